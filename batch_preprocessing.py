@@ -0,0 +1,204 @@
+import os
+import sys
+import glob
+import time
+import shutil
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from pipeline.engine import run_pipeline, PipelineStageError, stage_scripts
+from pipeline.stage_cache import StageCache
+
+# ==============================================================================
+# Batch preprocessing of many .conf files
+# ==============================================================================
+# Runs the preprocessing pipeline (pipeline/engine.py) for every configuration
+# file found in a directory, matched by a glob pattern, or listed in a manifest
+# file, spreading the configurations over a pool of worker processes.
+#
+# For each configuration a result bundle (handoff directory, see
+# pipeline/stage_io.py) is written to <output_dir>/<bundle_name>/. A failing
+# configuration is reported in the summary and does not stop the batch.
+#
+# usage: python batch_preprocessing.py SOURCE [SOURCE ...] [--workers N]
+#                                      [--output-dir DIR] [--no-cache]
+# example: python batch_preprocessing.py ./computation_examples --workers 4
+
+argErrCode = 20
+
+
+# ==============================================================================
+# STEP 1: Define function collecting configuration files
+# ==============================================================================
+def collect_conf_files(sources):
+    """
+    Expand directories, glob patterns and manifest files into .conf paths
+
+    - directory: all *.conf files below it (recursively)
+    - manifest: a file not ending in .conf, one path per line (# comments allowed),
+      relative paths are relative to the manifest's directory
+    - anything else: treated as a glob pattern (a plain path matches itself)
+
+    :param sources: List of directories, glob patterns or manifest files
+    :return: Sorted list of unique absolute .conf paths
+    """
+    conf_files = []
+    for source in sources:
+        if os.path.isdir(source):
+            conf_files.extend(glob.glob(os.path.join(source, "**", "*.conf"), recursive=True))
+        elif os.path.isfile(source) and not source.endswith(".conf"):
+            manifest_dir = os.path.dirname(os.path.abspath(source))
+            with open(source, "r") as fptr:
+                for line in fptr:
+                    line = line.split("#", 1)[0].strip()
+                    if line:
+                        conf_files.append(os.path.join(manifest_dir, line))
+        else:
+            conf_files.extend(glob.glob(source, recursive=True))
+
+    return sorted(set(os.path.abspath(conf_file) for conf_file in conf_files))
+
+
+def bundle_names(conf_files):
+    """
+    Unique, filesystem-safe bundle name for each configuration file
+
+    Names are the paths relative to the common parent directory, without the
+    .conf extension and with path separators replaced by "__".
+
+    :param conf_files: List of absolute .conf paths
+    :return: List of bundle names (same order)
+    """
+    if not conf_files:
+        return []
+    common_dir = os.path.commonpath([os.path.dirname(conf_file) for conf_file in conf_files])
+    names = []
+    for conf_file in conf_files:
+        relative = os.path.splitext(os.path.relpath(conf_file, common_dir))[0]
+        names.append(relative.replace(os.sep, "__"))
+    return names
+
+
+# ==============================================================================
+# STEP 2: Define worker function (runs in a pool process)
+# ==============================================================================
+def failure_summary(conf_file, bundle_dir, message):
+    """
+    Summary dictionary of a configuration that failed outside the pipeline
+
+    :param conf_file: Path to the .conf file
+    :param bundle_dir: Handoff directory of the configuration
+    :param message: Error message
+    :return: Summary dictionary in the format of preprocess_one()
+    """
+    return {"conf": conf_file, "bundle": bundle_dir, "status": "failed", "stage": "",
+            "returncode": 1, "message": message, "timings": {}, "num_pairs": 0, "total": 0.0}
+
+
+def preprocess_one(conf_file, bundle_dir, use_cache):
+    """
+    Run the pipeline for one configuration and never raise
+
+    :param conf_file: Path to the .conf file
+    :param bundle_dir: Handoff directory receiving the stage outputs
+    :param use_cache: Whether to use the shared StageCache
+    :return: Summary dictionary (conf, status, failed stage, return code, message, timings, total)
+    """
+    start = time.perf_counter()
+    summary = failure_summary(conf_file, bundle_dir, "")
+    summary.update(status="ok", returncode=0)
+    try:
+        # Drop stale stage files left in the bundle by a previous run
+        shutil.rmtree(bundle_dir, ignore_errors=True)
+        result = run_pipeline(conf_file, handoff_dir=bundle_dir,
+                              cache=StageCache() if use_cache else None)
+        summary["timings"] = result.timings
+        summary["num_pairs"] = len(result.atom_pairs)
+    except PipelineStageError as e:
+        summary.update(status="failed", stage=e.stage, returncode=e.returncode,
+                       message=str(e.message).strip())
+    except Exception as e:
+        summary.update(status="failed", returncode=1, message=f"{type(e).__name__}: {e}")
+    summary["total"] = time.perf_counter() - start
+    return summary
+
+
+# ==============================================================================
+# STEP 3: Define summary table output
+# ==============================================================================
+def format_summary(summaries):
+    """
+    Format the batch summary as a tab-separated table
+
+    :param summaries: List of dictionaries returned by preprocess_one()
+    :return: Table text, one header line and one line per configuration
+    """
+    stages = list(stage_scripts)
+    header = ["conf", "status", "failed_stage", "returncode", "num_pairs"] + \
+             [f"{stage}_s" for stage in stages] + ["total_s", "message"]
+    lines = ["\t".join(header)]
+    for summary in summaries:
+        row = [summary["conf"], summary["status"], summary["stage"], str(summary["returncode"]),
+               str(summary["num_pairs"])]
+        row += [f"{summary['timings'][stage]:.4f}" if stage in summary["timings"] else "" for stage in stages]
+        row += [f"{summary['total']:.4f}", " ".join(summary["message"].split())]
+        lines.append("\t".join(row))
+    return "\n".join(lines) + "\n"
+
+
+# ==============================================================================
+# STEP 4: Parse arguments and run the batch
+# ==============================================================================
+def main():
+    parser = argparse.ArgumentParser(description="Preprocess many .conf files in parallel")
+    parser.add_argument("sources", nargs="+", help="directories, glob patterns or manifest files")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--output-dir", default="./batch_output", help="directory receiving the result bundles")
+    parser.add_argument("--no-cache", action="store_true", help="do not use the stage cache")
+    args = parser.parse_args()
+
+    conf_files = collect_conf_files(args.sources)
+    if not conf_files:
+        print("no .conf files found", file=sys.stderr)
+        exit(argErrCode)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    names = bundle_names(conf_files)
+
+    print(f"Preprocessing {len(conf_files)} configurations with {args.workers} workers")
+    summaries = []
+    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        futures = {}
+        for conf_file, name in zip(conf_files, names):
+            bundle_dir = os.path.join(args.output_dir, name)
+            future = executor.submit(preprocess_one, conf_file, bundle_dir, not args.no_cache)
+            futures[future] = (conf_file, bundle_dir)
+        for future in as_completed(futures):
+            try:
+                summary = future.result()
+            except Exception as e:
+                # The worker process died (e.g. BrokenProcessPool), record the
+                # configuration as failed and keep collecting the others
+                conf_file, bundle_dir = futures[future]
+                summary = failure_summary(conf_file, bundle_dir, f"{type(e).__name__}: {e}")
+            summaries.append(summary)
+            print(f"  [{summary['status']}] {summary['conf']} ({summary['total']:.3f} s)")
+
+    # Keep the table in input order regardless of completion order
+    order = {conf_file: idx for idx, conf_file in enumerate(conf_files)}
+    summaries.sort(key=lambda summary: order[summary["conf"]])
+
+    table = format_summary(summaries)
+    summary_file = os.path.join(args.output_dir, "summary.tsv")
+    with open(summary_file, "w") as fptr:
+        fptr.write(table)
+
+    num_failed = sum(summary["status"] != "ok" for summary in summaries)
+    print(f"\n{len(summaries) - num_failed} succeeded, {num_failed} failed")
+    print(f"Summary written to {summary_file}")
+
+    exit(1 if num_failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+import numpy as np
+from dataclasses import dataclass
+
+from symmetry.group_structure import structure_of_representations, translation_denominator
+from hoppin_term_relations.orbit_of_space_group import PositionHash, site_symmetry
+
+# ==============================================================================
+# Integer atom indices and O(1) symmetry images of atoms
+# ==============================================================================
+# An atom of the crystal is a site j of the primitive cell (sublattice) in
+# cell n = (n0, n1, n2). The notes (notes/TB/symmetry_analysis_steps) name it
+# by its Wyckoff position (orbit of sites under the space group) and its
+# number within that orbit: AtomIndex(wyckoff_position, atom_number, n0, n1, n2).
+# For arrays of atoms the pair (site, cell) is packed into one integer key
+#   key = ((site * radix + n0 + cell_bound) * radix + n1 + cell_bound) * radix + n2 + cell_bound
+# with radix = 2 * cell_bound + 1.
+#
+# A space group operation g = (R|t) (primitive cell basis, fractional
+# coordinates y measured from the Bilbao origin) maps site j onto
+#   R y_j + t = y_perm[g, j] + shift[g, j]
+# (tables and Wyckoff orbits from site_symmetry(), orbit_of_space_group.py).
+# With these tables
+#   g (j, n) = (perm[g, j], R n + shift[g, j])
+# so apply_symmetry() is a table lookup and a 3x3 integer product. The
+# operations are the exact integer ones of the group structure
+# (symmetry/group_structure.py), listed modulo lattice translations: g fixes
+# an atom if it does so combined with some lattice translation, and fixes a
+# hopping (i, n_i) -> (j, n_j) if one translation fixes both atoms, i.e.
+#   perm[g, i] = i,  perm[g, j] = j,  R d + shift[g, j] - shift[g, i] = d   (d = n_j - n_i)
+
+# Largest absolute cell entry of an integer atom key
+cell_bound = 1023
+
+
+@dataclass(frozen=True)
+class AtomIndex:
+    """
+    One atom of the crystal (immutable and hashable)
+
+    wyckoff_position: orbit of the site under the space group (0, 1, ... in order of the sites)
+    atom_number: number of the site within its orbit
+    n0, n1, n2: cell of the atom
+    """
+    wyckoff_position: int
+    atom_number: int
+    n0: int
+    n1: int
+    n2: int
+
+    @property
+    def cell(self):
+        return (self.n0, self.n1, self.n2)
+
+
+# ==============================================================================
+# STEP 1: Define the integer encoding of (site, cell)
+# ==============================================================================
+def atom_keys(site, cell):
+    """
+    Encode atoms as single integers (mixed radix)
+
+    :param site: Site indices, shape (...)
+    :param cell: Cells, shape (..., 3), entries in [-cell_bound, cell_bound]
+    :return: int64 keys, shape (...)
+    :raises ValueError: If a cell entry exceeds cell_bound
+    """
+    cell = np.asarray(cell, dtype=np.int64)
+    if np.any(np.abs(cell) > cell_bound):
+        raise ValueError(f"cell entries must lie within +-{cell_bound}")
+    radix = 2 * cell_bound + 1
+    keys = np.asarray(site, dtype=np.int64)
+    for axis in range(3):
+        keys = keys * radix + cell[..., axis] + cell_bound
+    return keys
+
+
+def decode_atom_keys(keys):
+    """
+    Split integer atom keys into sites and cells (inverse of atom_keys())
+
+    :param keys: int64 keys, shape (...)
+    :return: tuple: (sites (...), cells (..., 3))
+    """
+    radix = 2 * cell_bound + 1
+    keys = np.asarray(keys, dtype=np.int64)
+    cell = np.empty(keys.shape + (3,), dtype=np.int64)
+    for axis in (2, 1, 0):
+        cell[..., axis] = keys % radix - cell_bound
+        keys = keys // radix
+    return keys, cell
+
+
+# ==============================================================================
+# STEP 2: Define the action of the space group on atoms
+# ==============================================================================
+class SymmetryHelper:
+    """
+    Space group action on the atoms of the crystal
+
+    :param group_structure: SpaceGroupStructure (exact integer operations in primitive cell basis)
+    :param atom_coordinates_frac_origin: Fractional site coordinates measured from the
+                                         space group origin, shape (N_atoms, 3)
+    :param atom_types: Atom type of every site, shape (N_atoms,) (None: images of any type match)
+    :raises ValueError: If an operation maps a site onto no site of the same atom type in the crystal
+    """
+
+    def __init__(self, group_structure, atom_coordinates_frac_origin, atom_types=None):
+        self.group_structure = group_structure
+        self.positions = np.asarray(atom_coordinates_frac_origin, dtype=float).reshape(-1, 3)
+        self.position_hash = PositionHash(self.positions)
+
+        # Exact operations as affine matrices (num_ops, 3, 4)
+        translations = np.asarray(group_structure.translations, dtype=float) / translation_denominator
+        matrices = np.concatenate([np.asarray(group_structure.rotations, dtype=float),
+                                   translations[:, :, np.newaxis]], axis=2)
+        self.site_symmetry = site_symmetry(matrices, self.positions, atom_types=atom_types)
+        self.rotations = self.site_symmetry.rotations
+        self.permutation = self.site_symmetry.permutation
+        self.shift = self.site_symmetry.shift
+
+        # Wyckoff position and number within it of every site, and the inverse map
+        self.wyckoff_position = self.site_symmetry.orbit_labels
+        self.atom_number = self.site_symmetry.atom_number
+        self.site_of_wyckoff = {(int(orbit), int(number)): site for site, (orbit, number)
+                                in enumerate(zip(self.wyckoff_position, self.atom_number))}
+
+    @classmethod
+    def from_pair_table(cls, pair_table, space_group_representations):
+        """
+        Helper for the atoms of a PairTable (output of find_neighbors())
+
+        :param pair_table: PairTable
+        :param space_group_representations: Output of generate_space_group_representations()
+        :return: SymmetryHelper
+        """
+        positions = pair_table.atom_coordinates_cart_cell_000 @ np.linalg.inv(pair_table.lattice_basis_primitive)
+        return cls(structure_of_representations(space_group_representations), positions, pair_table.atom_types)
+
+    def __len__(self):
+        """
+        Number of operations
+        """
+        return len(self.rotations)
+
+    @property
+    def num_atoms(self):
+        return len(self.positions)
+
+    # --------------------------------------------------------------------------
+    def atom_index(self, site, cell=(0, 0, 0)):
+        """
+        AtomIndex of a site in a cell
+        """
+        return AtomIndex(int(self.wyckoff_position[site]), int(self.atom_number[site]),
+                         int(cell[0]), int(cell[1]), int(cell[2]))
+
+    def site(self, atom):
+        """
+        Site index of an AtomIndex
+        """
+        return self.site_of_wyckoff[(atom.wyckoff_position, atom.atom_number)]
+
+    def apply_symmetry(self, atom, g):
+        """
+        Image of an atom under operation g
+
+        :param atom: AtomIndex
+        :param g: Operation index
+        :return: AtomIndex
+        """
+        site = self.site(atom)
+        cell = self.rotations[g] @ np.array(atom.cell, dtype=np.int64) + self.shift[g, site]
+        return self.atom_index(self.permutation[g, site], cell)
+
+    def compute_stabilizer(self, atom):
+        """
+        Operations fixing an atom (up to a lattice translation)
+
+        :param atom: AtomIndex
+        :return: Operation indices (sorted)
+        """
+        return self.site_symmetry.stabilizer(self.site(atom))
+
+    def compute_stabilizer_subset(self, center, neighbor):
+        """
+        Operations fixing both atoms of a hopping (with one common lattice translation)
+
+        :param center: AtomIndex
+        :param neighbor: AtomIndex
+        :return: Operation indices (sorted)
+        """
+        cell = np.array(neighbor.cell, dtype=np.int64) - np.array(center.cell, dtype=np.int64)
+        mask = self.pair_stabilizer_mask(self.site(center), self.site(neighbor), cell)
+        return np.nonzero(mask)[0]
+
+    def pair_stabilizer_mask(self, center_site, neighbor_site, neighbor_cell):
+        """
+        Which operations fix each pair (center in cell [0,0,0], neighbor in neighbor_cell)
+
+        :param center_site: Center sites, shape (...)
+        :param neighbor_site: Neighbor sites, shape (...)
+        :param neighbor_cell: Neighbor cells, shape (..., 3)
+        :return: bool array, shape (..., num_ops)
+        """
+        center_site = np.asarray(center_site, dtype=np.int64)[..., np.newaxis]
+        neighbor_site = np.asarray(neighbor_site, dtype=np.int64)[..., np.newaxis]
+        cell = np.asarray(neighbor_cell, dtype=np.int64)
+        ops = np.arange(len(self))
+        image_cell = (np.einsum("gab,...b->...ga", self.rotations, cell)
+                      + self.shift[ops, neighbor_site] - self.shift[ops, center_site])
+        cell = cell[..., np.newaxis, :]
+        return ((self.permutation[ops, center_site] == center_site)
+                & (self.permutation[ops, neighbor_site] == neighbor_site)
+                & np.all(image_cell == cell, axis=-1))
+
+    def apply_symmetry_keys(self, keys, g):
+        """
+        Images of integer atom keys (see atom_keys()) under operation g
+
+        :param keys: int64 keys, shape (...)
+        :param g: Operation index, or integer array broadcasting against keys
+        :return: int64 keys, shape of the broadcast
+        """
+        site, cell = decode_atom_keys(keys)
+        g = np.asarray(g, dtype=np.int64)
+        image_cell = np.einsum("...ab,...b->...a", self.rotations[g], cell) + self.shift[g, site]
+        return atom_keys(self.permutation[g, site], image_cell)
+
+    def atom_at(self, frac):
+        """
+        AtomIndex of the atom at fractional coordinates (measured from the space group origin)
+
+        :param frac: Fractional coordinates, shape (3,)
+        :return: AtomIndex, or None if no atom lies within the position tolerance
+        """
+        site, cell = self.position_hash.lookup(frac)
+        return None if site < 0 else self.atom_index(site, cell)
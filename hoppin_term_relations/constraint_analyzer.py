@@ -0,0 +1,374 @@
+import numpy as np
+from dataclasses import dataclass
+
+from hoppin_term_relations.forest import ROOT
+
+# ==============================================================================
+# Independent hopping parameters of the equivalence classes
+# ==============================================================================
+# The hopping block T (m x n) of a class, from the m orbitals of the center
+# atom i and the n orbitals of the neighbor atom j, must be invariant under
+# every operation h of the stabilizer subset of its reference hopping
+# (notes/TB/symmetry_analysis_steps: ConstraintAnalyzer):
+#   D_i(h) T D_j(h)^T = T   <=>   (D_i(h) kron D_j(h) - I) vec(T) = 0
+# with vec() row-major. The independent parameters span the null space of
+# the stacked constraint rows of all h.
+#
+# Instead of one Gaussian elimination per class, the classes are grouped by
+# block shape (m, n) and every group is solved in two batched LAPACK calls:
+#   - the stacked constraints C of a class enter only through the Gram matrix
+#       C^T C = sum_h (K_h^T K_h - K_h - K_h^T + I),   K_h = D_i(h) kron D_j(h),
+#     with K_h^T K_h = (D_i^T D_i) kron (D_j^T D_j) (the f orbital matrices
+#     are not orthogonal in the basis of the f kernel, so this is not I),
+#     which is (mn x mn) whatever the size of the stabilizer, so the
+#     stabilizers are summed with a 0/1 mask in one einsum and no padding
+#     to the largest stabilizer is needed
+#   - one batched eigh of the Gram matrices (the symmetric SVD of C) gives
+#     the null space: eigenvectors of eigenvalue <= tolerance
+# The orthonormal null space bases are then brought to reduced row echelon
+# form (batched over all classes of one shape and nullity) and entries within
+# the tolerance of an integer are snapped to it. The pivot columns are the
+# independent parameters: orbital elements T[a, b] that can be chosen freely,
+# every other element is a fixed combination of them (row p of the basis is
+# T for parameter p equal to 1 and all others 0).
+#
+# With a forest of classes (forest.py) only the roots are solved (the other
+# classes follow from them), and a root equivalent to its own conjugate
+# through an operation g (hopping i -> j mapped onto j -> i) gets the
+# hermiticity constraint T^T = D_i(g) T D_j(g)^T as one more set of rows,
+#   (K_g - S) vec(T) = 0,   S vec(T) = vec(T^T)
+
+# Eigenvalue of the constraint Gram matrix below which a direction is free
+null_space_tolerance = 1e-8
+
+
+@dataclass
+class IndependentParameters:
+    """
+    Independent parameters of every equivalence class
+
+    block_shape: (num_classes, 2) orbitals (m, n) of center and neighbor
+    num_parameters: (num_classes,) number of independent parameters of each class
+    parameter_offset: (num_classes + 1,) first parameter of each class in the parameter vector
+    parameter_orbitals: (num_parameters_total, 2) orbital element (a, b) of T chosen as each parameter
+    bases: list of (num_parameters, m, n) arrays, block T of each parameter set to 1
+    stabilizer_size: (num_classes,) number of operations in the stabilizer subset
+    """
+    block_shape: np.ndarray
+    num_parameters: np.ndarray
+    parameter_offset: np.ndarray
+    parameter_orbitals: np.ndarray
+    bases: list
+    stabilizer_size: np.ndarray
+
+    def __len__(self):
+        return len(self.num_parameters)
+
+    def total_parameters(self):
+        return int(self.parameter_offset[-1])
+
+    def parameters_of_class(self, class_id):
+        """
+        Orbital elements (a, b) of the independent parameters of one class
+        """
+        start, stop = self.parameter_offset[class_id], self.parameter_offset[class_id + 1]
+        return [tuple(int(value) for value in orbitals) for orbitals in self.parameter_orbitals[start:stop]]
+
+    def hopping_block(self, class_id, values):
+        """
+        Hopping block of the reference hopping for given parameter values
+
+        :param class_id: Class index
+        :param values: Values of the independent parameters of the class, shape (num_parameters,)
+        :return: Block T, shape (m, n)
+        """
+        return np.einsum("p,pab->ab", np.asarray(values, dtype=float), self.bases[class_id])
+
+
+# ==============================================================================
+# STEP 1: Define the batched linear algebra
+# ==============================================================================
+def kron_stack(left, right):
+    """
+    Kronecker products of stacks of matrices
+
+    :param left: Shape (..., m, m)
+    :param right: Shape (..., n, n)
+    :return: left kron right, shape (..., m*n, m*n)
+    """
+    m, n = left.shape[-1], right.shape[-1]
+    product = np.einsum("...ab,...de->...adbe", left, right)
+    return product.reshape(left.shape[:-2] + (m * n, m * n))
+
+
+def weighted_kron_sum(weights, left, right):
+    """
+    Weighted sums of Kronecker products over the operations, as one batched matmul
+
+    :param weights: Shape (C, G)
+    :param left: Shape (C, G, m, m)
+    :param right: Shape (C, G, n, n)
+    :return: sum_g weights[c, g] * (left[c, g] kron right[c, g]), shape (C, m*n, m*n)
+    """
+    num_classes, num_ops, m, _ = left.shape
+    n = right.shape[-1]
+    weighted_left = (left * weights[:, :, np.newaxis, np.newaxis]).reshape(num_classes, num_ops, m * m)
+    # (C, m*m, n*n): entry [(a, b), (d, e)] = sum_g w L_ab R_de
+    product = np.swapaxes(weighted_left, 1, 2) @ right.reshape(num_classes, num_ops, n * n)
+    return product.reshape(num_classes, m, m, n, n).transpose(0, 1, 3, 2, 4).reshape(num_classes, m * n, m * n)
+
+
+def reduced_row_echelon(rows, tolerance=null_space_tolerance):
+    """
+    Batched Gauss-Jordan elimination with partial pivoting
+
+    Only the members with a pivot in the current column are updated, and
+    only from that column on: the earlier entries of a row that is not a
+    pivot row yet are zero within the tolerance. The loop stops as soon as
+    every member has r pivots.
+
+    :param rows: Stack of full-rank row sets, shape (B, r, k)
+    :param tolerance: Entries of absolute value <= tolerance are treated as zero
+    :return: tuple: (reduced rows (B, r, k), pivot column of each row (B, r))
+    """
+    rows = np.array(rows, dtype=float)
+    num_batch, num_rows, num_cols = rows.shape
+    pivots = np.full((num_batch, num_rows), -1, dtype=np.int64)
+    next_row = np.zeros(num_batch, dtype=np.int64)
+    active = np.arange(num_batch)
+
+    for col in range(num_cols):
+        active = active[next_row[active] < num_rows]
+        if len(active) == 0:
+            break
+        # Largest entry of the column among the rows not used as pivots yet
+        magnitude = np.where(np.arange(num_rows) >= next_row[active, np.newaxis],
+                             np.abs(rows[active, :, col]), -1.0)
+        pivot_row = np.argmax(magnitude, axis=1)
+        found = magnitude[np.arange(len(active)), pivot_row] > tolerance
+        if not np.any(found):
+            continue
+        b, target, source = active[found], next_row[active[found]], pivot_row[found]
+
+        # Swap the pivot row into place and normalize it
+        rows[b, target], rows[b, source] = rows[b, source], rows[b, target].copy()
+        rows[b, target, col:] /= rows[b, target, col][:, np.newaxis]
+
+        # Clear the column in all other rows of these members
+        pivot_rows = rows[b, target, col:]
+        factors = rows[b, :, col]
+        factors[np.arange(len(b)), target] = 0.0
+        rows[b, :, col:] -= factors[:, :, np.newaxis] * pivot_rows[:, np.newaxis, :]
+
+        pivots[b, target] = col
+        next_row[b] += 1
+    return rows, pivots
+
+
+def snap_entries(values, tolerance=null_space_tolerance):
+    """
+    Replace entries within the tolerance of an integer by that integer
+    """
+    nearest = np.round(values)
+    return np.where(np.abs(values - nearest) <= tolerance, nearest, values)
+
+
+def null_space_bases(gram, tolerance=null_space_tolerance):
+    """
+    Canonical null space bases of a stack of constraint Gram matrices
+
+    :param gram: Positive semi-definite matrices C^T C, shape (B, k, k)
+    :param tolerance: Eigenvalue threshold
+    :return: tuple: (list of (r_b, k) bases in reduced row echelon form, list of (r_b,) pivot columns)
+    """
+    num_batch, k = gram.shape[0], gram.shape[-1]
+    eigenvalues, eigenvectors = np.linalg.eigh(gram)
+    nullity = np.sum(eigenvalues <= tolerance, axis=1)
+
+    bases, pivots = [None] * num_batch, [None] * num_batch
+    # Eigenvalues come in ascending order: the first nullity eigenvectors span the null space
+    for r in np.unique(nullity):
+        members = np.nonzero(nullity == r)[0]
+        rows = np.swapaxes(eigenvectors[members, :, :r], 1, 2)
+        if r == k:
+            # No constraint (e.g. trivial stabilizer): every element is a parameter
+            reduced = np.broadcast_to(np.eye(k), (len(members), k, k))
+            pivot_cols = np.broadcast_to(np.arange(k), (len(members), k))
+        elif r > 0:
+            reduced, pivot_cols = reduced_row_echelon(rows, tolerance)
+        else:
+            reduced, pivot_cols = rows, np.zeros((len(members), 0), dtype=np.int64)
+        reduced = snap_entries(reduced, tolerance)
+        for index, member in enumerate(members):
+            bases[member] = reduced[index].reshape(r, k)
+            pivots[member] = pivot_cols[index]
+    return bases, pivots
+
+
+# ==============================================================================
+# STEP 2: Define the analyzer
+# ==============================================================================
+def site_orbital_representations(pair_table, orbital_completion, num_ops):
+    """
+    Orbital representation matrices of every site of a PairTable
+
+    :param pair_table: PairTable
+    :param orbital_completion: Output of complete_orbitals()
+    :param num_ops: Number of operations
+    :return: List of arrays (num_ops, d, d), indexed by site
+    """
+    representations = orbital_completion["representations_on_active_orbitals"]
+    site_representations = []
+    for position_name in pair_table.atom_position_names:
+        matrices = np.asarray(representations[position_name], dtype=float)
+        if matrices.size == 0:
+            matrices = np.zeros((num_ops, 0, 0))
+        site_representations.append(matrices)
+    return site_representations
+
+
+class ConstraintAnalyzer:
+    """
+    Independent hopping parameters from the stabilizer constraints
+
+    :param symmetry_helper: SymmetryHelper of the atoms
+    :param site_representations: Orbital representation of every site, list of (num_ops, d, d)
+    :param tolerance: Eigenvalue threshold of the null spaces
+    """
+
+    def __init__(self, symmetry_helper, site_representations, tolerance=null_space_tolerance):
+        self.symmetry_helper = symmetry_helper
+        self.site_representations = site_representations
+        self.tolerance = tolerance
+        self.orbital_counts = np.array([matrices.shape[-1] for matrices in site_representations], dtype=np.int64)
+
+    @classmethod
+    def from_equivalence_classes(cls, classes, orbital_completion, tolerance=null_space_tolerance):
+        """
+        Analyzer for the atoms of an EquivalenceClasses partition
+
+        :param classes: EquivalenceClasses
+        :param orbital_completion: Output of complete_orbitals()
+        :return: ConstraintAnalyzer
+        """
+        helper = classes.symmetry_helper
+        return cls(helper, site_orbital_representations(classes.table, orbital_completion, len(helper)), tolerance)
+
+    # --------------------------------------------------------------------------
+    def compute_constraint_matrix(self, center_site, neighbor_site, neighbor_cell):
+        """
+        Stacked constraint rows (D_i(h) kron D_j(h) - I) of one hopping
+
+        :param center_site: Center site (cell [0,0,0])
+        :param neighbor_site: Neighbor site
+        :param neighbor_cell: Neighbor cell, shape (3,)
+        :return: Constraint matrix, shape (|H| * m*n, m*n) for the stabilizer subset H
+        """
+        stabilizer = np.nonzero(self.symmetry_helper.pair_stabilizer_mask(center_site, neighbor_site,
+                                                                          neighbor_cell))[0]
+        left = self.site_representations[center_site][stabilizer]
+        right = self.site_representations[neighbor_site][stabilizer]
+        size = left.shape[-1] * right.shape[-1]
+        return (kron_stack(left, right) - np.eye(size)).reshape(-1, size)
+
+    def find_independent_parameters(self, constraint_matrix, num_neighbor_orbitals):
+        """
+        Independent parameters of one constraint matrix
+
+        :param constraint_matrix: Shape (rows, m*n)
+        :param num_neighbor_orbitals: n
+        :return: tuple: (list of orbital elements (a, b), basis (num_parameters, m*n))
+        """
+        gram = np.asarray(constraint_matrix, dtype=float).T @ np.asarray(constraint_matrix, dtype=float)
+        bases, pivots = null_space_bases(gram[np.newaxis], self.tolerance)
+        parameters = [tuple(int(value) for value in divmod(int(col), num_neighbor_orbitals)) for col in pivots[0]]
+        return parameters, bases[0]
+
+    def gaussian_elimination(self, matrix):
+        """
+        Reduced row echelon form of a matrix of full row rank (with pivot columns)
+        """
+        reduced, pivots = reduced_row_echelon(np.asarray(matrix, dtype=float)[np.newaxis], self.tolerance)
+        return reduced[0], pivots[0]
+
+    # --------------------------------------------------------------------------
+    def stabilizer_gram(self, center_site, neighbor_site, stabilizer_mask, hermitian_operation=None):
+        """
+        Gram matrices C^T C of the constraints of classes with a common block shape
+
+        :param center_site: Center sites, shape (C,)
+        :param neighbor_site: Neighbor sites, shape (C,)
+        :param stabilizer_mask: Stabilizer subsets, shape (C, num_ops)
+        :param hermitian_operation: Operation mapping each hopping onto its conjugate, -1 for none, shape (C,)
+        :return: Shape (C, m*n, m*n)
+        """
+        left = np.stack([self.site_representations[site] for site in center_site])
+        right = np.stack([self.site_representations[site] for site in neighbor_site])
+        m, n = left.shape[-1], right.shape[-1]
+        weights = stabilizer_mask.astype(float)
+        kron_sum = weighted_kron_sum(weights, left, right)
+        left_square = np.swapaxes(left, -1, -2) @ left
+        right_square = np.swapaxes(right, -1, -2) @ right
+        square_sum = weighted_kron_sum(weights, left_square, right_square)
+        identity = weights.sum(axis=1)[:, np.newaxis, np.newaxis] * np.eye(m * n)
+        gram = square_sum - kron_sum - np.swapaxes(kron_sum, 1, 2) + identity
+
+        selected = np.nonzero(hermitian_operation >= 0)[0] if hermitian_operation is not None else []
+        if len(selected):
+            # The conjugate has the atoms swapped, so m = n; S permutes vec(T) into vec(T^T)
+            g = hermitian_operation[selected]
+            swap = np.eye(m * n)[np.arange(m * n).reshape(m, n).T.reshape(-1)]
+            difference = kron_stack(left[selected, g], right[selected, g]) - swap
+            gram[selected] += np.swapaxes(difference, 1, 2) @ difference
+        return gram
+
+    def solve(self, classes, forest=None):
+        """
+        Independent parameters of all classes, batched by block shape
+
+        :param classes: EquivalenceClasses
+        :param forest: Forest of the classes; if given, only roots get parameters,
+                       with the hermiticity constraint of self-conjugate roots
+        :return: IndependentParameters
+        """
+        table = classes.table
+        reference = classes.reference_pair
+        center = table.center_atom_index[reference].astype(np.int64)
+        neighbor = table.neighbor_atom_index[reference].astype(np.int64)
+        stabilizer_mask = self.symmetry_helper.pair_stabilizer_mask(center, neighbor,
+                                                                    table.neighbor_cell[reference])
+        block_shape = np.stack([self.orbital_counts[center], self.orbital_counts[neighbor]], axis=1)
+
+        num_classes = len(reference)
+        bases, pivots = [None] * num_classes, [None] * num_classes
+        shapes, shape_of_class = np.unique(block_shape.reshape(-1, 2), axis=0, return_inverse=True)
+        shape_of_class = shape_of_class.reshape(-1)
+        solved = np.ones(num_classes, dtype=bool) if forest is None else forest.vertex_type == ROOT
+        hermitian_operation = None if forest is None else forest.hermitian_operation
+        for shape_id, (m, n) in enumerate(shapes):
+            members = np.nonzero(shape_of_class == shape_id)[0]
+            unsolved = members if m * n == 0 else members[~solved[members]]
+            for member in unsolved:
+                bases[member] = np.zeros((0, m, n))
+                pivots[member] = np.zeros(0, dtype=np.int64)
+            members = members[solved[members]]
+            if m * n == 0 or len(members) == 0:
+                continue
+            gram = self.stabilizer_gram(center[members], neighbor[members], stabilizer_mask[members],
+                                        None if hermitian_operation is None else hermitian_operation[members])
+            group_bases, group_pivots = null_space_bases(gram, self.tolerance)
+            for member, basis, pivot_cols in zip(members, group_bases, group_pivots):
+                bases[member] = basis.reshape(-1, m, n)
+                pivots[member] = pivot_cols
+
+        num_parameters = np.array([len(pivot_cols) for pivot_cols in pivots], dtype=np.int64)
+        pivot_cols = np.concatenate(pivots + [np.zeros(0, dtype=np.int64)]).astype(np.int64)
+        columns = np.maximum(np.repeat(block_shape[:, 1], num_parameters), 1)
+        return IndependentParameters(
+            block_shape=block_shape,
+            num_parameters=num_parameters,
+            parameter_offset=np.concatenate([[0], np.cumsum(num_parameters)]).astype(np.int64),
+            parameter_orbitals=np.stack([pivot_cols // columns, pivot_cols % columns], axis=1),
+            bases=bases,
+            stabilizer_size=stabilizer_mask.sum(axis=1).astype(np.int64),
+        )
@@ -0,0 +1,208 @@
+import numpy as np
+from dataclasses import dataclass
+
+# ==============================================================================
+# Tolerance-aware clustering of pair distances into shells
+# ==============================================================================
+# Distances of symmetry-equivalent pairs agree only up to floating-point
+# noise (e.g. fractional coordinates 0.33333333 / 0.66666666). Rounding to a
+# fixed number of digits can put such a noise band across a rounding
+# boundary and split one physical shell in two.
+#
+# Instead the distances are sorted and a new shell starts wherever two
+# consecutive sorted distances differ by more than
+#   tolerance = atol + rtol * distance
+# (single-linkage clustering in one dimension). Every step is vectorized.
+# Besides the shell index of each pair, the boundaries (smallest / largest
+# member), multiplicities and the gap to the next shell are recorded; a gap
+# not much larger than the tolerance means two shells are nearly degenerate,
+# a small margin between a cutoff and a shell boundary means the cutoff is
+# ill-placed.
+
+# Default absolute / relative tolerance of the shell clustering
+default_shell_atol = 1e-6
+default_shell_rtol = 0.0
+
+
+@dataclass
+class DistanceShells:
+    """
+    Distance shells of a set of pairs, sorted by increasing distance
+
+    shell_index: (P,) shell of each pair
+    shell_distances: (num_shells,) mean distance of each shell
+    shell_lower: (num_shells,) smallest distance in each shell
+    shell_upper: (num_shells,) largest distance in each shell
+    multiplicities: (num_shells,) number of pairs in each shell
+    gap_to_next: (num_shells,) shell_lower of the next shell minus shell_upper (inf for the last shell)
+    """
+    shell_index: np.ndarray
+    shell_distances: np.ndarray
+    shell_lower: np.ndarray
+    shell_upper: np.ndarray
+    multiplicities: np.ndarray
+    gap_to_next: np.ndarray
+
+    def __len__(self):
+        return len(self.shell_distances)
+
+    def cutoff_margin(self, cutoff):
+        """
+        Distance between a cutoff radius and the nearest shell boundary
+
+        :param cutoff: Cartesian cutoff radius
+        :return: Smallest |cutoff - shell_lower| or |cutoff - shell_upper| (inf without shells)
+        """
+        if len(self) == 0:
+            return np.inf
+        boundaries = np.concatenate([self.shell_lower, self.shell_upper])
+        return float(np.min(np.abs(boundaries - cutoff)))
+
+    def truncated(self, num_shells):
+        """
+        The first num_shells shells and the pairs in them
+
+        gap_to_next of the last kept shell still refers to the first dropped shell.
+
+        :param num_shells: Number of shells to keep
+        :return: DistanceShells
+        """
+        keep = self.shell_index < num_shells
+        return DistanceShells(
+            shell_index=self.shell_index[keep],
+            shell_distances=self.shell_distances[:num_shells],
+            shell_lower=self.shell_lower[:num_shells],
+            shell_upper=self.shell_upper[:num_shells],
+            multiplicities=self.multiplicities[:num_shells],
+            gap_to_next=self.gap_to_next[:num_shells],
+        )
+
+
+def cluster_distances(distances, atol=default_shell_atol, rtol=default_shell_rtol):
+    """
+    Cluster distances into shells by sorting and splitting at gaps larger than the tolerance
+
+    :param distances: Pair distances, shape (P,)
+    :param atol: Absolute tolerance
+    :param rtol: Relative tolerance (multiplies the larger of two neighboring distances)
+    :return: DistanceShells
+    :raises ValueError: If a tolerance is negative
+    """
+    if atol < 0 or rtol < 0:
+        raise ValueError(f"shell tolerances must be non-negative, got atol={atol}, rtol={rtol}")
+
+    distances = np.asarray(distances, dtype=float).reshape(-1)
+    if len(distances) == 0:
+        empty = np.zeros(0)
+        return DistanceShells(np.zeros(0, dtype=np.int64), empty, empty, empty, np.zeros(0, dtype=np.int64), empty)
+
+    order = np.argsort(distances, kind="stable")
+    sorted_distances = distances[order]
+
+    # A new shell starts after every gap larger than the tolerance
+    gaps = np.diff(sorted_distances)
+    breaks = gaps > atol + rtol * sorted_distances[1:]
+    sorted_shell_index = np.concatenate([[0], np.cumsum(breaks)]).astype(np.int64)
+
+    shell_index = np.empty(len(distances), dtype=np.int64)
+    shell_index[order] = sorted_shell_index
+
+    # First / one-past-last sorted position of each shell
+    starts = np.concatenate([[0], np.nonzero(breaks)[0] + 1])
+    ends = np.append(starts[1:], len(distances))
+
+    multiplicities = np.bincount(sorted_shell_index)
+    shell_sums = np.bincount(sorted_shell_index, weights=sorted_distances)
+    shell_lower = sorted_distances[starts]
+    shell_upper = sorted_distances[ends - 1]
+    gap_to_next = np.append(shell_lower[1:] - shell_upper[:-1], np.inf)
+
+    return DistanceShells(
+        shell_index=shell_index,
+        shell_distances=shell_sums / multiplicities,
+        shell_lower=shell_lower,
+        shell_upper=shell_upper,
+        multiplicities=multiplicities,
+        gap_to_next=gap_to_next,
+    )
+
+
+class ShellHistogram:
+    """
+    Running distance shell histogram for pairs that arrive in blocks
+
+    Each shell is kept as an interval [lower, upper] with its pair count and
+    distance sum. Adding a block merges its distances into the intervals by
+    the same sort-and-gap rule as cluster_distances(), so after all blocks the
+    shells equal those of clustering all distances at once, without keeping
+    the distances.
+
+    :param atol: Absolute tolerance
+    :param rtol: Relative tolerance
+    """
+
+    def __init__(self, atol=default_shell_atol, rtol=default_shell_rtol):
+        if atol < 0 or rtol < 0:
+            raise ValueError(f"shell tolerances must be non-negative, got atol={atol}, rtol={rtol}")
+        self.atol = atol
+        self.rtol = rtol
+        self.lower = np.zeros(0)
+        self.upper = np.zeros(0)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.sums = np.zeros(0)
+
+    def __len__(self):
+        return len(self.lower)
+
+    def num_pairs(self):
+        return int(self.counts.sum())
+
+    def add(self, distances):
+        """
+        Merge a block of distances into the histogram
+
+        :param distances: Pair distances, shape (P,)
+        """
+        distances = np.asarray(distances, dtype=float).reshape(-1)
+        if len(distances) == 0:
+            return
+
+        # Existing shells and new distances as intervals, sorted by lower end
+        lower = np.concatenate([self.lower, distances])
+        upper = np.concatenate([self.upper, distances])
+        counts = np.concatenate([self.counts, np.ones(len(distances), dtype=np.int64)])
+        sums = np.concatenate([self.sums, distances])
+        order = np.argsort(lower, kind="stable")
+        lower, upper, counts, sums = lower[order], upper[order], counts[order], sums[order]
+
+        # New shell wherever the next interval starts beyond the tolerance of everything before it
+        reach = np.maximum.accumulate(upper)
+        breaks = lower[1:] - reach[:-1] > self.atol + self.rtol * lower[1:]
+        starts = np.concatenate([[0], np.nonzero(breaks)[0] + 1])
+
+        self.lower = lower[starts]
+        self.upper = np.maximum.reduceat(upper, starts)
+        self.counts = np.add.reduceat(counts, starts)
+        self.sums = np.add.reduceat(sums, starts)
+
+    def shell_index(self, distances):
+        """
+        Shell of each distance (the distances must have been added)
+        """
+        return np.searchsorted(self.lower, np.asarray(distances, dtype=float), side="right") - 1
+
+    def shells(self, next_shell_lower=np.inf):
+        """
+        DistanceShells of the histogram (without per-pair shell indices)
+
+        :param next_shell_lower: Lower end of the shell after the last one, if known
+        :return: DistanceShells with an empty shell_index
+        """
+        return DistanceShells(
+            shell_index=np.zeros(0, dtype=np.int64),
+            shell_distances=self.sums / np.maximum(self.counts, 1),
+            shell_lower=self.lower.copy(),
+            shell_upper=self.upper.copy(),
+            multiplicities=self.counts.copy(),
+            gap_to_next=np.append(self.lower[1:] - self.upper[:-1], next_shell_lower - self.upper[-1:]),
+        )
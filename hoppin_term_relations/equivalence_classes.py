@@ -0,0 +1,286 @@
+import numpy as np
+from dataclasses import dataclass, field
+
+from hoppin_term_relations.irreducible_pairs import IrreduciblePairs, pair_images, pair_keys
+from hoppin_term_relations.atom_index import AtomIndex, SymmetryHelper
+
+# ==============================================================================
+# Equivalence classes of hoppings
+# ==============================================================================
+# A hopping is a pair of the neighbor table: from the neighbor atom j in cell
+# n to the center atom i in cell [0,0,0]. Two hoppings with the same center
+# are equivalent if an operation of the site stabilizer of the center maps
+# one onto the other (notes/TB/symmetry_analysis_steps: EquivalenceClass,
+# EquivalenceClassBuilder). Hoppings of different centers are related later,
+# through the forest of classes.
+#
+# Instead of testing every pair against every operation and every other pair,
+# all pairs are mapped through all operations at once (pair_images()) and
+# the images are encoded as integer keys. A sorted key table turns every
+# image into the row of its pair (or "not in the table", e.g. for the cube of
+# cells of a skewed lattice), which gives an image matrix (num_pairs, num_ops);
+# operations outside the stabilizer of the center are masked. Every member of
+# a class sees the same in-table images, so the row minimum labels the class
+# and is its reference hopping. The operation relating the reference to each
+# member is read from the reference's row. Cost: O(pairs * ops) time; the
+# image matrix is built in blocks of rows to bound the memory.
+
+# Number of pairs whose images are held at once
+image_block_size = 1 << 16
+
+
+@dataclass(frozen=True)
+class Hopping:
+    """
+    Hopping from from_atom to to_atom (to_atom is the center, in cell [0,0,0])
+
+    space_group_element_id: operation mapping the reference hopping of the class onto this one
+    """
+    to_atom: AtomIndex
+    from_atom: AtomIndex
+    space_group_element_id: int
+
+    def conjugate(self):
+        """
+        Atoms of the reverse hopping: (from_atom, to_atom)
+        """
+        return self.from_atom, self.to_atom
+
+
+@dataclass
+class EquivalenceClass:
+    """
+    Symmetry-equivalent hoppings with a common center atom
+
+    id: (wyckoff_position, atom_number, class index) of the class
+    """
+    id: tuple
+    center_atom: AtomIndex
+    reference_hopping: Hopping
+    distance: float
+    hoppings: list = field(default_factory=list)
+
+    def size(self):
+        return len(self.hoppings)
+
+    def contains(self, hopping):
+        return any(member.to_atom == hopping.to_atom and member.from_atom == hopping.from_atom
+                   for member in self.hoppings)
+
+
+# ==============================================================================
+# STEP 1: Define the columnar partition of a pair table
+# ==============================================================================
+class EquivalenceClasses:
+    """
+    Partition of all pairs of a PairTable into equivalence classes
+
+    :param table: PairTable of all pairs (the members)
+    :param symmetry_helper: SymmetryHelper of the atoms of the table
+    :param class_of_pair: Class of every pair, shape (P,)
+    :param operation: Operation mapping the reference pair of its class onto every pair, shape (P,)
+    :param reference_pair: Row of the reference pair of every class, shape (num_classes,)
+    """
+
+    def __init__(self, table, symmetry_helper, class_of_pair, operation, reference_pair):
+        self.table = table
+        self.symmetry_helper = symmetry_helper
+        self.class_of_pair = np.asarray(class_of_pair, dtype=np.int64)
+        self.operation = np.asarray(operation, dtype=np.int64)
+        self.reference_pair = np.asarray(reference_pair, dtype=np.int64)
+
+        # Class index within the classes of the same center atom
+        center = self.center_site
+        order = np.argsort(center, kind="stable")
+        first = np.searchsorted(center[order], center[order], side="left")
+        self.class_index = np.empty(len(center), dtype=np.int64)
+        self.class_index[order] = np.arange(len(center)) - first
+
+    def __len__(self):
+        """
+        Number of classes
+        """
+        return len(self.reference_pair)
+
+    @property
+    def center_site(self):
+        """
+        Center site of every class, shape (num_classes,)
+        """
+        return self.table.center_atom_index[self.reference_pair].astype(np.int64)
+
+    @property
+    def distance(self):
+        """
+        Hopping distance of every class, shape (num_classes,)
+        """
+        return self.table.distance[self.reference_pair]
+
+    def class_sizes(self):
+        return np.bincount(self.class_of_pair, minlength=len(self))
+
+    def members(self, class_id):
+        """
+        Rows of the pairs in one class (reference first, then in table order)
+        """
+        rows = np.nonzero(self.class_of_pair == class_id)[0]
+        reference = self.reference_pair[class_id]
+        return np.concatenate([[reference], rows[rows != reference]])
+
+    def ids(self):
+        """
+        (wyckoff_position, atom_number, class index) of every class, shape (num_classes, 3)
+        """
+        site_symmetry = self.symmetry_helper.site_symmetry
+        center = self.center_site
+        return np.stack([site_symmetry.orbit_labels[center], site_symmetry.atom_number[center],
+                         self.class_index], axis=1)
+
+    # --------------------------------------------------------------------------
+    def hopping(self, row):
+        """
+        Hopping of one pair of the table
+        """
+        helper = self.symmetry_helper
+        return Hopping(to_atom=helper.atom_index(int(self.table.center_atom_index[row])),
+                       from_atom=helper.atom_index(int(self.table.neighbor_atom_index[row]),
+                                                   self.table.neighbor_cell[row].astype(np.int64)),
+                       space_group_element_id=int(self.operation[row]))
+
+    def equivalence_class(self, class_id):
+        """
+        One class as an EquivalenceClass of Hopping objects (built on demand)
+        """
+        rows = self.members(class_id)
+        hoppings = [self.hopping(row) for row in rows]
+        return EquivalenceClass(id=tuple(int(value) for value in self.ids()[class_id]),
+                                center_atom=hoppings[0].to_atom, reference_hopping=hoppings[0],
+                                distance=float(self.distance[class_id]), hoppings=hoppings)
+
+    def equivalence_class_list(self):
+        """
+        All classes as EquivalenceClass objects
+        """
+        return [self.equivalence_class(class_id) for class_id in range(len(self))]
+
+
+# ==============================================================================
+# STEP 2: Define the builder
+# ==============================================================================
+class EquivalenceClassBuilder:
+    """
+    Partition the neighbor pairs into equivalence classes of hoppings
+
+    :param pair_table: Output of find_neighbors() (PairTable, or IrreduciblePairs which is expanded)
+    :param space_group_representations: Output of generate_space_group_representations()
+    """
+
+    def __init__(self, pair_table, space_group_representations):
+        if isinstance(pair_table, IrreduciblePairs):
+            pair_table = pair_table.expand()[0]
+        self.table = pair_table
+        self.symmetry_helper = SymmetryHelper.from_pair_table(pair_table, space_group_representations)
+        self.classes = None
+
+    def pair_rows(self, center, neighbor, cell):
+        """
+        Rows of pairs in the table (after build_all_equivalence_classes())
+
+        :param center: Center sites, shape (...)
+        :param neighbor: Neighbor sites, shape (...)
+        :param cell: Neighbor cells, shape (..., 3), entries within cell_bound
+        :return: Rows, shape (...); len(table) for pairs not in the table
+        """
+        keys = pair_keys(center, neighbor, cell, self.table.num_atoms, self.cell_bound)
+        positions = np.minimum(np.searchsorted(self.sorted_keys, keys), len(self.sorted_keys) - 1)
+        return np.where(self.sorted_keys[positions] == keys, self.key_order[positions], len(self.table))
+
+    def image_index(self, rows, stabilizer_only=True):
+        """
+        Row of the image of every pair under every operation (re-centered in cell [0,0,0])
+
+        :param rows: Pair rows, shape (B,)
+        :param stabilizer_only: Keep only operations fixing the center of each pair
+        :return: Image rows, shape (B, num_ops); len(table) where the image is not in
+                 the table or (stabilizer_only) the operation does not fix the center
+        """
+        table = self.table
+        helper = self.symmetry_helper
+        center, neighbor, cell = pair_images(table.center_atom_index[rows], table.neighbor_atom_index[rows],
+                                             table.neighbor_cell[rows], helper.rotations, helper.permutation,
+                                             helper.shift)
+        image_rows = self.pair_rows(center, neighbor, cell)
+        if stabilizer_only:
+            image_rows[center != table.center_atom_index[rows, np.newaxis]] = len(table)
+        return image_rows
+
+    def build_all_equivalence_classes(self):
+        """
+        Partition all pairs of the table
+
+        :return: EquivalenceClasses
+        """
+        table = self.table
+        helper = self.symmetry_helper
+        num_pairs = len(table)
+
+        # Keys must hold every image cell: |R n + shift_j - shift_i| <= |R|_row * max|n| + 2 max|shift|
+        max_cell = int(np.abs(table.neighbor_cell).max(initial=0))
+        self.cell_bound = int(np.abs(helper.rotations).sum(axis=2).max(initial=1) * max_cell
+                              + 2 * np.abs(helper.shift).max(initial=0))
+        keys = pair_keys(table.center_atom_index, table.neighbor_atom_index, table.neighbor_cell,
+                         table.num_atoms, self.cell_bound)
+        self.key_order = np.argsort(keys, kind="stable")
+        self.sorted_keys = keys[self.key_order]
+
+        # Row minimum of the image matrix (smallest in-table image), block by block
+        class_minimum = np.empty(num_pairs, dtype=np.int64)
+        for start in range(0, num_pairs, image_block_size):
+            rows = np.arange(start, min(start + image_block_size, num_pairs))
+            class_minimum[rows] = self.image_index(rows).min(axis=1)
+
+        reference_pair, class_of_pair = np.unique(class_minimum, return_inverse=True)
+        class_of_pair = class_of_pair.reshape(-1)
+
+        # Operation mapping the reference onto each member: first column of the reference's row holding the member
+        operation = np.empty(num_pairs, dtype=np.int64)
+        for start in range(0, num_pairs, image_block_size):
+            rows = np.arange(start, min(start + image_block_size, num_pairs))
+            reference_images = self.image_index(class_minimum[rows])
+            operation[rows] = np.argmax(reference_images == rows[:, np.newaxis], axis=1)
+
+        self.classes = EquivalenceClasses(table, helper, class_of_pair, operation, reference_pair)
+        return self.classes
+
+    def partition_equivalence_classes(self, center):
+        """
+        Equivalence classes of the hoppings onto one center atom
+
+        :param center: Center site index, or AtomIndex
+        :return: List of EquivalenceClass
+        """
+        if isinstance(center, AtomIndex):
+            center = self.symmetry_helper.site(center)
+        classes = self.classes if self.classes is not None else self.build_all_equivalence_classes()
+        return [classes.equivalence_class(class_id) for class_id in np.nonzero(classes.center_site == center)[0]]
+
+    def find_group_element_relating_atoms(self, reference, target):
+        """
+        First stabilizer operation of the common center mapping one hopping onto another
+
+        :param reference: Hopping
+        :param target: Hopping
+        :return: Operation index, or None if the hoppings are not equivalent
+        """
+        helper = self.symmetry_helper
+        if reference.to_atom != target.to_atom:
+            return None
+        for g in helper.compute_stabilizer(reference.to_atom):
+            # Image translated back so that its center is target's center again
+            image_to = helper.apply_symmetry(reference.to_atom, g)
+            image_from = helper.apply_symmetry(reference.from_atom, g)
+            translation = np.array(target.to_atom.cell) - np.array(image_to.cell)
+            cell = np.array(image_from.cell) + translation
+            if helper.atom_index(helper.site(image_from), cell) == target.from_atom:
+                return int(g)
+        return None
@@ -0,0 +1,547 @@
+import numpy as np
+from dataclasses import dataclass
+from fractions import Fraction
+from math import gcd
+
+from symmetry.union_find import UnionFind
+from hoppin_term_relations.constraint_analyzer import IndependentParameters, site_orbital_representations
+from hoppin_term_relations.forest import ROOT
+
+# ==============================================================================
+# Exact (algebraic) mode of the hopping constraint analysis
+# ==============================================================================
+# The orbital representations carry floating-point error from the sqrt(3),
+# sqrt(5) and sqrt(15) factors of the d and f kernels and from lattice
+# vectors given to 8 digits, so a float threshold decides which parameters
+# are free. In the exact mode:
+#   - every entry of the representation matrices is recognized as q * sqrt(k),
+#     q a rational with a small denominator and k a square-free radicand
+#     (crystallographic rotations in a Cartesian frame only have such
+#     entries); the recognized matrix of an operation g of order k is checked
+#     to satisfy D(g)^k = I exactly
+#   - numbers are kept as {radicand: Fraction} (RadicalNumber), closed under
+#     +, -, * and exact inversion by successive conjugation
+#   - the orbitals of each site split into blocks never mixed by any operation
+#     (s, p, d, f shells), and T splits into independent (block_i x block_j)
+#     sub-blocks
+#   - a sub-block is invariant under the stabilizer subset iff it is invariant
+#     under generators of it (at most 3 for point groups), found from the
+#     multiplication table of the group structure
+#   - the constraint rows (D_i(g) kron D_j(g) - I) of the generators are
+#     eliminated fraction-free (cross-multiplication and removal of the
+#     rational content of each row, no division) as sparse rows; each pivot
+#     row is divided by its pivot once at the end
+#   - results are cached per (stabilizer subgroup, orbital sets of the two
+#     sub-blocks), so classes with the same site symmetry and orbitals are
+#     solved once
+# Columns are eliminated from the last to the first: the free columns are
+# then the same independent parameters that the float ConstraintAnalyzer
+# picks (leading columns of the reduced null space), and the relations read
+# e.g. t4 = -t1 or t3 = sqrt(3)*t1 with t numbering the row-major elements of T.
+
+# Absolute tolerance when recognizing a float as q * sqrt(k)
+recognition_tolerance = 1e-6
+# Largest denominator of q
+recognition_max_denominator = 96
+# Square-free radicands tried, in order
+recognition_radicands = (1, 2, 3, 5, 6, 10, 15, 30)
+
+
+class RadicalNumber:
+    """
+    Exact number sum_k q_k * sqrt(k) with rational q_k and square-free radicands k
+
+    :param terms: Dictionary radicand -> Fraction (zero coefficients are dropped)
+    """
+    __slots__ = ("terms",)
+
+    def __init__(self, terms=None):
+        self.terms = {k: Fraction(q) for k, q in (terms or {}).items() if q != 0}
+
+    @classmethod
+    def rational(cls, value):
+        return cls({1: Fraction(value)})
+
+    @classmethod
+    def from_float(cls, value, tolerance=recognition_tolerance, max_denominator=recognition_max_denominator):
+        """
+        Recognize a float as q * sqrt(k)
+
+        :raises ValueError: If no radicand of recognition_radicands fits within the tolerance
+        """
+        if abs(value) <= tolerance:
+            return cls()
+        for radicand in recognition_radicands:
+            root = radicand ** 0.5
+            q = Fraction(value / root).limit_denominator(max_denominator)
+            if q != 0 and abs(float(q) * root - value) <= tolerance:
+                return cls({radicand: q})
+        raise ValueError(f"{value!r} is not q*sqrt(k) with a small denominator, the exact mode does not apply")
+
+    def is_zero(self):
+        return not self.terms
+
+    def __eq__(self, other):
+        if not isinstance(other, RadicalNumber):
+            other = RadicalNumber.rational(other)
+        return self.terms == other.terms
+
+    def __hash__(self):
+        return hash(frozenset(self.terms.items()))
+
+    def __neg__(self):
+        return RadicalNumber({k: -q for k, q in self.terms.items()})
+
+    def __add__(self, other):
+        terms = dict(self.terms)
+        for k, q in other.terms.items():
+            terms[k] = terms.get(k, 0) + q
+        return RadicalNumber(terms)
+
+    def __sub__(self, other):
+        return self + (-other)
+
+    def __mul__(self, other):
+        if not isinstance(other, RadicalNumber):
+            return RadicalNumber({k: q * other for k, q in self.terms.items()})
+        terms = {}
+        for a, p in self.terms.items():
+            for b, q in other.terms.items():
+                # sqrt(a) sqrt(b) = g sqrt(a b / g^2) for square-free a, b with g = gcd(a, b)
+                g = gcd(a, b)
+                k = a * b // (g * g)
+                terms[k] = terms.get(k, 0) + p * q * g
+        return RadicalNumber(terms)
+
+    __rmul__ = __mul__
+
+    def inverse(self):
+        """
+        Exact inverse, by multiplying with conjugates until the denominator is rational
+
+        :raises ZeroDivisionError: If the number is zero
+        """
+        if self.is_zero():
+            raise ZeroDivisionError("inverse of zero")
+        numerator, denominator = RadicalNumber.rational(1), self
+        while set(denominator.terms) - {1}:
+            # Split off one prime p of the radicands: x = u + v sqrt(p), conjugate u - v sqrt(p)
+            p = next(_smallest_prime_factor(k) for k in denominator.terms if k != 1)
+            conjugate = RadicalNumber({k: (-q if k % p == 0 else q) for k, q in denominator.terms.items()})
+            numerator, denominator = numerator * conjugate, denominator * conjugate
+        return numerator * (1 / denominator.terms[1])
+
+    def __truediv__(self, other):
+        return self * other.inverse()
+
+    def rational_content(self):
+        """
+        Positive rational c with all coefficients of self / c coprime integers (0 for zero)
+        """
+        numerators = [q.numerator for q in self.terms.values()]
+        denominators = [q.denominator for q in self.terms.values()]
+        numerator, denominator = 0, 1
+        for value in numerators:
+            numerator = gcd(numerator, value)
+        for value in denominators:
+            denominator = denominator * value // gcd(denominator, value)
+        return Fraction(numerator, denominator)
+
+    def __float__(self):
+        return float(sum(float(q) * k ** 0.5 for k, q in self.terms.items()))
+
+    def __repr__(self):
+        return f"RadicalNumber({self})"
+
+    def __str__(self):
+        if self.is_zero():
+            return "0"
+        parts = []
+        for k in sorted(self.terms):
+            q = self.terms[k]
+            magnitude = abs(q)
+            if k == 1:
+                text = str(magnitude)
+            elif magnitude == 1:
+                text = f"√{k}"
+            elif magnitude.denominator == 1:
+                text = f"{magnitude.numerator}·√{k}"
+            else:
+                text = f"{magnitude.numerator}·√{k}/{magnitude.denominator}" if magnitude.numerator != 1 \
+                    else f"√{k}/{magnitude.denominator}"
+            parts.append(("-" if q < 0 else "+", text))
+        head = ("-" if parts[0][0] == "-" else "") + parts[0][1]
+        return " ".join([head] + [f"{sign} {text}" for sign, text in parts[1:]])
+
+
+def _smallest_prime_factor(n):
+    factor = 2
+    while factor * factor <= n:
+        if n % factor == 0:
+            return factor
+        factor += 1
+    return n
+
+
+# ==============================================================================
+# STEP 1: Define the fraction-free elimination of sparse rows
+# ==============================================================================
+def _remove_content(row):
+    """
+    Divide a sparse row by the rational content of its entries
+    """
+    content = Fraction(0)
+    for value in row.values():
+        value_content = value.rational_content()
+        content = Fraction(gcd(content.numerator, value_content.numerator),
+                           content.denominator * value_content.denominator
+                           // gcd(content.denominator, value_content.denominator))
+    return {col: value * (1 / content) for col, value in row.items()} if content else row
+
+
+def _cross_eliminate(row, pivot_row, col):
+    """
+    pivot * row - row[col] * pivot_row (clears column col of row without division)
+    """
+    pivot, factor = pivot_row[col], row[col]
+    result = {c: value * pivot for c, value in row.items()}
+    for c, value in pivot_row.items():
+        entry = result.get(c, RadicalNumber()) - factor * value
+        if entry.is_zero():
+            result.pop(c, None)
+        else:
+            result[c] = entry
+    return _remove_content(result)
+
+
+def exact_reduced_rows(rows):
+    """
+    Reduced row echelon form of sparse exact rows, pivoting on the last nonzero column of each row
+
+    :param rows: Iterable of dictionaries column -> RadicalNumber
+    :return: Dictionary pivot column -> row normalized to 1 at the pivot
+    """
+    pivot_rows = {}
+    for row in rows:
+        row = {col: value for col, value in row.items() if not value.is_zero()}
+        # Reduce against the pivot rows, largest pivot column first
+        for col in sorted(pivot_rows, reverse=True):
+            if col in row:
+                row = _cross_eliminate(row, pivot_rows[col], col)
+        if not row:
+            continue
+        col = max(row)
+        # Keep the pivot rows reduced: clear the new pivot column from them
+        for other in pivot_rows:
+            if col in pivot_rows[other]:
+                pivot_rows[other] = _cross_eliminate(pivot_rows[other], row, col)
+        pivot_rows[col] = row
+    return {col: {c: value / row[col] for c, value in row.items()} for col, row in pivot_rows.items()}
+
+
+def exact_null_space(rows, num_cols):
+    """
+    Null space of exact constraint rows in reduced row echelon form
+
+    :param rows: Iterable of dictionaries column -> RadicalNumber
+    :param num_cols: Number of unknowns
+    :return: tuple: (free columns (sorted), basis rows as dictionaries column -> RadicalNumber)
+    """
+    reduced = exact_reduced_rows(rows)
+    free = [col for col in range(num_cols) if col not in reduced]
+    basis = []
+    for f in free:
+        vector = {f: RadicalNumber.rational(1)}
+        for col, row in reduced.items():
+            if f in row:
+                vector[col] = -row[f]
+        basis.append(vector)
+    return free, basis
+
+
+# ==============================================================================
+# STEP 2: Define the exact solver
+# ==============================================================================
+def orbital_blocks(matrices, tolerance=recognition_tolerance):
+    """
+    Blocks of orbitals never mixed by any operation
+
+    :param matrices: Representation matrices, shape (num_ops, d, d)
+    :return: List of sorted orbital index arrays
+    """
+    d = matrices.shape[-1]
+    rows, cols = np.nonzero(np.any(np.abs(matrices) > tolerance, axis=0))
+    components = UnionFind(d)
+    components.union_edges(rows, cols)
+    labels = components.roots()
+    return [np.nonzero(labels == root)[0] for root in np.unique(labels)]
+
+
+def subgroup_generators(group_structure, elements):
+    """
+    Generators of the subgroup formed by some operations (modulo the lattice)
+
+    :param group_structure: SpaceGroupStructure
+    :param elements: Operation indices of the subgroup
+    :return: Sorted list of generator indices (representatives)
+    """
+    representatives = group_structure.representatives
+    elements = sorted({int(representatives[g]) for g in elements})
+    generators, closure = [], {group_structure.identity}
+    for g in elements:
+        if g in closure:
+            continue
+        generators.append(g)
+        # Closure under right multiplication by the generators
+        frontier = list(closure)
+        while frontier:
+            element = frontier.pop()
+            for generator in generators:
+                product = int(group_structure.multiply(element, generator))
+                if product not in closure:
+                    closure.add(product)
+                    frontier.append(product)
+    return generators
+
+
+@dataclass
+class ExactParameters:
+    """
+    Exact independent parameters of one equivalence class
+
+    block_shape: (m, n) orbitals of center and neighbor
+    free_columns: row-major elements a*n + b of T chosen as the independent parameters
+    basis: one dictionary column -> RadicalNumber per parameter (T for that parameter 1, the others 0)
+    """
+    block_shape: tuple
+    free_columns: list
+    basis: list
+
+    def num_parameters(self):
+        return len(self.free_columns)
+
+    def element(self, col):
+        """
+        Element col of T as {parameter: coefficient}
+        """
+        return {p: vector[col] for p, vector in enumerate(self.basis) if col in vector}
+
+    def relations(self, names=None):
+        """
+        Relations of the dependent elements of T to the independent ones
+
+        :param names: Name of every element of T in row-major order (default t1, t2, ...)
+        :return: List of strings such as "t4 = -t1" or "t3 = √3·t1"
+        """
+        m, n = self.block_shape
+        names = names or [f"t{col + 1}" for col in range(m * n)]
+        lines = []
+        for col in range(m * n):
+            if col in self.free_columns:
+                continue
+            terms = []
+            for p, coefficient in self.element(col).items():
+                text = str(coefficient)
+                if text == "1":
+                    terms.append(names[self.free_columns[p]])
+                elif text == "-1":
+                    terms.append("-" + names[self.free_columns[p]])
+                elif len(coefficient.terms) > 1:
+                    terms.append(f"({text})·{names[self.free_columns[p]]}")
+                else:
+                    terms.append(f"{text}·{names[self.free_columns[p]]}")
+            expression = " + ".join(terms).replace("+ -", "- ") if terms else "0"
+            lines.append(f"{names[col]} = {expression}")
+        return lines
+
+    def float_basis(self):
+        """
+        Basis as floats, shape (num_parameters, m, n)
+        """
+        m, n = self.block_shape
+        basis = np.zeros((len(self.basis), m * n))
+        for p, vector in enumerate(self.basis):
+            for col, value in vector.items():
+                basis[p, col] = float(value)
+        return basis.reshape(-1, m, n)
+
+
+class ExactConstraintSolver:
+    """
+    Exact independent hopping parameters from the stabilizer constraints
+
+    :param symmetry_helper: SymmetryHelper of the atoms
+    :param site_representations: Orbital representation of every site, list of (num_ops, d, d)
+    :param site_orbitals: Global orbital indices (orbital_map) of the rows of every site representation
+    :raises ValueError: If a representation entry is not of the form q * sqrt(k)
+    """
+
+    def __init__(self, symmetry_helper, site_representations, site_orbitals):
+        self.symmetry_helper = symmetry_helper
+        self.group_structure = symmetry_helper.group_structure
+        self.site_representations = site_representations
+        self.site_orbitals = [tuple(int(orbital) for orbital in orbitals) for orbitals in site_orbitals]
+        self.site_blocks = [orbital_blocks(matrices) for matrices in site_representations]
+        self.exact_matrices = {}
+        self.cache = {}
+
+    @classmethod
+    def from_equivalence_classes(cls, classes, orbital_completion):
+        """
+        Solver for the atoms of an EquivalenceClasses partition
+
+        :param classes: EquivalenceClasses
+        :param orbital_completion: Output of complete_orbitals()
+        :return: ExactConstraintSolver
+        """
+        helper = classes.symmetry_helper
+        vectors = orbital_completion["updated_orbital_vectors"]
+        site_orbitals = [np.nonzero(np.asarray(vectors[name]) == 1)[0] for name in classes.table.atom_position_names]
+        return cls(helper, site_orbital_representations(classes.table, orbital_completion, len(helper)),
+                   site_orbitals)
+
+    # --------------------------------------------------------------------------
+    def exact_matrix(self, site, block, g):
+        """
+        Exact representation of operation g on one orbital block of a site
+
+        The recognition is checked exactly: D(g)^k = I for the order k of g.
+
+        :raises ValueError: If the recognized matrix fails the check
+        """
+        orbitals = tuple(self.site_orbitals[site][index] for index in block)
+        key = (orbitals, g)
+        if key not in self.exact_matrices:
+            values = self.site_representations[site][g][np.ix_(block, block)]
+            matrix = [[RadicalNumber.from_float(value) for value in row] for row in values]
+            size = len(block)
+            power = matrix
+            for _ in range(int(self.group_structure.element_orders[g]) - 1):
+                power = [[sum((power[a][c] * matrix[c][b] for c in range(size)), RadicalNumber())
+                          for b in range(size)] for a in range(size)]
+            if any(power[a][b] != (1 if a == b else 0) for a in range(size) for b in range(size)):
+                raise ValueError(f"recognized representation of operation {g} is not exact")
+            self.exact_matrices[key] = matrix
+        return self.exact_matrices[key]
+
+    def sub_block_null_space(self, generators, center_site, center_block, neighbor_site, neighbor_block,
+                             hermitian_operation=-1):
+        """
+        Exact null space of the constraints of one (block_i x block_j) sub-block, cached
+
+        :param hermitian_operation: Operation mapping the hopping onto its conjugate (whole blocks only), or -1
+        :return: tuple: (free local columns, basis rows over local columns)
+        """
+        key = (tuple(generators), hermitian_operation,
+               tuple(self.site_orbitals[center_site][i] for i in center_block),
+               tuple(self.site_orbitals[neighbor_site][j] for j in neighbor_block))
+        if key in self.cache:
+            return self.cache[key]
+
+        m, n = len(center_block), len(neighbor_block)
+        rows = []
+        operations = [(g, False) for g in generators] + ([(hermitian_operation, True)] if hermitian_operation >= 0
+                                                          else [])
+        for g, transpose in operations:
+            left = self.exact_matrix(center_site, center_block, g)
+            right = self.exact_matrix(neighbor_site, neighbor_block, g)
+            # Row (a, d) of D_i(g) kron D_j(g) - I (or - S for T^T, m = n), column (b, e): D_i[a, b] D_j[d, e]
+            for a in range(m):
+                for d in range(n):
+                    row = {}
+                    for b in range(m):
+                        if left[a][b].is_zero():
+                            continue
+                        for e in range(n):
+                            if not right[d][e].is_zero():
+                                row[b * n + e] = left[a][b] * right[d][e]
+                    col = d * n + a if transpose else a * n + d
+                    row[col] = row.get(col, RadicalNumber()) - RadicalNumber.rational(1)
+                    rows.append(row)
+        self.cache[key] = exact_null_space(rows, m * n)
+        return self.cache[key]
+
+    def solve_hopping(self, center_site, neighbor_site, stabilizer, hermitian_operation=-1):
+        """
+        Exact parameters of one hopping
+
+        :param stabilizer: Operation indices of its stabilizer subset
+        :param hermitian_operation: Operation mapping the hopping onto its conjugate, or -1
+        :return: ExactParameters
+        """
+        generators = subgroup_generators(self.group_structure, stabilizer)
+        m = self.site_representations[center_site].shape[-1]
+        n = self.site_representations[neighbor_site].shape[-1]
+
+        # T^T couples sub-block (a, b) with (b, a): the hermiticity constraint is solved on the whole block
+        if hermitian_operation >= 0:
+            center_blocks, neighbor_blocks = [np.arange(m)], [np.arange(n)]
+        else:
+            center_blocks, neighbor_blocks = self.site_blocks[center_site], self.site_blocks[neighbor_site]
+
+        # Sub-block results mapped to row-major columns a * n + b of the whole block
+        free_columns, basis = [], []
+        for center_block in center_blocks:
+            for neighbor_block in neighbor_blocks:
+                local_free, local_basis = self.sub_block_null_space(generators, center_site, center_block,
+                                                                    neighbor_site, neighbor_block,
+                                                                    int(hermitian_operation))
+                width = len(neighbor_block)
+                to_global = [int(center_block[c // width]) * n + int(neighbor_block[c % width])
+                             for c in range(len(center_block) * width)]
+                free_columns.extend(to_global[c] for c in local_free)
+                basis.extend({to_global[c]: value for c, value in vector.items()} for vector in local_basis)
+
+        order = np.argsort(free_columns, kind="stable")
+        return ExactParameters(block_shape=(m, n), free_columns=[free_columns[p] for p in order],
+                               basis=[basis[p] for p in order])
+
+    def solve(self, classes, forest=None):
+        """
+        Exact parameters of all classes
+
+        :param classes: EquivalenceClasses
+        :param forest: Forest of the classes; if given, only roots get parameters,
+                       with the hermiticity constraint of self-conjugate roots
+        :return: List of ExactParameters, indexed by class
+        """
+        table = classes.table
+        reference = classes.reference_pair
+        center = table.center_atom_index[reference].astype(np.int64)
+        neighbor = table.neighbor_atom_index[reference].astype(np.int64)
+        stabilizer_mask = self.symmetry_helper.pair_stabilizer_mask(center, neighbor,
+                                                                    table.neighbor_cell[reference])
+        if forest is None:
+            return [self.solve_hopping(int(i), int(j), np.nonzero(mask)[0])
+                    for i, j, mask in zip(center, neighbor, stabilizer_mask)]
+
+        results = []
+        for i, j, mask, vertex_type, hermitian_operation in zip(center, neighbor, stabilizer_mask,
+                                                                 forest.vertex_type, forest.hermitian_operation):
+            shape = (self.site_representations[i].shape[-1], self.site_representations[j].shape[-1])
+            results.append(self.solve_hopping(int(i), int(j), np.nonzero(mask)[0], int(hermitian_operation))
+                           if vertex_type == ROOT else ExactParameters(block_shape=shape, free_columns=[], basis=[]))
+        return results
+
+
+def exact_to_independent_parameters(exact_parameters, stabilizer_size):
+    """
+    Float IndependentParameters (as from ConstraintAnalyzer.solve()) of exact results
+
+    :param exact_parameters: List of ExactParameters, indexed by class
+    :param stabilizer_size: Number of operations in the stabilizer subset of each class
+    :return: IndependentParameters
+    """
+    block_shape = np.array([parameters.block_shape for parameters in exact_parameters],
+                           dtype=np.int64).reshape(-1, 2)
+    num_parameters = np.array([parameters.num_parameters() for parameters in exact_parameters], dtype=np.int64)
+    orbitals = [divmod(col, max(parameters.block_shape[1], 1))
+                for parameters in exact_parameters for col in parameters.free_columns]
+    return IndependentParameters(
+        block_shape=block_shape,
+        num_parameters=num_parameters,
+        parameter_offset=np.concatenate([[0], np.cumsum(num_parameters)]).astype(np.int64),
+        parameter_orbitals=np.array(orbitals, dtype=np.int64).reshape(-1, 2),
+        bases=[parameters.float_basis() for parameters in exact_parameters],
+        stabilizer_size=np.asarray(stabilizer_size, dtype=np.int64),
+    )
@@ -1,39 +1,56 @@
 import numpy as np
 import sys
+import os
 import json
 
+# Make the repository root importable when this file is run as a script
+if __package__ in (None, ""):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pipeline.stage_io import write_stage, read_stage, pop_handoff_arg
+from hoppin_term_relations.pair_table import PairTable
+from hoppin_term_relations.distance_shells import cluster_distances, default_shell_atol, default_shell_rtol
+from hoppin_term_relations.irreducible_pairs import IrreduciblePairs, reduce_pairs
+from hoppin_term_relations.lattice_reduction import lll_reduce
+
 # Original file: /home/adada/Documents/pyCode/TB/cd/NbrAtom.py
 # This script finds neighbors of atoms in unit cell [0,0,0] to neighboring cells
+#
+# usage: python find_neighbors.py [--handoff DIR] [--npz pairs.npz] [--stream pairs.bin [--block-size N]]
+#                                 < combined_input.json
+#        --npz additionally writes the pair table to a .npz file (see pair_table.py)
+#        --stream writes the pairs block by block to a binary stream file
+#        instead of building the table (see pair_stream.py); stdout / the
+#        handoff directory then receive no pair columns, only stdout gets the
+#        stream metadata
 
 # Exit codes
 json_err_code = 4
 key_err_code = 5
 val_err_code = 6
 
-
-# ==============================================================================
-# STEP 1: Read and parse JSON input from stdin
-# ==============================================================================
-try:
-    combined_input_json = sys.stdin.read()
-    combined_input = json.loads(combined_input_json)
-except json.JSONDecodeError as e:
-    print(f"Error parsing JSON input: {e}", file=sys.stderr)
-    exit(json_err_code)
-
-# Split the combined input into two main components
-parsed_config = combined_input["parsed_config"]
-space_group_representations = combined_input["space_group_representations"]
+# Slack added to a cutoff so that pairs exactly at the cutoff distance are kept
+cutoff_tolerance = 1e-6
 
 
 # ==============================================================================
-# STEP 2: Extract configuration parameters from JSON
+# STEP 1: Define function extracting configuration parameters
 # ==============================================================================
-try:
+def extract_neighbor_parameters(parsed_config, space_group_representations):
+    """
+    Extract the lattice, atoms and neighbor range needed by the neighbor search
+
+    :param parsed_config: Parsed configuration dictionary (output of parse_conf.py)
+    :param space_group_representations: Output of generate_space_group_representations()
+    :return: Dictionary with lattice_basis_primitive, atom_position_names, atom_types,
+             atom_coordinates_frac, space_group_origin_cart, neighbor_cell_num_vec,
+             neighbor_cutoff and neighbor_shells (None if not given), shell_atol, shell_rtol,
+             lattice_reduction, symmetry_reduction and num_workers
+    :raises KeyError: If a required key is missing
+    """
     # Primitive cell lattice basis vectors (3x3 matrix)
     # Original variable name: Lv
-    lattice_basis_primitive = parsed_config['lattice_basis']
-    lattice_basis_primitive = np.array(lattice_basis_primitive)
+    lattice_basis_primitive = np.array(parsed_config['lattice_basis'])
 
     # Atom positions in the primitive cell
     # Original variable name: AtLv
@@ -43,6 +60,29 @@ try:
     # Original variable name: Nbr
     neighbors = parsed_config["neighbors"]
 
+    # Optional Cartesian cutoff radius / number of distance shells
+    # (empty or missing: use the neighbor cell range above)
+    neighbor_cutoff = parsed_config.get("neighbor_cutoff", "")
+    neighbor_cutoff = None if neighbor_cutoff in ("", None) else float(neighbor_cutoff)
+    neighbor_shells = parsed_config.get("neighbor_shells", "")
+    neighbor_shells = None if neighbor_shells in ("", None) else int(neighbor_shells)
+
+    # Absolute / relative tolerance of the distance shell clustering
+    shell_atol = parsed_config.get("shell_tolerance", "")
+    shell_atol = default_shell_atol if shell_atol in ("", None) else float(shell_atol)
+    shell_rtol = parsed_config.get("shell_relative_tolerance", "")
+    shell_rtol = default_shell_rtol if shell_rtol in ("", None) else float(shell_rtol)
+
+    # Optional: search cutoff pairs in an LLL-reduced basis
+    lattice_reduction = str(parsed_config.get("neighbor_lattice_reduction", "")).lower() == "true"
+
+    # Optional: keep one representative pair per space group orbit
+    symmetry_reduction = str(parsed_config.get("neighbor_symmetry_reduction", "")).lower() == "true"
+
+    # Optional: number of worker processes searching shards of center atoms
+    num_workers = parsed_config.get("neighbor_workers", "")
+    num_workers = 1 if num_workers in ("", None) else int(num_workers)
+
     # Bilbao space group origin under Cartesian basis
     space_group_origin_cart = np.array(space_group_representations["space_group_origin_cartesian"])
 
@@ -69,147 +109,437 @@ try:
 
     atom_coordinates_frac = np.array(atom_coordinates_frac)  # Convert to numpy array
 
-
-except KeyError as e:
-    print(f"Error: Required key {e} not found in configuration", file=sys.stderr)
-    exit(key_err_code)
-except ValueError as e:
-    print(f"Error with configuration data: {e}", file=sys.stderr)
-    exit(val_err_code)
+    return {
+        "lattice_basis_primitive": lattice_basis_primitive,
+        "atom_position_names": atom_position_names,
+        "atom_types": atom_types,
+        "atom_coordinates_frac": atom_coordinates_frac,
+        "space_group_origin_cart": space_group_origin_cart,
+        "neighbor_cell_num_vec": neighbor_cell_num_vec,
+        "neighbor_cutoff": neighbor_cutoff,
+        "neighbor_shells": neighbor_shells,
+        "shell_atol": shell_atol,
+        "shell_rtol": shell_rtol,
+        "lattice_reduction": lattice_reduction,
+        "symmetry_reduction": symmetry_reduction,
+        "num_workers": num_workers
+    }
 
 
 # ==============================================================================
-# STEP 3: Generate all atoms in neighboring cells
+# STEP 2: Define vectorized neighbor search helpers
 # ==============================================================================
-# Neighbor range: [[-N0, N0], [-N1, N1], [-N2, N2]]
-N0, N1, N2 = neighbor_cell_num_vec
-total_num_cells = (2*N0+1) * (2*N1+1) * (2*N2+1)
-atom_num_in_1_cell = len(atom_position_names)
-
-# Create list of dictionaries for all atoms in the supercell
-atoms_in_cells = []
-
-count = 0
-for n0 in range(-N0, N0+1):
-    for n1 in range(-N1, N1+1):
-        for n2 in range(-N2, N2+1):
-            for j in range(atom_num_in_1_cell):
-                atom_dict = {
-                    'cell': [n0, n1, n2],                    # Which unit cell
-                    'atom_index': j,                         # Which atom in that cell
-                    'position_name': atom_position_names[j],
-                    'atom_type': atom_types[j],
-                    'frac_coords': atom_coordinates_frac[j].tolist(),  # Convert to list
-                    'global_index': count                    # Unique identifier
-                }
-                atoms_in_cells.append(atom_dict)
-                count += 1
-
-
-# ==============================================================================
-# STEP 4: Calculate Cartesian coordinates
-# ==============================================================================
-# Cartesian coordinates for atoms in the origin cell [0,0,0]
-# Formula: cart_coords = frac_coords @ lattice_basis
-atom_coordinates_cart_cell_000 = atom_coordinates_frac @ lattice_basis_primitive
-
-# Shift all atomic positions by the space group origin
-# This aligns positions with the Bilbao convention's origin choice
-#
-# Broadcasting explanation:
-#   atom_coordinates_cart_cell_000 has shape (N_atoms, 3)
-#   space_group_origin_cart has shape (3,)
-#   NumPy automatically broadcasts (3,) to (N_atoms, 3) by repeating the vector
-#   for each atom, so this is equivalent to:
-#       for i in range(N_atoms):
-#           atom_coordinates_cart_cell_000[i, :] -= space_group_origin_cart
-#   Example:
-#       [[1.0, 2.0, 3.0],     [[0.5, 0.5, 0.5],     [[0.5, 1.5, 2.5],
-#        [4.0, 5.0, 6.0]]  -   [0.5, 0.5, 0.5]]  =   [3.5, 4.5, 5.5]]
-atom_coordinates_cart_cell_000 = atom_coordinates_cart_cell_000 - space_group_origin_cart
-
-# Cartesian coordinates for all atoms in neighboring cells
-atoms_cart_coords = np.zeros((len(atoms_in_cells), 3))
-for i, atom in enumerate(atoms_in_cells):
-    n0, n1, n2 = atom['cell']
-    j = atom['atom_index']
-
-    # Cell translation vector: n0*a1 + n1*a2 + n2*a3
-    cell_translation = (n0*lattice_basis_primitive[0,:] +
-                        n1*lattice_basis_primitive[1,:] +
-                        n2*lattice_basis_primitive[2,:])
-
-    # Atom position within the cell (shifted by space group origin)
-    atom_position = atom_coordinates_frac[j,:] @ lattice_basis_primitive - space_group_origin_cart
-
-    # Total position = cell_translation + atom_position_in_cell
-    atoms_cart_coords[i,:] = cell_translation + atom_position
-
-
-# ==============================================================================
-# STEP 5: Create atom pairs and calculate distances
-# ==============================================================================
-# Pair atoms in origin cell [0,0,0] with atoms in all neighboring cells
-atom_pairs = []
-count = 0
-num_digits = 6  # Truncate distances to 6 decimal places
-
-for i in range(atom_num_in_1_cell):  # Atoms in origin cell [0,0,0]
-    for j, atom_j in enumerate(atoms_in_cells):  # Atoms in all cells
-
-        # Calculate distance between the two atoms
-        displacement = atoms_cart_coords[j] - atom_coordinates_cart_cell_000[i]
-        distance = np.linalg.norm(displacement)
-        distance = round(distance, num_digits)  # Truncate to num_digits decimal places
-
-        # Create pair dictionary with complete information
-        pair_dict = {
-            'pair_index': count,
-            'distance': distance,
-            'atom_at_center_cell': {
-                'cell': [0, 0, 0],
-                'atom_index': i,
-                'position_name': atom_position_names[i],
-                'atom_type': atom_types[i],
-                'frac_coords': atom_coordinates_frac[i].tolist(),      # Convert to list
-                'cart_coords': atom_coordinates_cart_cell_000[i].tolist()  # Already shifted
-            },
-            'atom_at_neighbor_cell': {
-                'cell': atom_j['cell'],
-                'atom_index': atom_j['atom_index'],
-                'position_name': atom_j['position_name'],
-                'atom_type': atom_j['atom_type'],
-                'frac_coords': atom_j['frac_coords'],
-                'cart_coords': atoms_cart_coords[j].tolist(),  # Already shifted
-                'global_index': atom_j['global_index']
-            }
-        }
-        atom_pairs.append(pair_dict)
-        count += 1
+def cell_translations(neighbor_cell_num_vec):
+    """
+    All cells [n0, n1, n2] with |nk| <= Nk, in the order of the original nested loops
+
+    :param neighbor_cell_num_vec: [N0, N1, N2]
+    :return: Integer array of shape ((2N0+1)(2N1+1)(2N2+1), 3)
+    """
+    N0, N1, N2 = neighbor_cell_num_vec
+    n0, n1, n2 = np.meshgrid(np.arange(-N0, N0+1), np.arange(-N1, N1+1), np.arange(-N2, N2+1), indexing="ij")
+    return np.stack([n0.ravel(), n1.ravel(), n2.ravel()], axis=-1)
+
+
+def cutoff_cell_range(lattice_basis_primitive, atom_coordinates_frac, cutoff, dim):
+    """
+    Minimal neighbor cell range containing every atom within cutoff of an atom in cell [0,0,0]
+
+    The lattice planes normal to reciprocal vector b_k are h_k = 1/|b_k| apart,
+    so fractional coordinate k of a displacement of length <= cutoff is at
+    most cutoff / h_k, and atoms of one cell differ by at most the spread of
+    their fractional coordinates. The range is chosen per axis.
+
+    :param lattice_basis_primitive: Lattice vectors (rows), shape (3, 3)
+    :param atom_coordinates_frac: Fractional atom coordinates, shape (N_atoms, 3)
+    :param cutoff: Cartesian cutoff radius
+    :param dim: Dimensionality (only the first 2 directions are periodic if dim != 3)
+    :return: [N0, N1, N2]
+    """
+    reciprocal_lengths = np.linalg.norm(np.linalg.inv(lattice_basis_primitive), axis=0)
+    spread = np.ptp(atom_coordinates_frac, axis=0)
+    cell_num_vec = [int(n) for n in np.floor(cutoff * reciprocal_lengths + spread + cutoff_tolerance)]
+    if dim != 3:
+        cell_num_vec[2] = 0
+    return cell_num_vec
+
+
+def cell_list_pairs(centers_cart, images_cart, cutoff):
+    """
+    All (center, image) pairs closer than cutoff, found with a cell list
+
+    Images are sorted into cubic bins of edge cutoff, so the neighbors of a
+    center lie in the 27 bins around its own bin.
+
+    :param centers_cart: Cartesian coordinates of the centers, shape (N_centers, 3)
+    :param images_cart: Cartesian coordinates of the candidate neighbors, shape (N_images, 3)
+    :param cutoff: Cartesian cutoff radius
+    :return: tuple: (center indices, image indices, distances), unordered
+    """
+    bin_size = cutoff + cutoff_tolerance
+
+    # Only images in the bounding box of the centers (expanded by cutoff) can be neighbors
+    lower = centers_cart.min(axis=0) - bin_size
+    upper = centers_cart.max(axis=0) + bin_size
+    inside = np.all((images_cart >= lower) & (images_cart <= upper), axis=1)
+    image_indices = np.nonzero(inside)[0]
+
+    num_bins = np.floor((upper - lower) / bin_size).astype(np.int64) + 1
+    image_bins = np.floor((images_cart[image_indices] - lower) / bin_size).astype(np.int64)
+    center_bins = np.floor((centers_cart - lower) / bin_size).astype(np.int64)
+
+    def bin_keys(bins):
+        return (bins[:, 0] * num_bins[1] + bins[:, 1]) * num_bins[2] + bins[:, 2]
+
+    order = np.argsort(bin_keys(image_bins), kind="stable")
+    sorted_keys = bin_keys(image_bins)[order]
+    sorted_images = image_indices[order]
+
+    center_list, image_list = [], []
+    for offset in np.array(np.meshgrid([-1, 0, 1], [-1, 0, 1], [-1, 0, 1], indexing="ij")).reshape(3, -1).T:
+        neighbor_bins = center_bins + offset
+        valid = np.all((neighbor_bins >= 0) & (neighbor_bins < num_bins), axis=1)
+        keys = bin_keys(neighbor_bins)
+        start = np.searchsorted(sorted_keys, keys, side="left")
+        stop = np.searchsorted(sorted_keys, keys, side="right")
+        counts = np.where(valid, stop - start, 0)
+
+        # Expand the ranges [start, stop) of all centers at once
+        total = int(counts.sum())
+        if total == 0:
+            continue
+        range_starts = np.repeat(start - np.cumsum(counts) + counts, counts)
+        center_list.append(np.repeat(np.arange(len(centers_cart)), counts))
+        image_list.append(sorted_images[range_starts + np.arange(total)])
+
+    if not center_list:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+
+    center_idx = np.concatenate(center_list)
+    image_idx = np.concatenate(image_list)
+    displacement = images_cart[image_idx] - centers_cart[center_idx]
+    distances = np.sqrt(np.einsum("ij,ij->i", displacement, displacement))
+
+    within = distances <= cutoff + cutoff_tolerance
+    return center_idx[within], image_idx[within], distances[within]
+
+
+def search_pairs(atom_coordinates_cart_cell_000, lattice_basis_primitive, neighbor_cell_num_vec, cutoff=None,
+                 num_workers=1):
+    """
+    Pair atoms in cell [0,0,0] with atom images in the neighbor cell range
+
+    :param atom_coordinates_cart_cell_000: Cartesian coordinates of the atoms in cell [0,0,0], shape (N_atoms, 3)
+    :param lattice_basis_primitive: Lattice vectors (rows), shape (3, 3)
+    :param neighbor_cell_num_vec: [N0, N1, N2]
+    :param cutoff: Cartesian cutoff radius, or None for all pairs in the range
+    :param num_workers: Worker processes; above 1 the center atoms are searched
+                        in parallel shards (parallel_pairs.py), with the same result
+    :return: tuple: (cells (N_cells, 3), images_cart (N_cells*N_atoms, 3),
+                     center indices, image indices, distances) with pairs sorted by (center, image);
+             image index g refers to atom g % N_atoms in cell g // N_atoms
+    """
+    cells = cell_translations(neighbor_cell_num_vec)
+    atom_num_in_1_cell = len(atom_coordinates_cart_cell_000)
+
+    # Cell translation vector: n0*a1 + n1*a2 + n2*a3, for all cells
+    cell_translation = (cells[:, 0:1] * lattice_basis_primitive[0, :] +
+                        cells[:, 1:2] * lattice_basis_primitive[1, :] +
+                        cells[:, 2:3] * lattice_basis_primitive[2, :])
+
+    # Total position = cell_translation + atom_position_in_cell, for all (cell, atom)
+    images_cart = (cell_translation[:, np.newaxis, :] + atom_coordinates_cart_cell_000[np.newaxis, :, :]).reshape(-1, 3)
+
+    if num_workers > 1 and atom_num_in_1_cell > 1:
+        # Imported here: parallel_pairs.py itself imports this module in its workers
+        from hoppin_term_relations.parallel_pairs import sharded_search
+        center_idx, image_idx, distances = sharded_search(atom_coordinates_cart_cell_000, images_cart, cutoff,
+                                                          num_workers)
+    elif cutoff is None:
+        center_idx = np.repeat(np.arange(atom_num_in_1_cell), len(images_cart))
+        image_idx = np.tile(np.arange(len(images_cart)), atom_num_in_1_cell)
+        displacement = images_cart[image_idx] - atom_coordinates_cart_cell_000[center_idx]
+        distances = np.sqrt(np.einsum("ij,ij->i", displacement, displacement))
+    else:
+        center_idx, image_idx, distances = cell_list_pairs(atom_coordinates_cart_cell_000, images_cart, cutoff)
+        order = np.lexsort((image_idx, center_idx))
+        center_idx, image_idx, distances = center_idx[order], image_idx[order], distances[order]
+
+    return cells, images_cart, center_idx, image_idx, distances
+
+
+def search_frame(atom_coordinates_cart_cell_000, atom_coordinates_frac, lattice_basis_primitive, dim,
+                 lattice_reduction=False):
+    """
+    Basis and atom coordinates in which a cutoff search runs
+
+    Without lattice_reduction this is the original basis. With it, the
+    periodic axes are LLL-reduced (lattice_reduction.py) and the atoms are
+    wrapped into the reduced cell: atom j sits at its original position
+    minus wrap[j] @ search_basis.
+
+    :param atom_coordinates_cart_cell_000: Cartesian coordinates of the atoms in cell [0,0,0], shape (N_atoms, 3)
+    :param atom_coordinates_frac: Fractional atom coordinates, shape (N_atoms, 3)
+    :param lattice_basis_primitive: Lattice vectors (rows), shape (3, 3)
+    :param dim: Dimensionality (only the first 2 directions are periodic if dim != 3)
+    :param lattice_reduction: Use an LLL-reduced basis
+    :return: tuple: (search_basis (3, 3), M (3, 3) with search_basis = M @ lattice_basis_primitive
+                     (None without reduction), wrap (N_atoms, 3) int, Cartesian coordinates (N_atoms, 3),
+                     fractional coordinates in the search basis (N_atoms, 3))
+    """
+    atom_num_in_1_cell = len(atom_coordinates_frac)
+    if not lattice_reduction:
+        return (lattice_basis_primitive, None, np.zeros((atom_num_in_1_cell, 3), dtype=np.int64),
+                atom_coordinates_cart_cell_000, atom_coordinates_frac)
+
+    periodic_axes = 3 if dim == 3 else 2
+    reduced_basis, M = lll_reduce(lattice_basis_primitive, periodic_axes)
+
+    # Fractional coordinates in the reduced basis, wrapped into its cell along periodic axes
+    # (frac' @ reduced_basis = frac @ lattice_basis  ->  frac' = frac @ M^(-1))
+    reduced_frac = atom_coordinates_frac @ np.linalg.inv(M)
+    wrap = np.zeros((atom_num_in_1_cell, 3), dtype=np.int64)
+    wrap[:, :periodic_axes] = np.floor(reduced_frac[:, :periodic_axes] + cutoff_tolerance)
+    wrapped_cart = atom_coordinates_cart_cell_000 - wrap @ reduced_basis
+    return reduced_basis, M, wrap, wrapped_cart, reduced_frac - wrap
+
+
+def original_cells(search_cells, M, wrap, center_idx, neighbor_idx):
+    """
+    Cells of pairs found in the search frame, in the original basis
+
+    :param search_cells: Neighbor cells in the search basis, shape (P, 3)
+    :param M: Basis transformation of search_frame() (None: original basis)
+    :param wrap: Atom wrapping of search_frame(), shape (N_atoms, 3)
+    :param center_idx: Center atoms, shape (P,)
+    :param neighbor_idx: Neighbor atoms, shape (P,)
+    :return: Neighbor cells relative to the center cell, in the original basis, shape (P, 3)
+    """
+    if M is None:
+        return search_cells
+    return (search_cells - wrap[neighbor_idx] + wrap[center_idx]) @ M
+
+
+def cutoff_search(atom_coordinates_cart_cell_000, atom_coordinates_frac, lattice_basis_primitive,
+                  cutoff, dim, lattice_reduction=False, num_workers=1):
+    """
+    All pairs within cutoff, searched over the minimal cell range (optionally of an LLL-reduced basis)
+
+    With lattice_reduction the cells of the pairs are converted back to the
+    original basis (see search_frame()).
+
+    :param atom_coordinates_cart_cell_000: Cartesian coordinates of the atoms in cell [0,0,0], shape (N_atoms, 3)
+    :param atom_coordinates_frac: Fractional atom coordinates, shape (N_atoms, 3)
+    :param lattice_basis_primitive: Lattice vectors (rows), shape (3, 3)
+    :param cutoff: Cartesian cutoff radius
+    :param dim: Dimensionality (only the first 2 directions are periodic if dim != 3)
+    :param lattice_reduction: Search in an LLL-reduced basis
+    :param num_workers: Worker processes of the pair search (see search_pairs())
+    :return: tuple: (neighbor_cell_num_vec (range of the pair cells in the original basis),
+                     search_cell_num_vec (range searched, in the searched basis),
+                     pair cells (P, 3), center indices, neighbor indices, distances),
+             pairs sorted by center atom, neighbor cell and neighbor atom
+    """
+    atom_num_in_1_cell = len(atom_coordinates_frac)
+    search_basis, M, wrap, search_cart, search_frac = search_frame(
+        atom_coordinates_cart_cell_000, atom_coordinates_frac, lattice_basis_primitive, dim, lattice_reduction)
+
+    search_cell_num_vec = cutoff_cell_range(search_basis, search_frac, cutoff, dim)
+    cells, _, center_idx, image_idx, distances = search_pairs(search_cart, search_basis, search_cell_num_vec, cutoff,
+                                                              num_workers)
+    neighbor_idx = image_idx % atom_num_in_1_cell
+    pair_cells = original_cells(cells[image_idx // atom_num_in_1_cell], M, wrap, center_idx, neighbor_idx)
+    if M is None:
+        return search_cell_num_vec, search_cell_num_vec, pair_cells, center_idx, neighbor_idx, distances
+
+    # Sort like the unreduced search: by center, then cell (lexicographic), then atom
+    order = np.lexsort((neighbor_idx, pair_cells[:, 2], pair_cells[:, 1], pair_cells[:, 0], center_idx))
+    neighbor_cell_num_vec = [int(n) for n in np.abs(pair_cells).max(axis=0, initial=0)]
+
+    return (neighbor_cell_num_vec, search_cell_num_vec, pair_cells[order], center_idx[order],
+            neighbor_idx[order], distances[order])
 
 
 # ==============================================================================
-# STEP 6: Find unique distances and classify pairs
+# STEP 3: Define the stage function finding all atom pairs
 # ==============================================================================
-# Extract all distances from pairs
-all_distances = [pair['distance'] for pair in atom_pairs]
-
-# Find unique distances (duplicates automatically removed by set())
-# Sort them in ascending order
-unique_distances = sorted(set(all_distances))
-
-# Create lookup dictionary: distance -> index
-# Example: {1.5: 0, 2.1: 1, 3.0: 2}
-distance_to_index = {dist: idx for idx, dist in enumerate(unique_distances)}
+def find_neighbors(parsed_config: dict, space_group_representations: dict) -> PairTable | IrreduciblePairs:
+    """
+    Pair every atom in cell [0,0,0] with the atoms in the neighboring cells
+
+    Without neighbor_cutoff / neighbor_shells in the configuration, all atoms in
+    the cells |nk| <= neighbors are paired (original behavior). With
+    neighbor_cutoff only pairs within that Cartesian distance are returned,
+    with neighbor_shells only pairs up to the k-th nonzero distance shell;
+    both search the minimal cell range per axis, in an LLL-reduced basis with
+    neighbor_lattice_reduction=true.
+    Distances are grouped into shells by tolerance-aware clustering
+    (distance_shells.py; conf keys shell_tolerance / shell_relative_tolerance).
+    With neighbor_symmetry_reduction=true only one pair per space group orbit
+    is returned (irreducible_pairs.py). neighbor_workers=<n> searches the
+    center atoms in parallel (parallel_pairs.py); the result is the same.
+
+    :param parsed_config: Parsed configuration dictionary (output of parse_conf.py)
+    :param space_group_representations: Output of generate_space_group_representations(),
+                                        space_group_origin_cartesian (and space_group_matrices_primitive
+                                        for the symmetry reduction) are used
+    :return: PairTable (columns sorted by center atom and neighbor cell); iterating it
+             yields the original pair dictionaries (pair_index, distance, atom_at_center_cell,
+             atom_at_neighbor_cell, distance_index, unique_distance_value).
+             IrreduciblePairs with neighbor_symmetry_reduction=true
+    :raises KeyError: If a required key is missing
+    :raises ValueError: If neighbor_cutoff or neighbor_shells is not positive, a shell tolerance is negative
+                        or the atoms are not invariant under the space group (symmetry reduction)
+    """
+    params = extract_neighbor_parameters(parsed_config, space_group_representations)
+    lattice_basis_primitive = params["lattice_basis_primitive"]
+    atom_position_names = params["atom_position_names"]
+    atom_types = params["atom_types"]
+    atom_coordinates_frac = params["atom_coordinates_frac"]
+    space_group_origin_cart = params["space_group_origin_cart"]
+    neighbor_cutoff = params["neighbor_cutoff"]
+    neighbor_shells = params["neighbor_shells"]
+    shell_atol = params["shell_atol"]
+    shell_rtol = params["shell_rtol"]
+    lattice_reduction = params["lattice_reduction"]
+    num_workers = params["num_workers"]
+
+    # Cartesian coordinates for atoms in the origin cell [0,0,0]
+    # Formula: cart_coords = frac_coords @ lattice_basis
+    # Shifted by the space group origin to align positions with the Bilbao
+    # convention's origin choice
+    atom_coordinates_cart_cell_000 = atom_coordinates_frac @ lattice_basis_primitive - space_group_origin_cart
+
+    # ==========================================================================
+    # Search pairs: full cell range, Cartesian cutoff, or first k distance shells
+    # ==========================================================================
+    if neighbor_cutoff is None and neighbor_shells is None:
+        # Neighbor range: [[-N0, N0], [-N1, N1], [-N2, N2]]
+        neighbor_cell_num_vec = params["neighbor_cell_num_vec"]
+        search_cell_num_vec = neighbor_cell_num_vec
+        cells, _, center_idx, image_idx, distances = search_pairs(
+            atom_coordinates_cart_cell_000, lattice_basis_primitive, neighbor_cell_num_vec, num_workers=num_workers)
+        # Image index g = cell index * N_atoms + atom index
+        atom_num_in_1_cell = len(atom_position_names)
+        pair_cells = cells[image_idx // atom_num_in_1_cell]
+        neighbor_idx = image_idx % atom_num_in_1_cell
+        shells = cluster_distances(distances, shell_atol, shell_rtol)
+
+    elif neighbor_shells is None:
+        if neighbor_cutoff <= 0:
+            raise ValueError(f"neighbor_cutoff must be positive, got {neighbor_cutoff}")
+        neighbor_cell_num_vec, search_cell_num_vec, pair_cells, center_idx, neighbor_idx, distances = \
+            cutoff_search(atom_coordinates_cart_cell_000, atom_coordinates_frac, lattice_basis_primitive,
+                          neighbor_cutoff, parsed_config["dim"], lattice_reduction, num_workers)
+        shells = cluster_distances(distances, shell_atol, shell_rtol)
+
+        # A shell boundary within the clustering tolerance of the cutoff may be cut in two
+        if shells.cutoff_margin(neighbor_cutoff) <= shell_atol + shell_rtol * neighbor_cutoff:
+            print(f"Warning: neighbor_cutoff={neighbor_cutoff} lies on a distance shell boundary "
+                  f"(margin {shells.cutoff_margin(neighbor_cutoff):.2e})", file=sys.stderr)
 
-# Add distance classification to each pair
-for pair in atom_pairs:
-    distance = pair['distance']
-    pair['distance_index'] = distance_to_index[distance]
-    pair['unique_distance_value'] = unique_distances[distance_to_index[distance]]
+    else:
+        if neighbor_shells <= 0:
+            raise ValueError(f"neighbor_shells must be positive, got {neighbor_shells}")
+        # Grow the cutoff until it contains neighbor_shells nonzero shells and
+        # the start of the next one; all pairs closer than the cutoff are found,
+        # so these shells (and the gap after the last one) are complete
+        periodic_axes = 3 if parsed_config["dim"] == 3 else 2
+        cutoff = float(np.min(np.linalg.norm(lattice_basis_primitive[:periodic_axes], axis=1)))
+        while True:
+            neighbor_cell_num_vec, search_cell_num_vec, pair_cells, center_idx, neighbor_idx, distances = \
+                cutoff_search(atom_coordinates_cart_cell_000, atom_coordinates_frac, lattice_basis_primitive,
+                              cutoff, parsed_config["dim"], lattice_reduction, num_workers)
+            shells = cluster_distances(distances, shell_atol, shell_rtol)
+            nonzero_shells = np.nonzero(shells.shell_lower > shell_atol)[0]
+            if len(nonzero_shells) > neighbor_shells:
+                break
+            cutoff *= 1.5
+
+        # Shells are sorted, so keeping the first ones keeps the shell indices valid
+        last_shell = nonzero_shells[neighbor_shells - 1]
+        keep = shells.shell_index <= last_shell
+        pair_cells, center_idx, neighbor_idx, distances = \
+            pair_cells[keep], center_idx[keep], neighbor_idx[keep], distances[keep]
+        shells = shells.truncated(last_shell + 1)
+        if lattice_reduction:
+            # Range of the kept pairs only
+            neighbor_cell_num_vec = [int(n) for n in np.abs(pair_cells).max(axis=0, initial=0)]
+
+    # ==========================================================================
+    # Create the pair table
+    # ==========================================================================
+    atom_pairs = PairTable(
+        atom_position_names=atom_position_names,
+        atom_types=atom_types,
+        atom_coordinates_frac=atom_coordinates_frac,
+        atom_coordinates_cart_cell_000=atom_coordinates_cart_cell_000,
+        lattice_basis_primitive=lattice_basis_primitive,
+        neighbor_cell_num_vec=neighbor_cell_num_vec,
+        search_cell_num_vec=search_cell_num_vec,
+        center_atom_index=center_idx,
+        neighbor_atom_index=neighbor_idx,
+        neighbor_cell=pair_cells,
+        distance=distances,
+        shell_index=shells.shell_index,
+        unique_distances=shells.shell_distances,
+        shell_lower=shells.shell_lower,
+        shell_upper=shells.shell_upper,
+        shell_multiplicity=shells.multiplicities,
+        shell_gap_to_next=shells.gap_to_next
+    )
+
+    if params["symmetry_reduction"]:
+        return reduce_pairs(atom_pairs, space_group_representations)
+    return atom_pairs
 
 
 # ==============================================================================
-# STEP 7: Output results as JSON
+# STEP 4: Read inputs, find neighbors and write outputs
 # ==============================================================================
-print(json.dumps(atom_pairs), file=sys.stdout)
\ No newline at end of file
+if __name__ == "__main__":
+    args, handoff_dir = pop_handoff_arg(sys.argv[1:])
+    npz_file = args[args.index("--npz") + 1] if "--npz" in args[:-1] else None
+    stream_file = args[args.index("--stream") + 1] if "--stream" in args[:-1] else None
+    block_size = int(args[args.index("--block-size") + 1]) if "--block-size" in args[:-1] else None
+    if handoff_dir is not None:
+        # Read both inputs from the handoff directory (zero-copy arrays)
+        parsed_config = read_stage(handoff_dir, "parse_conf")
+        space_group_representations = read_stage(handoff_dir, "space_group_representations")
+    else:
+        try:
+            combined_input_json = sys.stdin.read()
+            combined_input = json.loads(combined_input_json)
+        except json.JSONDecodeError as e:
+            print(f"Error parsing JSON input: {e}", file=sys.stderr)
+            exit(json_err_code)
+
+        # Split the combined input into two main components
+        parsed_config = combined_input["parsed_config"]
+        space_group_representations = combined_input["space_group_representations"]
+
+    try:
+        if stream_file is not None:
+            # Imported here: pair_stream.py itself imports this module
+            from hoppin_term_relations.pair_stream import NeighborStream, default_pair_block_size
+            stream = NeighborStream(parsed_config, space_group_representations,
+                                    block_size if block_size is not None else default_pair_block_size)
+            stream.write(stream_file)
+            print(json.dumps(stream.metadata()), file=sys.stdout)
+            exit(0)
+        atom_pairs = find_neighbors(parsed_config, space_group_representations)
+    except KeyError as e:
+        print(f"Error: Required key {e} not found in configuration", file=sys.stderr)
+        exit(key_err_code)
+    except ValueError as e:
+        print(f"Error with configuration data: {e}", file=sys.stderr)
+        exit(val_err_code)
+
+    if npz_file is not None:
+        atom_pairs.save_npz(npz_file)
+
+    if handoff_dir is not None:
+        # Write pair columns to the handoff directory
+        write_stage(handoff_dir, "find_neighbors", atom_pairs.to_columns())
+    else:
+        print(json.dumps(atom_pairs.records()), file=sys.stdout)
@@ -0,0 +1,205 @@
+import numpy as np
+from dataclasses import dataclass
+
+from symmetry.union_find import UnionFind
+
+# ==============================================================================
+# Forest of equivalence classes
+# ==============================================================================
+# The equivalence classes (equivalence_classes.py) relate hoppings onto one
+# center. Classes of different centers are related by the remaining space
+# group operations (linear edges) and by hermitian conjugation, which maps the
+# hopping i -> j over cell n onto j -> i over cell -n (hermitian edges).
+# Each tree of the forest is one family of related classes, whose root holds
+# the independent parameters (notes/TB/symmetry_analysis_steps: ForestBuilder).
+#
+# Instead of searching all classes for a parent, conjugate or image of every
+# class, all relations are found at once:
+#   - the reference hoppings of all classes are mapped through all operations
+#     in one pass (EquivalenceClassBuilder.image_index()) and looked up in the
+#     integer key table of the pairs; an image that is the reference of a
+#     class is a linear edge
+#   - the conjugate of every reference is its key with the atoms swapped and
+#     the cell negated, looked up in the same table; its class is the
+#     hermitian edge
+#   - all edges are merged by a vectorized union-find (symmetry/union_find.py),
+#     whose roots are the smallest class of each tree
+# The images of a root cover every class reachable from it by an operation:
+# those are its linear children, reached by the operation read from the
+# root's image row. The other classes of the tree are the conjugates of
+# these, i.e. hermitian children of the class holding their conjugate. A tree
+# whose root is equivalent to its own conjugate has no hermitian children;
+# the operation relating them is recorded, since it further constrains the
+# root parameters (hermitian_operation). The forest is stored as flat arrays
+# (parent, edge type, operation per class); the total cost is
+# O(classes * ops) plus near-linear union-find.
+
+# Vertex types
+ROOT = 0
+HERMITIAN_CHILD = 1
+LINEAR_CHILD = 2
+vertex_type_names = ("ROOT", "HERMITIAN_CHILD", "LINEAR_CHILD")
+
+
+@dataclass
+class Forest:
+    """
+    Trees of related equivalence classes, as flat arrays indexed by class
+
+    parent: parent class (-1 for roots)
+    vertex_type: ROOT, HERMITIAN_CHILD or LINEAR_CHILD
+    edge_operation: operation mapping the reference of the parent onto the reference of the child
+                    (linear edge) or onto the conjugate of the reference of the child (hermitian edge); -1 for roots
+    tree: root class of the tree of each class
+    root_operation: operation mapping the reference of the root onto the reference of each class
+                    (or onto its conjugate, for hermitian children)
+    hermitian_operation: for roots equivalent to their own conjugate, the operation mapping the
+                         reference onto its conjugate; -1 otherwise
+    """
+    parent: np.ndarray
+    vertex_type: np.ndarray
+    edge_operation: np.ndarray
+    tree: np.ndarray
+    root_operation: np.ndarray
+    hermitian_operation: np.ndarray
+
+    def __len__(self):
+        return len(self.parent)
+
+    def roots(self):
+        return np.nonzero(self.vertex_type == ROOT)[0]
+
+    def num_trees(self):
+        return int(np.sum(self.vertex_type == ROOT))
+
+    def tree_members(self, root):
+        """
+        Classes of the tree of a root (root first)
+        """
+        members = np.nonzero(self.tree == root)[0]
+        return np.concatenate([[root], members[members != root]])
+
+    def vertex_type_counts(self):
+        """
+        Number of classes of each vertex type, keyed by name
+        """
+        counts = np.bincount(self.vertex_type, minlength=len(vertex_type_names))
+        return {name: int(count) for name, count in zip(vertex_type_names, counts)}
+
+    def depth(self):
+        """
+        Largest number of edges from a class to its root
+        """
+        depth = np.zeros(len(self), dtype=np.int64)
+        level = self.parent.copy()
+        while np.any(level >= 0):
+            depth += level >= 0
+            level = np.where(level >= 0, self.parent[np.maximum(level, 0)], -1)
+        return int(depth.max(initial=0))
+
+
+# ==============================================================================
+# STEP 1: Define the builder
+# ==============================================================================
+class ForestBuilder:
+    """
+    Build the forest of the equivalence classes of an EquivalenceClassBuilder
+
+    :param builder: EquivalenceClassBuilder (its classes are built if needed)
+    """
+
+    def __init__(self, builder):
+        self.builder = builder
+        self.classes = builder.classes if builder.classes is not None else builder.build_all_equivalence_classes()
+        self.group_structure = builder.symmetry_helper.group_structure
+        self.forest = None
+
+    def conjugate_rows(self, rows):
+        """
+        Rows of the conjugate hoppings (atoms swapped, cell negated); len(table) if missing
+        """
+        table = self.builder.table
+        return self.builder.pair_rows(table.neighbor_atom_index[rows], table.center_atom_index[rows],
+                                      -np.asarray(table.neighbor_cell[rows], dtype=np.int64))
+
+    def build_forest(self):
+        """
+        :return: Forest
+        """
+        classes = self.classes
+        table = self.builder.table
+        num_classes, num_pairs = len(classes), len(table)
+        reference = classes.reference_pair
+        num_ops = len(self.builder.symmetry_helper)
+
+        # Linear edges: image of every reference under every operation, if it is the reference of a class
+        image_rows = self.builder.image_index(reference, stabilizer_only=False)
+        image_class = classes.class_of_pair[np.minimum(image_rows, num_pairs - 1)]
+        is_reference = (image_rows < num_pairs) & (reference[image_class] == image_rows)
+        image_class = np.where(is_reference, image_class, -1)
+
+        # Hermitian edges: class of the conjugate of every reference
+        conjugate_row = self.conjugate_rows(reference)
+        conjugate_class = np.where(conjugate_row < num_pairs,
+                                   classes.class_of_pair[np.minimum(conjugate_row, num_pairs - 1)], -1)
+
+        source, target = np.nonzero(image_class >= 0)
+        components = UnionFind(num_classes)
+        components.union_edges(np.concatenate([source, np.nonzero(conjugate_class >= 0)[0]]),
+                               np.concatenate([image_class[source, target], conjugate_class[conjugate_class >= 0]]))
+        tree = components.roots()
+        is_root = tree == np.arange(num_classes)
+
+        # Linear children: images of the root's reference, by the first operation reaching them
+        root_operation = np.full(num_classes, num_ops, dtype=np.int64)
+        root_rows, ops = np.nonzero(is_reference & is_root[:, np.newaxis])
+        np.minimum.at(root_operation, image_class[root_rows, ops], ops)
+        linear = root_operation < num_ops
+
+        # Hermitian children: the rest, related to the root through the class of their conjugate
+        hermitian = ~linear
+        conjugate_of_hermitian = conjugate_class[hermitian]
+        if np.any(conjugate_of_hermitian < 0) or not np.all(linear[conjugate_of_hermitian]):
+            raise ValueError("the pair table is not closed under hermitian conjugation")
+        within_class = classes.operation[conjugate_row[hermitian]]
+        root_operation[hermitian] = self.group_structure.multiply(within_class,
+                                                                  root_operation[conjugate_of_hermitian])
+
+        vertex_type = np.where(is_root, ROOT, np.where(linear, LINEAR_CHILD, HERMITIAN_CHILD)).astype(np.int64)
+        parent = np.where(is_root, -1, tree)
+        parent[hermitian] = conjugate_of_hermitian
+        edge_operation = np.where(is_root, -1, root_operation)
+        edge_operation[hermitian] = within_class
+
+        # Roots equivalent to their own conjugate (the conjugate's class is a linear child or the root)
+        hermitian_operation = np.full(num_classes, -1, dtype=np.int64)
+        self_conjugate = np.nonzero(is_root & (conjugate_class >= 0))[0]
+        self_conjugate = self_conjugate[linear[conjugate_class[self_conjugate]]]
+        hermitian_operation[self_conjugate] = self.group_structure.multiply(
+            classes.operation[conjugate_row[self_conjugate]], root_operation[conjugate_class[self_conjugate]])
+
+        self.forest = Forest(parent=parent, vertex_type=vertex_type, edge_operation=edge_operation, tree=tree,
+                             root_operation=root_operation, hermitian_operation=hermitian_operation)
+        return self.forest
+
+    def pair_rules(self):
+        """
+        Transformation rule of every pair of the table from the parameters of its root
+
+        :return: tuple: (root class (P,), operation (P,), hermitian (P,)), for compile_expansion()
+        """
+        forest = self.forest if self.forest is not None else self.build_forest()
+        classes = self.classes
+        num_pairs = len(self.builder.table)
+        pair_class = classes.class_of_pair
+
+        # Linear: reference of the root -> reference of the class -> pair
+        operation = self.group_structure.multiply(classes.operation, forest.root_operation[pair_class])
+        hermitian = forest.vertex_type[pair_class] == HERMITIAN_CHILD
+
+        # Hermitian: the pair is the transpose of its conjugate, which is reached linearly
+        conjugate = self.conjugate_rows(np.nonzero(hermitian)[0])
+        if np.any(conjugate >= num_pairs):
+            raise ValueError("the pair table is not closed under hermitian conjugation")
+        operation[hermitian] = operation[conjugate]
+        return forest.tree[pair_class], operation, hermitian
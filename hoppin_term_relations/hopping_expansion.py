@@ -0,0 +1,175 @@
+import numpy as np
+from dataclasses import dataclass
+
+# ==============================================================================
+# Sparse expansion of the independent parameters into all hopping blocks
+# ==============================================================================
+# Every hopping p of the pair table (center i in cell [0,0,0], neighbor j in
+# cell n) has a block H_p (m_i x n_j). It follows from the independent
+# parameters theta of one root class r by a transformation rule
+#   H_p = D_left(g) X D_right(g)^T,   X = sum_q theta_q B_q    (linear)
+#   X = (sum_q theta_q B_q)^T                                  (hermitian)
+# (notes/TB/symmetry_analysis_steps: TransformationRule), with B_q the basis
+# of the parameters of r (constraint_analyzer.py), g the operation mapping
+# the reference hopping of r onto p, and left / right the center / neighbor
+# site of the reference (swapped for a hermitian rule).
+#
+# Instead of applying the rules edge by edge for every parameter vector, they
+# are compiled once into one sparse matrix M (COO, sorted by row) with
+#   vec(H) = M theta,   vec(H) = all blocks H_p flattened row-major, in pair order
+# The entries of M are computed per (root class, rule type) in one einsum
+# over all hoppings of the group. A full hopping table for new parameter
+# values is then one sparse matvec (np.bincount), and a batch of parameter
+# vectors one sparse matmat (np.add.reduceat over the sorted rows); the
+# matrix can also be handed to scipy.sparse.
+
+# Entries of absolute value below this are dropped from the matrix
+expansion_drop_tolerance = 1e-12
+
+
+@dataclass
+class HoppingExpansion:
+    """
+    Sparse matrix from the independent parameters to the flattened hopping blocks
+
+    rows, cols, data: COO entries, sorted by row
+    num_parameters: number of independent parameters (columns)
+    block_shape: (P, 2) orbitals (m, n) of center and neighbor of each hopping
+    block_offset: (P + 1,) first row of each hopping block
+    """
+    rows: np.ndarray
+    cols: np.ndarray
+    data: np.ndarray
+    num_parameters: int
+    block_shape: np.ndarray
+    block_offset: np.ndarray
+
+    def __post_init__(self):
+        # First entry of each nonempty row, for the batched product
+        self.row_starts = np.concatenate([[0], np.nonzero(np.diff(self.rows))[0] + 1]) if len(self.rows) \
+            else np.zeros(0, dtype=np.int64)
+
+    @property
+    def shape(self):
+        return int(self.block_offset[-1]), self.num_parameters
+
+    @property
+    def nnz(self):
+        return len(self.data)
+
+    def apply(self, parameters):
+        """
+        All hopping blocks for given parameter values
+
+        :param parameters: Parameter vector (num_parameters,), or a batch (num_parameters, K)
+        :return: Flattened hopping blocks, shape (num_rows,) or (num_rows, K)
+        """
+        parameters = np.asarray(parameters, dtype=float)
+        if parameters.shape[0] != self.num_parameters:
+            raise ValueError(f"expected {self.num_parameters} parameters, got {parameters.shape[0]}")
+        num_rows = self.shape[0]
+        if parameters.ndim == 1:
+            return np.bincount(self.rows, weights=self.data * parameters[self.cols], minlength=num_rows)
+
+        result = np.zeros((num_rows,) + parameters.shape[1:])
+        if len(self.rows):
+            products = self.data[:, np.newaxis] * parameters[self.cols]
+            result[self.rows[self.row_starts]] = np.add.reduceat(products, self.row_starts, axis=0)
+        return result
+
+    __matmul__ = apply
+
+    def hopping_block(self, hoppings, row):
+        """
+        Block H_p of one hopping from the output of apply()
+
+        :param hoppings: Flattened hopping blocks, shape (num_rows,)
+        :param row: Pair row p
+        :return: Shape (m, n)
+        """
+        start, stop = self.block_offset[row], self.block_offset[row + 1]
+        return np.asarray(hoppings)[start:stop].reshape(self.block_shape[row])
+
+    def to_scipy(self):
+        """
+        The matrix as scipy.sparse.csr_matrix (needs scipy)
+        """
+        # Imported here: scipy is optional, the NumPy products above do not need it
+        from scipy.sparse import csr_matrix
+        return csr_matrix((self.data, (self.rows, self.cols)), shape=self.shape)
+
+    def to_dense(self):
+        matrix = np.zeros(self.shape)
+        np.add.at(matrix, (self.rows, self.cols), self.data)
+        return matrix
+
+
+# ==============================================================================
+# STEP 1: Define the compilation of the rules
+# ==============================================================================
+def compile_expansion(classes, parameters, site_representations, root_class=None, operation=None,
+                      hermitian=None, drop_tolerance=expansion_drop_tolerance):
+    """
+    Compile the transformation rules of all hoppings into a HoppingExpansion
+
+    Without rules every class is its own root: each hopping follows from the
+    parameters of its class through the operation relating it to the reference.
+    The rules of a forest are ForestBuilder.pair_rules() (parameters solved with
+    that forest), e.g. compile_expansion(classes, parameters, representations, *builder.pair_rules()).
+
+    :param classes: EquivalenceClasses of the pair table
+    :param parameters: IndependentParameters of the classes
+    :param site_representations: Orbital representation of every site, list of (num_ops, d, d)
+    :param root_class: Root class of every pair, shape (P,) (default: its own class)
+    :param operation: Operation mapping the reference of the root class onto every pair, shape (P,)
+    :param hermitian: Whether the rule of every pair is hermitian (reference block transposed), shape (P,)
+    :param drop_tolerance: Entries of absolute value <= drop_tolerance are dropped
+    :return: HoppingExpansion
+    """
+    table = classes.table
+    num_pairs = len(table)
+    root_class = classes.class_of_pair if root_class is None else np.asarray(root_class, dtype=np.int64)
+    operation = classes.operation if operation is None else np.asarray(operation, dtype=np.int64)
+    hermitian = np.zeros(num_pairs, dtype=bool) if hermitian is None else np.asarray(hermitian, dtype=bool)
+
+    orbital_counts = np.array([matrices.shape[-1] for matrices in site_representations], dtype=np.int64)
+    block_shape = np.stack([orbital_counts[table.center_atom_index], orbital_counts[table.neighbor_atom_index]],
+                           axis=1).reshape(-1, 2)
+    block_offset = np.concatenate([[0], np.cumsum(block_shape[:, 0] * block_shape[:, 1])]).astype(np.int64)
+
+    reference = classes.reference_pair
+    reference_sites = np.stack([table.center_atom_index[reference], table.neighbor_atom_index[reference]],
+                               axis=1).astype(np.int64)
+
+    rows, cols, data = [], [], []
+    # One group per (root class, rule type)
+    group_key = root_class * 2 + hermitian
+    order = np.argsort(group_key, kind="stable")
+    starts = np.concatenate([[0], np.nonzero(np.diff(group_key[order]))[0] + 1, [num_pairs]]) if num_pairs \
+        else np.zeros(1, dtype=np.int64)
+    for start, stop in zip(starts[:-1], starts[1:]):
+        pairs = order[start:stop]
+        root, is_hermitian = int(root_class[pairs[0]]), bool(hermitian[pairs[0]])
+        basis = parameters.bases[root]
+        if len(basis) == 0:
+            continue
+        left_site, right_site = reference_sites[root][::-1] if is_hermitian else reference_sites[root]
+        if is_hermitian:
+            basis = np.swapaxes(basis, 1, 2)
+
+        # entries[p, q, a, b] = (D_left(g_p) B_q D_right(g_p)^T)[a, b]
+        g = operation[pairs]
+        entries = np.einsum("pac,qcd,pbd->pqab", site_representations[left_site][g], basis,
+                            site_representations[right_site][g], optimize=True)
+        p, q, a, b = np.nonzero(np.abs(entries) > drop_tolerance)
+        rows.append(block_offset[pairs[p]] + a * block_shape[pairs[p], 1] + b)
+        cols.append(parameters.parameter_offset[root] + q)
+        data.append(entries[p, q, a, b])
+
+    rows = np.concatenate(rows + [np.zeros(0, dtype=np.int64)]).astype(np.int64)
+    cols = np.concatenate(cols + [np.zeros(0, dtype=np.int64)]).astype(np.int64)
+    data = np.concatenate(data + [np.zeros(0)])
+    entry_order = np.lexsort((cols, rows))
+    return HoppingExpansion(rows=rows[entry_order], cols=cols[entry_order], data=data[entry_order],
+                            num_parameters=parameters.total_parameters(), block_shape=block_shape,
+                            block_offset=block_offset)
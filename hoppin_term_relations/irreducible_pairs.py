@@ -0,0 +1,275 @@
+import numpy as np
+
+from hoppin_term_relations.pair_table import PairTable, write_columns_npz
+from hoppin_term_relations.orbit_of_space_group import site_symmetry
+
+# ==============================================================================
+# Symmetry-reduced atom pairs: one representative per space group orbit
+# ==============================================================================
+# A space group operation g = (R|t) (primitive cell basis, acting on
+# fractional coordinates y measured from the Bilbao origin) maps atom j to
+#   R y_j + t = y_perm[g, j] + shift[g, j]
+# (atom permutation table and lattice shift table, see orbit_of_space_group.py).
+# The pair
+#   (center i in cell 0, neighbor j in cell n)
+# is therefore mapped to
+#   (perm[g, i] in cell 0, perm[g, j] in cell shift[g, j] + R n - shift[g, i]),
+# after translating the image back so that its center lies in cell [0,0,0].
+# Operations that differ by a lattice vector act identically on pairs.
+#
+# All pairs of a PairTable are encoded as integer keys; the image keys of all
+# pairs under all operations form an image matrix (num_pairs, num_ops).
+# Images outside the table (the cube of cells of the original neighbor search
+# is not closed under rotations of a skewed cell) are ignored. Every member
+# of an orbit sees the same set of in-table images, so the smallest in-table
+# image index (row minimum) labels the orbit consistently and its pair is
+# the representative.
+#
+# Only the representatives are stored, with the operation tables; the full
+# pair list is reconstructed on demand (IrreduciblePairs.expand()), including
+# for every pair the operation generating it from its representative.
+
+
+# ==============================================================================
+# STEP 1: Define the action of the space group on atoms and pairs
+# ==============================================================================
+def atom_permutation_table(space_group_matrices_primitive, atom_coordinates_frac_origin, atom_types=None):
+    """
+    Atom permutation and lattice shift of every operation (see site_symmetry())
+
+    :param space_group_matrices_primitive: Space group matrices (affine) in primitive cell basis, shape (num_ops, 3, 4)
+    :param atom_coordinates_frac_origin: Fractional atom coordinates measured from the
+                                         space group origin, shape (N_atoms, 3)
+    :param atom_types: Atom type of every atom, shape (N_atoms,) (None: images of any type match)
+    :return: tuple: (rotations (num_ops, 3, 3) int64, permutation (num_ops, N_atoms) int64,
+                     shift (num_ops, N_atoms, 3) int64)
+    :raises ValueError: If an operation maps an atom onto no atom of the same type in the cell, or two atoms coincide
+    """
+    site = site_symmetry(space_group_matrices_primitive, atom_coordinates_frac_origin, atom_types=atom_types)
+    return site.rotations, site.permutation, site.shift
+
+
+def pair_images(center_atom_index, neighbor_atom_index, neighbor_cell, rotations, permutation, shift):
+    """
+    Images of pairs under all operations, re-centered in cell [0,0,0]
+
+    :param center_atom_index: Center atoms, shape (P,)
+    :param neighbor_atom_index: Neighbor atoms, shape (P,)
+    :param neighbor_cell: Neighbor cells, shape (P, 3)
+    :param rotations: Integer rotations, shape (num_ops, 3, 3)
+    :param permutation: Atom permutation table, shape (num_ops, N_atoms)
+    :param shift: Lattice shift table, shape (num_ops, N_atoms, 3)
+    :return: tuple: (center (P, num_ops), neighbor (P, num_ops), cell (P, num_ops, 3))
+    """
+    center = np.asarray(center_atom_index, dtype=np.int64)
+    neighbor = np.asarray(neighbor_atom_index, dtype=np.int64)
+    cell = np.asarray(neighbor_cell, dtype=np.int64)
+
+    image_center = permutation[:, center].T
+    image_neighbor = permutation[:, neighbor].T
+    image_cell = (np.einsum("gab,pb->pga", rotations, cell)
+                  + np.swapaxes(shift[:, neighbor, :], 0, 1)
+                  - np.swapaxes(shift[:, center, :], 0, 1))
+    return image_center, image_neighbor, image_cell
+
+
+def pair_keys(center_atom_index, neighbor_atom_index, neighbor_cell, num_atoms, cell_bound):
+    """
+    Encode pairs as single integers (mixed radix)
+
+    :param center_atom_index: Center atoms, shape (...)
+    :param neighbor_atom_index: Neighbor atoms, shape (...)
+    :param neighbor_cell: Neighbor cells, shape (..., 3), entries in [-cell_bound, cell_bound]
+    :param num_atoms: Number of atoms in the cell
+    :param cell_bound: Largest absolute cell entry
+    :return: int64 keys, shape (...)
+    """
+    radix = 2 * cell_bound + 1
+    cell = np.asarray(neighbor_cell, dtype=np.int64) + cell_bound
+    keys = np.asarray(center_atom_index, dtype=np.int64) * num_atoms + neighbor_atom_index
+    for axis in range(3):
+        keys = keys * radix + cell[..., axis]
+    return keys
+
+
+# ==============================================================================
+# STEP 2: Define the reduced pair table
+# ==============================================================================
+class IrreduciblePairs:
+    """
+    One representative pair per symmetry orbit, expandable to the full pair table
+
+    :param table: PairTable of the representatives (shell columns refer to the full table)
+    :param orbit_size: Number of pairs in the orbit of each representative, shape (num_representatives,)
+    :param rotations: Integer rotations of the operations, shape (num_ops, 3, 3)
+    :param permutation: Atom permutation table, shape (num_ops, N_atoms)
+    :param shift: Lattice shift table, shape (num_ops, N_atoms, 3)
+    """
+
+    def __init__(self, table, orbit_size, rotations, permutation, shift):
+        self.table = table
+        self.orbit_size = np.asarray(orbit_size, dtype=np.int64)
+        self.rotations = np.asarray(rotations, dtype=np.int64)
+        self.permutation = np.asarray(permutation, dtype=np.int64)
+        self.shift = np.asarray(shift, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.table)
+
+    def num_pairs(self):
+        """
+        Number of pairs of the full table
+        """
+        return int(self.orbit_size.sum())
+
+    def expand(self):
+        """
+        Reconstruct the full pair table from the representatives
+
+        Pairs come out in the order of find_neighbors() (center atom, then
+        neighbor cell and atom); for every pair the representative and the
+        first operation g with g(representative) = pair are returned.
+
+        :return: tuple: (PairTable, representative index (P,), operation index (P,))
+        """
+        table = self.table
+        num_atoms = table.num_atoms
+        N = table.neighbor_cell_num_vec
+        num_ops = len(self.rotations)
+
+        center, neighbor, cell = pair_images(table.center_atom_index, table.neighbor_atom_index,
+                                             table.neighbor_cell, self.rotations, self.permutation, self.shift)
+        center, neighbor, cell = center.reshape(-1), neighbor.reshape(-1), cell.reshape(-1, 3)
+
+        # Keep images inside the neighbor cell range, one entry per distinct pair
+        # (representative-major order, so the first occurrence has the smallest operation)
+        inside = np.all(np.abs(cell) <= N, axis=1)
+        source = np.nonzero(inside)[0]
+        cell_index = (((cell[source, 0] + N[0]) * (2*N[1] + 1) + cell[source, 1] + N[1]) * (2*N[2] + 1)
+                      + cell[source, 2] + N[2])
+        global_index = cell_index * num_atoms + neighbor[source]
+        num_images = int(np.prod(2*N + 1)) * num_atoms
+        _, first = np.unique(center[source] * num_images + global_index, return_index=True)
+        source = source[first]
+
+        representative_index = source // num_ops
+        operation_index = source % num_ops
+        center, neighbor, cell = center[source], neighbor[source], cell[source]
+
+        # Distances from the geometry, in the same floating-point order as find_neighbors()
+        cells = cell.astype(np.int64)
+        lattice = table.lattice_basis_primitive
+        cell_translation = (cells[:, 0:1] * lattice[0, :] +
+                            cells[:, 1:2] * lattice[1, :] +
+                            cells[:, 2:3] * lattice[2, :])
+        displacement = ((cell_translation + table.atom_coordinates_cart_cell_000[neighbor])
+                        - table.atom_coordinates_cart_cell_000[center])
+        distance = np.sqrt(np.einsum("ij,ij->i", displacement, displacement))
+
+        full_table = PairTable(
+            atom_position_names=table.atom_position_names,
+            atom_types=table.atom_types,
+            atom_coordinates_frac=table.atom_coordinates_frac,
+            atom_coordinates_cart_cell_000=table.atom_coordinates_cart_cell_000,
+            lattice_basis_primitive=lattice,
+            neighbor_cell_num_vec=N,
+            search_cell_num_vec=table.search_cell_num_vec,
+            center_atom_index=center,
+            neighbor_atom_index=neighbor,
+            neighbor_cell=cell,
+            distance=distance,
+            shell_index=table.shell_index[representative_index],
+            unique_distances=table.unique_distances,
+            shell_lower=table.shell_lower,
+            shell_upper=table.shell_upper,
+            shell_multiplicity=table.shell_multiplicity,
+            shell_gap_to_next=table.shell_gap_to_next
+        )
+        return full_table, representative_index, operation_index
+
+    def records(self):
+        """
+        Representatives as pair dictionaries (see PairTable.record()) with their orbit size
+        """
+        records = self.table.records()
+        for record, orbit_size in zip(records, self.orbit_size.tolist()):
+            record['orbit_size'] = orbit_size
+        return records
+
+    def to_columns(self):
+        """
+        Columns of the representative table plus orbit sizes and operation tables
+        """
+        columns = self.table.to_columns()
+        columns["orbit_size"] = self.orbit_size
+        columns["operation_rotations"] = self.rotations
+        columns["atom_permutation"] = self.permutation
+        columns["atom_shift"] = self.shift
+        return columns
+
+    @classmethod
+    def from_columns(cls, columns):
+        """
+        Rebuild the reduced table from the output of to_columns()
+        """
+        return cls(PairTable.from_columns(columns), columns["orbit_size"], columns["operation_rotations"],
+                   columns["atom_permutation"], columns["atom_shift"])
+
+    def save_npz(self, file):
+        """
+        Write the reduced table to a compressed .npz file
+        """
+        write_columns_npz(file, self.to_columns())
+
+
+# ==============================================================================
+# STEP 3: Define the reduction of a full pair table
+# ==============================================================================
+def reduce_pairs(pair_table, space_group_representations):
+    """
+    Reduce a pair table to one representative per space group orbit
+
+    :param pair_table: PairTable (output of find_neighbors())
+    :param space_group_representations: Output of generate_space_group_representations()
+    :return: IrreduciblePairs
+    :raises ValueError: If the atom positions are not invariant under the space group
+    """
+    lattice = pair_table.lattice_basis_primitive
+    num_atoms = pair_table.num_atoms
+
+    # Fractional coordinates measured from the space group origin
+    positions = pair_table.atom_coordinates_cart_cell_000 @ np.linalg.inv(lattice)
+    rotations, permutation, shift = atom_permutation_table(
+        space_group_representations["space_group_matrices_primitive"], positions, pair_table.atom_types)
+
+    # Keys of the table and of all images
+    image_center, image_neighbor, image_cell = pair_images(
+        pair_table.center_atom_index, pair_table.neighbor_atom_index, pair_table.neighbor_cell,
+        rotations, permutation, shift)
+    N = np.asarray(pair_table.neighbor_cell_num_vec, dtype=np.int64)
+    cell_bound = int(max(np.abs(image_cell).max(initial=0), N.max(initial=0)))
+    keys = pair_keys(pair_table.center_atom_index, pair_table.neighbor_atom_index, pair_table.neighbor_cell,
+                     num_atoms, cell_bound)
+    image_keys = pair_keys(image_center, image_neighbor, image_cell, num_atoms, cell_bound)
+
+    # Image matrix: index of every image in the table (num_pairs = not in the table)
+    order = np.argsort(keys, kind="stable")
+    positions_in_sorted = np.minimum(np.searchsorted(keys[order], image_keys), len(keys) - 1)
+    found = keys[order][positions_in_sorted] == image_keys
+    image_index = np.where(found, order[positions_in_sorted], len(keys))
+
+    # Row minimum: smallest pair of the orbit that lies in the table
+    orbit_minimum = image_index.min(axis=1)
+    representatives = np.nonzero(orbit_minimum == np.arange(len(keys)))[0]
+    orbit_size = np.bincount(orbit_minimum, minlength=len(keys))[representatives]
+
+    return IrreduciblePairs(pair_table.take(representatives), orbit_size, rotations, permutation, shift)
+
+
+def load_pair_columns(columns):
+    """
+    PairTable or IrreduciblePairs from stage columns (to_columns() of either, or read_columns_npz())
+    """
+    if "orbit_size" in columns:
+        return IrreduciblePairs.from_columns(columns)
+    return PairTable.from_columns(columns)
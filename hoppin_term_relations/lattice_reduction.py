@@ -0,0 +1,69 @@
+import numpy as np
+
+# ==============================================================================
+# LLL reduction of a lattice basis
+# ==============================================================================
+# A skewed basis (e.g. a hexagonal primitive cell given with a 120 degree angle
+# or a sheared supercell) has small heights between lattice planes compared to
+# its vector lengths, so a cutoff sphere spans many cells along some axes.
+# Lenstra-Lenstra-Lovasz reduction finds an equivalent basis of short, nearly
+# orthogonal vectors:
+#   reduced_basis = M @ lattice_basis,  M integer with det(M) = +-1
+# Cells n' of the reduced basis correspond to cells n = n' @ M of the original
+# basis. Only the first num_axes vectors are reduced (the periodic directions
+# of a 2D system); the others are kept.
+
+# Lovasz condition parameter
+lll_delta = 0.75
+
+
+def gram_schmidt(basis):
+    """
+    Gram-Schmidt orthogonalization of the rows of basis
+
+    :param basis: Basis vectors (rows), shape (n, 3)
+    :return: tuple: (orthogonal vectors (n, 3), coefficients mu (n, n))
+    """
+    n = len(basis)
+    orthogonal = np.zeros_like(basis, dtype=float)
+    mu = np.zeros((n, n))
+    for i in range(n):
+        orthogonal[i] = basis[i]
+        for j in range(i):
+            mu[i, j] = basis[i] @ orthogonal[j] / (orthogonal[j] @ orthogonal[j])
+            orthogonal[i] = orthogonal[i] - mu[i, j] * orthogonal[j]
+    return orthogonal, mu
+
+
+def lll_reduce(lattice_basis, num_axes=3):
+    """
+    LLL-reduce the first num_axes lattice vectors
+
+    :param lattice_basis: Lattice vectors (rows), shape (3, 3)
+    :param num_axes: Number of leading vectors to reduce (3 for 3D, 2 for 2D systems)
+    :return: tuple: (reduced basis (3, 3) = M @ lattice_basis, integer unimodular M (3, 3))
+    """
+    lattice_basis = np.asarray(lattice_basis, dtype=float)
+    M = np.eye(3, dtype=np.int64)
+
+    k = 1
+    while k < num_axes:
+        basis = M[:num_axes] @ lattice_basis
+        orthogonal, mu = gram_schmidt(basis)
+
+        # Size reduction of vector k against all earlier vectors
+        for j in range(k - 1, -1, -1):
+            q = int(np.rint(mu[k, j]))
+            if q != 0:
+                M[k] -= q * M[j]
+                basis = M[:num_axes] @ lattice_basis
+                orthogonal, mu = gram_schmidt(basis)
+
+        # Lovasz condition: swap if vector k is much shorter than vector k-1 (projected)
+        if orthogonal[k] @ orthogonal[k] >= (lll_delta - mu[k, k - 1]**2) * (orthogonal[k - 1] @ orthogonal[k - 1]):
+            k += 1
+        else:
+            M[[k, k - 1]] = M[[k - 1, k]]
+            k = max(k - 1, 1)
+
+    return M @ lattice_basis, M
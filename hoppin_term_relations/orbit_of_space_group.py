@@ -0,0 +1,218 @@
+import numpy as np
+from dataclasses import dataclass
+
+# ==============================================================================
+# Site symmetry of the atoms of the primitive cell
+# ==============================================================================
+# A space group operation g = (R|t) (primitive cell basis, fractional
+# coordinates y measured from the Bilbao origin) maps site j onto
+#   R y_j + t = y_perm[g, j] + shift[g, j]
+# site_symmetry() applies the whole operation stack to all sites in one
+# broadcast, reduces the images modulo the lattice and matches them to the
+# sites through a hash of snapped coordinates (PositionHash), i.e. one lookup
+# per (operation, site) and no comparison of every image with every site.
+# An image only matches a site of the same atom type.
+# From the permutation and shift tables follow, without further geometry:
+#   - stabilizers: the operations are listed modulo lattice translations, so
+#     g stands for all (R|t + L); one of them fixes site j (the one with
+#     L = -shift[g, j]) iff perm[g, j] = j
+#   - orbits (Wyckoff positions): {perm[g, j] for all g}; every member of an
+#     orbit has the same smallest member, which labels the orbit
+#   - coset operations: for every site the first g mapping the first site of
+#     its orbit onto it
+
+# Tolerance when matching atom images to atom positions (fractional coordinates)
+position_tolerance = 1e-5
+
+
+# ==============================================================================
+# STEP 1: Define the hash of snapped site coordinates
+# ==============================================================================
+# Grid offsets probed by a lookup, own grid cell first
+_probe_offsets = np.array(np.meshgrid([-1, 0, 1], [-1, 0, 1], [-1, 0, 1], indexing="ij")).reshape(3, -1).T
+_probe_offsets = _probe_offsets[np.argsort(np.abs(_probe_offsets).sum(axis=1), kind="stable")]
+
+
+class PositionHash:
+    """
+    Hash index of the sites of the primitive cell by snapped fractional coordinates
+
+    Coordinates are reduced modulo 1 and snapped to a grid of spacing
+    tolerance; a point within tolerance of a site lies in the grid cell of
+    the site or a neighboring one, so a lookup probes at most 27 keys.
+
+    :param atom_coordinates_frac: Fractional site coordinates, shape (N_atoms, 3)
+    :param tolerance: Matching tolerance (1/tolerance must be an integer)
+    :raises ValueError: If two sites coincide within the tolerance
+    """
+
+    def __init__(self, atom_coordinates_frac, tolerance=position_tolerance):
+        self.positions = np.asarray(atom_coordinates_frac, dtype=float).reshape(-1, 3)
+        self.tolerance = tolerance
+        self.num_bins = int(round(1 / tolerance))
+
+        keys = self._grid_keys(self._grid(self.positions))
+        self.site_of_key = {}
+        for site, key in enumerate(keys.tolist()):
+            if key in self.site_of_key:
+                raise ValueError(f"sites {self.site_of_key[key]} and {site} coincide "
+                                 f"within tolerance {tolerance}")
+            self.site_of_key[key] = site
+
+        # Sorted copy of the table for vectorized lookups
+        self._sorted_keys = np.array(sorted(self.site_of_key), dtype=np.int64)
+        self._sorted_sites = np.array([self.site_of_key[key] for key in self._sorted_keys.tolist()],
+                                      dtype=np.int64)
+
+    def _grid(self, frac):
+        return np.mod(np.rint(np.mod(frac, 1.0) / self.tolerance).astype(np.int64), self.num_bins)
+
+    def _grid_keys(self, grid):
+        grid = np.mod(grid, self.num_bins)
+        return (grid[..., 0] * self.num_bins + grid[..., 1]) * self.num_bins + grid[..., 2]
+
+    def lookup(self, frac):
+        """
+        Site and cell of one point
+
+        :param frac: Fractional coordinates, shape (3,)
+        :return: tuple: (site, cell (3,) int) or (-1, None) if no site lies within tolerance
+        """
+        frac = np.asarray(frac, dtype=float)
+        grid = self._grid(frac)
+        for offset in _probe_offsets:
+            site = self.site_of_key.get(int(self._grid_keys(grid + offset)), -1)
+            if site >= 0:
+                cell = np.rint(frac - self.positions[site])
+                if np.all(np.abs(frac - self.positions[site] - cell) < self.tolerance):
+                    return site, cell.astype(np.int64)
+        return -1, None
+
+    def lookup_many(self, frac):
+        """
+        Sites and cells of many points at once
+
+        :param frac: Fractional coordinates, shape (..., 3)
+        :return: tuple: (sites (...) with -1 where no site matches, cells (..., 3) int)
+        """
+        frac = np.asarray(frac, dtype=float)
+        grid = self._grid(frac)
+        sites = np.full(frac.shape[:-1], -1, dtype=np.int64)
+        cells = np.zeros(frac.shape, dtype=np.int64)
+        for offset in _probe_offsets:
+            unmatched = sites < 0
+            if not np.any(unmatched):
+                break
+            keys = self._grid_keys(grid[unmatched] + offset)
+            slot = np.minimum(np.searchsorted(self._sorted_keys, keys), len(self._sorted_keys) - 1)
+            candidate = np.where(self._sorted_keys[slot] == keys, self._sorted_sites[slot], -1)
+            difference = frac[unmatched] - self.positions[np.maximum(candidate, 0)]
+            cell = np.rint(difference)
+            match = (candidate >= 0) & np.all(np.abs(difference - cell) < self.tolerance, axis=-1)
+            sites[unmatched] = np.where(match, candidate, -1)
+            cells[unmatched] = np.where(match[..., np.newaxis], cell.astype(np.int64), 0)
+        return sites, cells
+
+
+# ==============================================================================
+# STEP 2: Define the site symmetry tables
+# ==============================================================================
+@dataclass
+class SiteSymmetry:
+    """
+    Action of the space group on the sites of the primitive cell
+
+    rotations: (num_ops, 3, 3) integer rotations in primitive basis
+    permutation: (num_ops, N_atoms) image site of every site
+    shift: (num_ops, N_atoms, 3) lattice vector of every image
+    stabilizer_mask: (N_atoms, num_ops) True where the operation (up to a lattice translation) fixes the site
+    orbit_labels: (N_atoms,) Wyckoff position of every site (0, 1, ... in order of the first site)
+    orbit_representatives: (num_orbits,) first site of every orbit
+    atom_number: (N_atoms,) number of every site within its orbit
+    coset_operations: (N_atoms,) first operation mapping the orbit representative onto the site
+    """
+    rotations: np.ndarray
+    permutation: np.ndarray
+    shift: np.ndarray
+    stabilizer_mask: np.ndarray
+    orbit_labels: np.ndarray
+    orbit_representatives: np.ndarray
+    atom_number: np.ndarray
+    coset_operations: np.ndarray
+
+    @property
+    def num_orbits(self):
+        return len(self.orbit_representatives)
+
+    def stabilizer(self, site):
+        """
+        Indices of the operations fixing a site (up to a lattice translation)
+        """
+        return np.nonzero(self.stabilizer_mask[site])[0]
+
+    def orbit_members(self, label):
+        """
+        Sites of one orbit (Wyckoff position), in order of their atom_number
+        """
+        return np.nonzero(self.orbit_labels == label)[0]
+
+
+def site_symmetry(space_group_matrices_primitive, atom_coordinates_frac_origin, tolerance=position_tolerance,
+                  atom_types=None):
+    """
+    Permutation tables, stabilizers and orbits of all sites under all operations
+
+    :param space_group_matrices_primitive: Space group matrices (affine) in primitive cell basis, shape (num_ops, 3, 4)
+    :param atom_coordinates_frac_origin: Fractional site coordinates measured from the
+                                         space group origin, shape (N_atoms, 3)
+    :param tolerance: Matching tolerance (fractional coordinates)
+    :param atom_types: Atom type of every site, shape (N_atoms,); None accepts images of any type
+    :return: SiteSymmetry
+    :raises ValueError: If an operation maps a site onto no site (of the same atom type) of the cell,
+                        or two sites coincide
+    """
+    matrices = np.asarray(space_group_matrices_primitive, dtype=float)
+    positions = np.asarray(atom_coordinates_frac_origin, dtype=float).reshape(-1, 3)
+    rotations = np.rint(matrices[:, :, 0:3]).astype(np.int64)
+    num_atoms = len(positions)
+
+    # Images R y_j + t of all sites under all operations, shape (num_ops, N_atoms, 3)
+    images = np.einsum("gab,jb->gja", matrices[:, :, 0:3], positions) + matrices[:, np.newaxis, :, 3]
+    permutation, shift = PositionHash(positions, tolerance).lookup_many(images)
+    if atom_types is not None:
+        # An image on a site of another atom type is no image
+        atom_types = np.asarray(atom_types).reshape(-1)
+        other_type = atom_types[np.maximum(permutation, 0)] != atom_types[np.newaxis, :]
+        permutation = np.where(other_type, -1, permutation)
+    if np.any(permutation < 0):
+        raise ValueError("atom positions are not invariant under the space group "
+                         "(an operation maps an atom onto no atom of the same type in the cell)")
+
+    sites = np.arange(num_atoms)
+    stabilizer_mask = (permutation == sites).T
+
+    # Orbits labelled by their smallest member, renumbered in order of appearance
+    orbit_minimum = permutation.min(axis=0) if len(permutation) else sites
+    orbit_representatives, orbit_labels = np.unique(orbit_minimum, return_inverse=True)
+    orbit_labels = orbit_labels.reshape(-1)
+
+    # Number of each site within its orbit (rank in a stable sort by orbit)
+    order = np.argsort(orbit_labels, kind="stable")
+    orbit_start = np.searchsorted(orbit_labels[order], orbit_labels[order], side="left")
+    atom_number = np.empty(num_atoms, dtype=np.int64)
+    atom_number[order] = np.arange(num_atoms) - orbit_start
+
+    # First operation mapping the orbit representative onto each site
+    representative = orbit_representatives[orbit_labels]
+    coset_operations = np.argmax(permutation[:, representative] == sites, axis=0)
+
+    return SiteSymmetry(
+        rotations=rotations,
+        permutation=permutation,
+        shift=shift,
+        stabilizer_mask=stabilizer_mask,
+        orbit_labels=orbit_labels.astype(np.int64),
+        orbit_representatives=orbit_representatives.astype(np.int64),
+        atom_number=atom_number,
+        coset_operations=coset_operations.astype(np.int64),
+    )
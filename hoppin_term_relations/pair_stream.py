@@ -0,0 +1,355 @@
+import numpy as np
+import json
+from dataclasses import dataclass
+
+from hoppin_term_relations.find_neighbors import (
+    extract_neighbor_parameters, cell_translations, cutoff_cell_range, cell_list_pairs,
+    search_frame, original_cells, cutoff_tolerance)
+from hoppin_term_relations.distance_shells import ShellHistogram
+from hoppin_term_relations.pair_table import PairTable
+
+# ==============================================================================
+# Memory-bounded streaming of atom pairs
+# ==============================================================================
+# NeighborStream produces the pairs of find_neighbors() in blocks of at most
+# block_size pairs, in the same order (center atom, neighbor cell, neighbor
+# atom), without holding the full list:
+#   - neighbors=N: the (center, image) grid is cut into flat index ranges
+#   - neighbor_cutoff / neighbor_shells: centers are processed in groups sized
+#     from the expected number of pairs per center (cell list per group);
+#     neighbor_shells first streams through the growing cutoffs with a
+#     histogram only, then streams the pairs up to the k-th shell
+# A ShellHistogram is updated with every block, so the distance shells are
+# known at the end without the distances.
+#
+# Blocks can go to a consumer callback (NeighborStream.run()) or to an
+# append-only binary file (NeighborStream.write()): fixed-size records
+# (pair_record_dtype) appended block by block, plus a JSON sidecar file
+# "<file>.json" with the atom table, cell ranges and shells written at the
+# end. PairStreamFile reads such a file back block by block (memory-mapped).
+#
+# The stream always holds the full pair list (neighbor_symmetry_reduction
+# applies to the in-memory table of find_neighbors() only).
+
+# Default maximal number of pairs per block
+default_pair_block_size = 1 << 20
+
+# One pair of the binary stream file
+pair_record_dtype = np.dtype([("center", "<i4"), ("neighbor", "<i4"), ("cell", "<i4", (3,)), ("distance", "<f8")])
+
+
+@dataclass
+class PairBlock:
+    """
+    Consecutive pairs of the stream
+
+    start: index of the first pair in the full list
+    center_atom_index, neighbor_atom_index: (B,) atom indices
+    neighbor_cell: (B, 3) neighbor cells
+    distance: (B,) distances
+    """
+    start: int
+    center_atom_index: np.ndarray
+    neighbor_atom_index: np.ndarray
+    neighbor_cell: np.ndarray
+    distance: np.ndarray
+
+    def __len__(self):
+        return len(self.distance)
+
+
+# ==============================================================================
+# STEP 1: Define the block generator
+# ==============================================================================
+class NeighborStream:
+    """
+    Pairs of find_neighbors() generated block by block
+
+    After blocks() is exhausted, histogram, num_pairs, neighbor_cell_num_vec
+    and search_cell_num_vec describe the whole stream.
+
+    :param parsed_config: Parsed configuration dictionary (output of parse_conf.py)
+    :param space_group_representations: Output of generate_space_group_representations()
+    :param block_size: Maximal number of pairs per block
+    :raises KeyError: If a required key is missing
+    :raises ValueError: If neighbor_cutoff or neighbor_shells is not positive or a shell tolerance is negative
+    """
+
+    def __init__(self, parsed_config, space_group_representations, block_size=default_pair_block_size):
+        params = extract_neighbor_parameters(parsed_config, space_group_representations)
+        self.params = params
+        self.dim = parsed_config["dim"]
+        self.block_size = max(int(block_size), 1)
+
+        self.lattice_basis_primitive = params["lattice_basis_primitive"]
+        self.atom_coordinates_frac = params["atom_coordinates_frac"]
+        self.atom_coordinates_cart_cell_000 = (self.atom_coordinates_frac @ self.lattice_basis_primitive
+                                               - params["space_group_origin_cart"])
+
+        if params["neighbor_cutoff"] is not None and params["neighbor_cutoff"] <= 0:
+            raise ValueError(f"neighbor_cutoff must be positive, got {params['neighbor_cutoff']}")
+        if params["neighbor_shells"] is not None and params["neighbor_shells"] <= 0:
+            raise ValueError(f"neighbor_shells must be positive, got {params['neighbor_shells']}")
+
+        self.histogram = ShellHistogram(params["shell_atol"], params["shell_rtol"])
+        self.next_shell_lower = np.inf
+        self.num_pairs = 0
+        self.neighbor_cell_num_vec = np.zeros(3, dtype=np.int64)
+        self.search_cell_num_vec = np.zeros(3, dtype=np.int64)
+
+    # --------------------------------------------------------------------------
+    def blocks(self):
+        """
+        Generate the pair blocks in find_neighbors() order
+
+        :return: Generator of PairBlock
+        """
+        params = self.params
+        self.histogram = ShellHistogram(params["shell_atol"], params["shell_rtol"])
+        self.num_pairs = 0
+        self.neighbor_cell_num_vec = np.zeros(3, dtype=np.int64)
+
+        if params["neighbor_cutoff"] is None and params["neighbor_shells"] is None:
+            self.neighbor_cell_num_vec = np.asarray(params["neighbor_cell_num_vec"], dtype=np.int64)
+            self.search_cell_num_vec = self.neighbor_cell_num_vec
+            raw_blocks = self._cell_range_blocks(self.neighbor_cell_num_vec)
+            max_distance = np.inf
+        elif params["neighbor_shells"] is None:
+            raw_blocks = self._cutoff_blocks(params["neighbor_cutoff"])
+            max_distance = np.inf
+        else:
+            cutoff, max_distance = self._shells_cutoff(params["neighbor_shells"])
+            raw_blocks = self._cutoff_blocks(cutoff)
+
+        for center_idx, neighbor_idx, pair_cells, distances in raw_blocks:
+            if max_distance < np.inf:
+                keep = distances <= max_distance
+                center_idx, neighbor_idx, pair_cells, distances = \
+                    center_idx[keep], neighbor_idx[keep], pair_cells[keep], distances[keep]
+
+            for start in range(0, len(distances), self.block_size):
+                stop = start + self.block_size
+                block = PairBlock(self.num_pairs, center_idx[start:stop], neighbor_idx[start:stop],
+                                  pair_cells[start:stop], distances[start:stop])
+                self.histogram.add(block.distance)
+                if len(block) and params["lattice_reduction"]:
+                    # Range of the pair cells in the original basis
+                    self.neighbor_cell_num_vec = np.maximum(self.neighbor_cell_num_vec,
+                                                            np.abs(block.neighbor_cell).max(axis=0))
+                self.num_pairs += len(block)
+                yield block
+
+    def _cell_range_blocks(self, neighbor_cell_num_vec):
+        """
+        All (center, image) pairs of the cell range, cut into flat index ranges
+        """
+        cart_000 = self.atom_coordinates_cart_cell_000
+        lattice = self.lattice_basis_primitive
+        atom_num_in_1_cell = len(cart_000)
+        range_shape = tuple(2 * np.asarray(neighbor_cell_num_vec) + 1)
+        num_images = int(np.prod(range_shape)) * atom_num_in_1_cell
+
+        for start in range(0, atom_num_in_1_cell * num_images, self.block_size):
+            flat = np.arange(start, min(start + self.block_size, atom_num_in_1_cell * num_images))
+            center_idx = flat // num_images
+            image_idx = flat % num_images
+
+            # Image index g = cell index * N_atoms + atom index, cells in cell_translations() order
+            cells = np.stack(np.unravel_index(image_idx // atom_num_in_1_cell, range_shape), axis=-1) \
+                - np.asarray(neighbor_cell_num_vec)
+            neighbor_idx = image_idx % atom_num_in_1_cell
+
+            # Same floating-point operations as search_pairs()
+            cell_translation = (cells[:, 0:1] * lattice[0, :] +
+                                cells[:, 1:2] * lattice[1, :] +
+                                cells[:, 2:3] * lattice[2, :])
+            displacement = (cell_translation + cart_000[neighbor_idx]) - cart_000[center_idx]
+            distances = np.sqrt(np.einsum("ij,ij->i", displacement, displacement))
+            yield center_idx, neighbor_idx, cells, distances
+
+    def _cutoff_blocks(self, cutoff):
+        """
+        Pairs within cutoff, processed in groups of center atoms
+        """
+        atom_num_in_1_cell = len(self.atom_coordinates_frac)
+        search_basis, M, wrap, search_cart, search_frac = search_frame(
+            self.atom_coordinates_cart_cell_000, self.atom_coordinates_frac, self.lattice_basis_primitive,
+            self.dim, self.params["lattice_reduction"])
+        search_cell_num_vec = cutoff_cell_range(search_basis, search_frac, cutoff, self.dim)
+        self.search_cell_num_vec = np.asarray(search_cell_num_vec, dtype=np.int64)
+        if M is None:
+            self.neighbor_cell_num_vec = self.search_cell_num_vec
+
+        # All images of the search range (one entry per atom and cell, not per pair)
+        cells = cell_translations(search_cell_num_vec)
+        cell_translation = (cells[:, 0:1] * search_basis[0, :] +
+                            cells[:, 1:2] * search_basis[1, :] +
+                            cells[:, 2:3] * search_basis[2, :])
+        images_cart = (cell_translation[:, np.newaxis, :] + search_cart[np.newaxis, :, :]).reshape(-1, 3)
+
+        # Expected pairs per center: atoms per volume times the cutoff sphere
+        periodic_axes = 3 if self.dim == 3 else 2
+        volume = abs(np.linalg.det(self.lattice_basis_primitive))
+        sphere = 4/3 * np.pi * (cutoff + cutoff_tolerance)**3
+        if periodic_axes == 2:
+            area = np.linalg.norm(np.cross(self.lattice_basis_primitive[0], self.lattice_basis_primitive[1]))
+            volume, sphere = area, np.pi * (cutoff + cutoff_tolerance)**2
+        pairs_per_center = atom_num_in_1_cell * sphere / volume + 1
+        centers_per_group = max(1, int(self.block_size // pairs_per_center))
+
+        for first_center in range(0, atom_num_in_1_cell, centers_per_group):
+            centers = np.arange(first_center, min(first_center + centers_per_group, atom_num_in_1_cell))
+            local_center, image_idx, distances = cell_list_pairs(search_cart[centers], images_cart, cutoff)
+            center_idx = centers[local_center]
+            neighbor_idx = image_idx % atom_num_in_1_cell
+            pair_cells = original_cells(cells[image_idx // atom_num_in_1_cell], M, wrap, center_idx, neighbor_idx)
+
+            if M is None:
+                order = np.lexsort((image_idx, center_idx))
+            else:
+                order = np.lexsort((neighbor_idx, pair_cells[:, 2], pair_cells[:, 1], pair_cells[:, 0], center_idx))
+            yield center_idx[order], neighbor_idx[order], pair_cells[order], distances[order]
+
+    def _shells_cutoff(self, neighbor_shells):
+        """
+        Cutoff containing the first neighbor_shells nonzero shells, found with histogram-only passes
+
+        :return: tuple: (search cutoff, largest distance of the last kept shell)
+        """
+        atol = self.params["shell_atol"]
+        periodic_axes = 3 if self.dim == 3 else 2
+        cutoff = float(np.min(np.linalg.norm(self.lattice_basis_primitive[:periodic_axes], axis=1)))
+        while True:
+            histogram = ShellHistogram(atol, self.params["shell_rtol"])
+            for _, _, _, distances in self._cutoff_blocks(cutoff):
+                histogram.add(distances)
+            nonzero_shells = np.nonzero(histogram.lower > atol)[0]
+            if len(nonzero_shells) > neighbor_shells:
+                break
+            cutoff *= 1.5
+
+        last_shell = nonzero_shells[neighbor_shells - 1]
+        self.next_shell_lower = float(histogram.lower[last_shell + 1])
+        return cutoff, float(histogram.upper[last_shell])
+
+    # --------------------------------------------------------------------------
+    def run(self, consumer):
+        """
+        Pass every block to consumer(block)
+
+        :return: self (histogram and ranges describe the stream)
+        """
+        for block in self.blocks():
+            consumer(block)
+        return self
+
+    def metadata(self):
+        """
+        Atom table, cell ranges and shells of the finished stream (JSON-serializable)
+        """
+        shells = self.histogram.shells(self.next_shell_lower)
+        return {
+            "num_pairs": self.num_pairs,
+            "atom_position_names": list(self.params["atom_position_names"]),
+            "atom_types": list(self.params["atom_types"]),
+            "atom_coordinates_frac": np.asarray(self.atom_coordinates_frac, dtype=float).tolist(),
+            "atom_coordinates_cart_cell_000": self.atom_coordinates_cart_cell_000.tolist(),
+            "lattice_basis_primitive": self.lattice_basis_primitive.tolist(),
+            "neighbor_cell_num_vec": self.neighbor_cell_num_vec.tolist(),
+            "search_cell_num_vec": self.search_cell_num_vec.tolist(),
+            "unique_distances": shells.shell_distances.tolist(),
+            "shell_lower": shells.shell_lower.tolist(),
+            "shell_upper": shells.shell_upper.tolist(),
+            "shell_multiplicity": shells.multiplicities.tolist(),
+            "shell_gap_to_next": [float(gap) for gap in shells.gap_to_next],
+        }
+
+    def write(self, file, consumer=None):
+        """
+        Append all blocks to a binary stream file and write its JSON sidecar
+
+        :param file: Path of the stream file (overwritten)
+        :param consumer: Optional callback, called with every block after it is written
+        :return: PairStreamFile reading the written file
+        """
+        with open(file, "wb") as stream:
+            for block in self.blocks():
+                records = np.empty(len(block), dtype=pair_record_dtype)
+                records["center"] = block.center_atom_index
+                records["neighbor"] = block.neighbor_atom_index
+                records["cell"] = block.neighbor_cell
+                records["distance"] = block.distance
+                stream.write(records.tobytes())
+                if consumer is not None:
+                    consumer(block)
+
+        with open(str(file) + ".json", "w") as sidecar:
+            json.dump(self.metadata(), sidecar)
+        return PairStreamFile(file)
+
+
+# ==============================================================================
+# STEP 2: Define the reader of stream files
+# ==============================================================================
+class PairStreamFile:
+    """
+    Pairs written by NeighborStream.write(), read block by block
+
+    :param file: Path of the stream file (the sidecar is file + ".json")
+    """
+
+    def __init__(self, file):
+        self.file = str(file)
+        with open(self.file + ".json", "r") as sidecar:
+            self.metadata = json.load(sidecar)
+        self.unique_distances = np.array(self.metadata["unique_distances"], dtype=float)
+        self.shell_lower = np.array(self.metadata["shell_lower"], dtype=float)
+        self.shell_upper = np.array(self.metadata["shell_upper"], dtype=float)
+        self.shell_multiplicity = np.array(self.metadata["shell_multiplicity"], dtype=np.int64)
+        self.shell_gap_to_next = np.array(self.metadata["shell_gap_to_next"], dtype=float)
+        self.neighbor_cell_num_vec = np.array(self.metadata["neighbor_cell_num_vec"], dtype=np.int64)
+        self.search_cell_num_vec = np.array(self.metadata["search_cell_num_vec"], dtype=np.int64)
+
+    def __len__(self):
+        return int(self.metadata["num_pairs"])
+
+    def _records(self):
+        if len(self) == 0:
+            return np.zeros(0, dtype=pair_record_dtype)
+        return np.memmap(self.file, dtype=pair_record_dtype, mode="r", shape=(len(self),))
+
+    def _table(self, records):
+        metadata = self.metadata
+        return PairTable(
+            atom_position_names=metadata["atom_position_names"],
+            atom_types=metadata["atom_types"],
+            atom_coordinates_frac=metadata["atom_coordinates_frac"],
+            atom_coordinates_cart_cell_000=metadata["atom_coordinates_cart_cell_000"],
+            lattice_basis_primitive=metadata["lattice_basis_primitive"],
+            neighbor_cell_num_vec=self.neighbor_cell_num_vec,
+            search_cell_num_vec=self.search_cell_num_vec,
+            center_atom_index=records["center"],
+            neighbor_atom_index=records["neighbor"],
+            neighbor_cell=records["cell"],
+            distance=records["distance"],
+            shell_index=np.searchsorted(self.shell_lower, records["distance"], side="right") - 1,
+            unique_distances=self.unique_distances,
+            shell_lower=self.shell_lower,
+            shell_upper=self.shell_upper,
+            shell_multiplicity=self.shell_multiplicity,
+            shell_gap_to_next=self.shell_gap_to_next
+        )
+
+    def iter_blocks(self, block_size=default_pair_block_size):
+        """
+        Generate PairTable blocks of at most block_size pairs (with shell indices)
+        """
+        records = self._records()
+        for start in range(0, len(records), block_size):
+            yield self._table(np.array(records[start:start + block_size]))
+
+    def to_table(self):
+        """
+        The whole stream as one PairTable
+        """
+        return self._table(np.array(self._records()))
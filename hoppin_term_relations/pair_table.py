@@ -0,0 +1,255 @@
+import numpy as np
+
+# ==============================================================================
+# Columnar table of atom pairs found by find_neighbors.py
+# ==============================================================================
+# Per-atom information (names, types, coordinates) is stored once in an atom
+# table; every pair is one row of integer / float NumPy columns:
+#
+#   center_atom_index    (P,)   int32   atom in cell [0,0,0]
+#   neighbor_atom_index  (P,)   int32   atom in cell neighbor_cell
+#   neighbor_cell        (P, 3) int8/int16/int32 (smallest type holding the cells)
+#   distance             (P,)   float64 distance
+#   shell_index          (P,)   int32   distance shell (see distance_shells.py)
+#
+# and every distance shell is one row of the shell columns unique_distances
+# (mean distance), shell_lower, shell_upper, shell_multiplicity and
+# shell_gap_to_next.
+#
+# The dictionaries of the original find_neighbors output are only built on
+# demand (record(), iteration), e.g. for debugging or the JSON output of the
+# stage script. The table can optionally be written to a .npz file.
+
+
+class PairTable:
+    """
+    Atom pairs as NumPy columns with an atom table
+
+    :param atom_position_names: List of position names, indexed by atom index
+    :param atom_types: List of atom types, indexed by atom index
+    :param atom_coordinates_frac: Fractional coordinates, shape (N_atoms, 3)
+    :param atom_coordinates_cart_cell_000: Cartesian coordinates in cell [0,0,0]
+                                           (shifted by the space group origin), shape (N_atoms, 3)
+    :param lattice_basis_primitive: Lattice vectors (rows), shape (3, 3)
+    :param neighbor_cell_num_vec: Cell range [N0, N1, N2] of the pairs (defines global indices)
+    :param search_cell_num_vec: Cell range searched (in the LLL-reduced basis if the lattice was reduced)
+    :param center_atom_index: Pair column, shape (P,)
+    :param neighbor_atom_index: Pair column, shape (P,)
+    :param neighbor_cell: Pair column, shape (P, 3)
+    :param distance: Pair column, shape (P,)
+    :param shell_index: Pair column, shape (P,)
+    :param unique_distances: Mean distance of each shell, sorted, shape (num_shells,)
+    :param shell_lower: Smallest distance of each shell, shape (num_shells,)
+    :param shell_upper: Largest distance of each shell, shape (num_shells,)
+    :param shell_multiplicity: Number of pairs in each shell, shape (num_shells,)
+    :param shell_gap_to_next: Gap to the next shell (inf if not known), shape (num_shells,)
+    """
+
+    # Names of the arrays written by to_columns() / save_npz()
+    array_columns = ["atom_coordinates_frac", "atom_coordinates_cart_cell_000", "lattice_basis_primitive",
+                     "neighbor_cell_num_vec", "search_cell_num_vec", "center_atom_index", "neighbor_atom_index",
+                     "neighbor_cell", "distance", "shell_index", "unique_distances", "shell_lower", "shell_upper",
+                     "shell_multiplicity", "shell_gap_to_next"]
+
+    def __init__(self, atom_position_names, atom_types, atom_coordinates_frac, atom_coordinates_cart_cell_000,
+                 lattice_basis_primitive, neighbor_cell_num_vec, search_cell_num_vec, center_atom_index,
+                 neighbor_atom_index, neighbor_cell, distance, shell_index, unique_distances, shell_lower, shell_upper,
+                 shell_multiplicity, shell_gap_to_next):
+        self.atom_position_names = [str(name) for name in atom_position_names]
+        self.atom_types = [str(atom_type) for atom_type in atom_types]
+        self.atom_coordinates_frac = np.asarray(atom_coordinates_frac, dtype=float).reshape(-1, 3)
+        self.atom_coordinates_cart_cell_000 = np.asarray(atom_coordinates_cart_cell_000, dtype=float).reshape(-1, 3)
+        self.lattice_basis_primitive = np.asarray(lattice_basis_primitive, dtype=float)
+        self.neighbor_cell_num_vec = np.asarray(neighbor_cell_num_vec, dtype=np.int64)
+        self.search_cell_num_vec = np.asarray(search_cell_num_vec, dtype=np.int64)
+        self.center_atom_index = np.asarray(center_atom_index, dtype=np.int32)
+        self.neighbor_atom_index = np.asarray(neighbor_atom_index, dtype=np.int32)
+        self.neighbor_cell = np.asarray(neighbor_cell).reshape(-1, 3).astype(cell_dtype(neighbor_cell))
+        self.distance = np.asarray(distance, dtype=float)
+        self.shell_index = np.asarray(shell_index, dtype=np.int32)
+        self.unique_distances = np.asarray(unique_distances, dtype=float)
+        self.shell_lower = np.asarray(shell_lower, dtype=float)
+        self.shell_upper = np.asarray(shell_upper, dtype=float)
+        self.shell_multiplicity = np.asarray(shell_multiplicity, dtype=np.int64)
+        self.shell_gap_to_next = np.asarray(shell_gap_to_next, dtype=float)
+
+    def __len__(self):
+        return len(self.distance)
+
+    def __iter__(self):
+        for pair_index in range(len(self)):
+            yield self.record(pair_index)
+
+    @property
+    def num_atoms(self):
+        return len(self.atom_position_names)
+
+    # ==========================================================================
+    # Derived columns
+    # ==========================================================================
+    def neighbor_global_index(self):
+        """
+        Index of each neighbor atom in the enumeration of the cell range
+        (cell index * N_atoms + atom index, cells in the order of cell_translations())
+        """
+        N = self.neighbor_cell_num_vec
+        cell = self.neighbor_cell.astype(np.int64) + N
+        cell_index = (cell[:, 0] * (2*N[1] + 1) + cell[:, 1]) * (2*N[2] + 1) + cell[:, 2]
+        return cell_index * self.num_atoms + self.neighbor_atom_index
+
+    def neighbor_cart_coords(self):
+        """
+        Cartesian coordinates of the neighbor atoms (shifted by the space group origin)
+        """
+        cells = self.neighbor_cell.astype(float)
+        cell_translation = (cells[:, 0:1] * self.lattice_basis_primitive[0, :] +
+                            cells[:, 1:2] * self.lattice_basis_primitive[1, :] +
+                            cells[:, 2:3] * self.lattice_basis_primitive[2, :])
+        return cell_translation + self.atom_coordinates_cart_cell_000[self.neighbor_atom_index]
+
+    def take(self, rows):
+        """
+        Table of the selected pairs (same atom table and distance shells)
+
+        :param rows: Integer indices or boolean mask of the pairs to keep
+        :return: PairTable
+        """
+        return PairTable(
+            atom_position_names=self.atom_position_names,
+            atom_types=self.atom_types,
+            atom_coordinates_frac=self.atom_coordinates_frac,
+            atom_coordinates_cart_cell_000=self.atom_coordinates_cart_cell_000,
+            lattice_basis_primitive=self.lattice_basis_primitive,
+            neighbor_cell_num_vec=self.neighbor_cell_num_vec,
+            search_cell_num_vec=self.search_cell_num_vec,
+            center_atom_index=self.center_atom_index[rows],
+            neighbor_atom_index=self.neighbor_atom_index[rows],
+            neighbor_cell=self.neighbor_cell[rows],
+            distance=self.distance[rows],
+            shell_index=self.shell_index[rows],
+            unique_distances=self.unique_distances,
+            shell_lower=self.shell_lower,
+            shell_upper=self.shell_upper,
+            shell_multiplicity=self.shell_multiplicity,
+            shell_gap_to_next=self.shell_gap_to_next
+        )
+
+    # ==========================================================================
+    # Lazy dictionary views
+    # ==========================================================================
+    def record(self, pair_index):
+        """
+        One pair as a dictionary in the format of the original find_neighbors output
+
+        :param pair_index: Row of the table
+        :return: Dictionary (pair_index, distance, atom_at_center_cell, atom_at_neighbor_cell,
+                 distance_index, unique_distance_value)
+        """
+        i = int(self.center_atom_index[pair_index])
+        j = int(self.neighbor_atom_index[pair_index])
+        cell = self.neighbor_cell[pair_index].astype(np.int64)
+        cell_translation = (cell[0] * self.lattice_basis_primitive[0, :] +
+                            cell[1] * self.lattice_basis_primitive[1, :] +
+                            cell[2] * self.lattice_basis_primitive[2, :])
+        N = self.neighbor_cell_num_vec
+        cell_index = ((cell[0] + N[0]) * (2*N[1] + 1) + cell[1] + N[1]) * (2*N[2] + 1) + cell[2] + N[2]
+        shell = int(self.shell_index[pair_index])
+
+        return {
+            'pair_index': pair_index,
+            'distance': float(self.distance[pair_index]),
+            'atom_at_center_cell': {
+                'cell': [0, 0, 0],
+                'atom_index': i,
+                'position_name': self.atom_position_names[i],
+                'atom_type': self.atom_types[i],
+                'frac_coords': self.atom_coordinates_frac[i].tolist(),
+                'cart_coords': self.atom_coordinates_cart_cell_000[i].tolist()
+            },
+            'atom_at_neighbor_cell': {
+                'cell': cell.tolist(),
+                'atom_index': j,
+                'position_name': self.atom_position_names[j],
+                'atom_type': self.atom_types[j],
+                'frac_coords': self.atom_coordinates_frac[j].tolist(),
+                'cart_coords': (cell_translation + self.atom_coordinates_cart_cell_000[j]).tolist(),
+                'global_index': int(cell_index * self.num_atoms + j)
+            },
+            'distance_index': shell,
+            'unique_distance_value': float(self.unique_distances[shell])
+        }
+
+    def records(self):
+        """
+        All pairs as a list of dictionaries (see record())
+        """
+        return list(self)
+
+    # ==========================================================================
+    # Conversion for handoff directories, the stage cache and .npz files
+    # ==========================================================================
+    def to_columns(self):
+        """
+        Dictionary of NumPy arrays plus the atom name/type lists
+        """
+        columns = {name: getattr(self, name) for name in self.array_columns}
+        columns["atom_position_names"] = list(self.atom_position_names)
+        columns["atom_types"] = list(self.atom_types)
+        return columns
+
+    @classmethod
+    def from_columns(cls, columns):
+        """
+        Rebuild the table from the output of to_columns()
+        """
+        return cls(**{name: columns[name] for name in cls.array_columns},
+                   atom_position_names=list(columns["atom_position_names"]),
+                   atom_types=list(columns["atom_types"]))
+
+    def save_npz(self, file):
+        """
+        Write the table to a compressed .npz file
+        """
+        write_columns_npz(file, self.to_columns())
+
+    @classmethod
+    def load_npz(cls, file):
+        """
+        Read a table written by save_npz()
+        """
+        return cls.from_columns(read_columns_npz(file))
+
+
+def write_columns_npz(file, columns):
+    """
+    Write pair columns (to_columns() output) to a compressed .npz file
+    """
+    columns = dict(columns)
+    columns["atom_position_names"] = np.array(columns["atom_position_names"], dtype=str)
+    columns["atom_types"] = np.array(columns["atom_types"], dtype=str)
+    np.savez_compressed(file, **columns)
+
+
+def read_columns_npz(file):
+    """
+    Read pair columns written by write_columns_npz()
+    """
+    with np.load(file, allow_pickle=False) as npz:
+        columns = {name: npz[name] for name in npz.files}
+    columns["atom_position_names"] = columns["atom_position_names"].tolist()
+    columns["atom_types"] = columns["atom_types"].tolist()
+    return columns
+
+
+def cell_dtype(neighbor_cell):
+    """
+    Smallest signed integer type holding all cell offsets
+
+    :param neighbor_cell: Integer cell offsets
+    :return: np.int8, np.int16 or np.int32
+    """
+    largest = int(np.abs(np.asarray(neighbor_cell)).max()) if np.size(neighbor_cell) else 0
+    for dtype in (np.int8, np.int16):
+        if largest <= np.iinfo(dtype).max:
+            return dtype
+    return np.int32
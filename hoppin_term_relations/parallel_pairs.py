@@ -0,0 +1,122 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+# ==============================================================================
+# Pair search sharded by center atom over a process pool
+# ==============================================================================
+# The pairs of different center atoms are independent, so the centers are cut
+# into contiguous shards that worker processes search in parallel:
+#   - the center coordinates and the atom images of the cell range are placed
+#     once in shared memory; workers attach to them read-only instead of
+#     receiving a copy per shard
+#   - every shard returns its pairs sorted by (center, image), exactly as the
+#     serial search_pairs() sorts them
+#   - the shard results are concatenated in shard order (executor.map keeps
+#     the submission order), so the merged pairs equal the serial ones element
+#     by element, whatever order the shards finish in
+# Distances are computed by the same floating-point operations as in the
+# serial search, so the distance shells and shell indices are identical too.
+
+# Shards per worker process (more, smaller shards balance uneven centers)
+shards_per_worker = 4
+
+# Shared arrays of the current pool, set in each worker by attach_shared_arrays()
+_shared = {}
+
+
+def share_array(array):
+    """
+    Copy an array into a new shared memory block
+
+    :param array: NumPy array
+    :return: tuple: (SharedMemory, (name, shape, dtype) to attach to it)
+    """
+    array = np.ascontiguousarray(array)
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    return block, (block.name, array.shape, array.dtype.str)
+
+
+def attach_shared_arrays(descriptions):
+    """
+    Pool initializer: attach to the shared arrays as read-only NumPy views
+
+    :param descriptions: Dictionary name -> (shared memory name, shape, dtype) from share_array()
+    """
+    for name, (block_name, shape, dtype) in descriptions.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        view = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        view.flags.writeable = False
+        # Keep the block referenced as long as its view is used
+        _shared[name] = (block, view)
+
+
+def shard_pairs(shard):
+    """
+    Pairs of one shard of center atoms (runs in a worker process)
+
+    :param shard: tuple: (first center, one past the last center, cutoff or None)
+    :return: tuple: (center indices, image indices, distances), sorted by (center, image)
+    """
+    # Imported here: find_neighbors.py imports this module
+    from hoppin_term_relations.find_neighbors import cell_list_pairs
+
+    first_center, stop_center, cutoff = shard
+    centers_cart = _shared["centers_cart"][1]
+    images_cart = _shared["images_cart"][1]
+    centers = np.arange(first_center, stop_center)
+
+    if cutoff is None:
+        center_idx = np.repeat(centers, len(images_cart))
+        image_idx = np.tile(np.arange(len(images_cart)), len(centers))
+        displacement = images_cart[image_idx] - centers_cart[center_idx]
+        distances = np.sqrt(np.einsum("ij,ij->i", displacement, displacement))
+        return center_idx, image_idx, distances
+
+    local_center, image_idx, distances = cell_list_pairs(centers_cart[centers], images_cart, cutoff)
+    center_idx = centers[local_center]
+    order = np.lexsort((image_idx, center_idx))
+    return center_idx[order], image_idx[order], distances[order]
+
+
+def center_shards(num_centers, num_workers):
+    """
+    Contiguous ranges of center atoms, about shards_per_worker per worker
+
+    :return: List of (first center, one past the last center)
+    """
+    num_shards = max(1, min(num_centers, num_workers * shards_per_worker))
+    bounds = np.linspace(0, num_centers, num_shards + 1).astype(np.int64)
+    return [(int(bounds[k]), int(bounds[k + 1])) for k in range(num_shards) if bounds[k] < bounds[k + 1]]
+
+
+def sharded_search(centers_cart, images_cart, cutoff, num_workers):
+    """
+    Pairs of all centers with all images, searched in parallel
+
+    :param centers_cart: Cartesian coordinates of the centers, shape (N_centers, 3)
+    :param images_cart: Cartesian coordinates of the atom images, shape (N_images, 3)
+    :param cutoff: Cartesian cutoff radius, or None for all pairs
+    :param num_workers: Number of worker processes
+    :return: tuple: (center indices, image indices, distances), sorted by (center, image)
+    """
+    blocks, descriptions = [], {}
+    try:
+        for name, array in (("centers_cart", centers_cart), ("images_cart", images_cart)):
+            block, descriptions[name] = share_array(np.asarray(array, dtype=float))
+            blocks.append(block)
+
+        shards = [(first, stop, cutoff) for first, stop in center_shards(len(centers_cart), num_workers)]
+        with ProcessPoolExecutor(max_workers=num_workers, initializer=attach_shared_arrays,
+                                 initargs=(descriptions,)) as executor:
+            results = list(executor.map(shard_pairs, shards))
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    if not results:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+    center_idx, image_idx, distances = (np.concatenate(column) for column in zip(*results))
+    return center_idx, image_idx, distances
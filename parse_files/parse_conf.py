@@ -3,6 +3,12 @@ import sys
 import json
 import os
 
+# Make the repository root importable when this file is run as a script
+if __package__ in (None, ""):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pipeline.stage_io import write_stage, pop_handoff_arg
+
 # ==============================================================================
 # Configuration parser for tight-binding model input files
 # ==============================================================================
@@ -17,22 +23,6 @@ paramErrCode = 3         # Wrong command-line parameters
 fileNotExistErrCode = 4  # Configuration file doesn't exist
 
 
-# ==============================================================================
-# STEP 0: Validate command-line arguments
-# ==============================================================================
-if len(sys.argv) != 2:
-    print("wrong number of arguments.", file=sys.stderr)
-    print("usage: python parse_conf.py /path/to/xxx.conf", file=sys.stderr)
-    exit(paramErrCode)
-
-conf_file = sys.argv[1]
-
-# Check if configuration file exists
-if not os.path.exists(conf_file):
-    print(f"file not found: {conf_file}", file=sys.stderr)
-    exit(fileNotExistErrCode)
-
-
 # ==============================================================================
 # STEP 1: Define regex patterns for parsing
 # ==============================================================================
@@ -44,7 +34,8 @@ float_pattern = r"[-+]?(?:\d*\.\d+|\d+)(?:[eE][-+]?\d+)?"
 
 # Pattern for atom type definitions: AtomSymbol = count ; orbital1, orbital2, ...
 # Example: O=3;2px,2py,2pz
-atom_orbital_pattern = r'^([A-Za-z]+\d*)\s*=\s*(\d+)\s*;\s*([1-7](?:s|px|py|pz|dxy|dxz|dyz|dx2-y2|dz2|fxyz|fx3-3xy2|f3x2y-y3|fxz2|fyz2|fx2-y2z|fz3)(?:\s*,\s*[1-7](?:s|px|py|pz|dxy|dxz|dyz|dx2-y2|dz2|fxyz|fx3-3xy2|f3x2y-y3|fxz2|fyz2|fx2-y2z|fz3))*)\s*$'
+# g, h, i orbitals are named by their real harmonic component, e.g. 5gC0, 5gS4
+atom_orbital_pattern = r'^([A-Za-z]+\d*)\s*=\s*(\d+)\s*;\s*([1-7](?:s|px|py|pz|dxy|dxz|dyz|dx2-y2|dz2|fxyz|fx3-3xy2|f3x2y-y3|fxz2|fyz2|fx2-y2z|fz3|[ghi][CS]\d)(?:\s*,\s*[1-7](?:s|px|py|pz|dxy|dxz|dyz|dx2-y2|dz2|fxyz|fx3-3xy2|f3x2y-y3|fxz2|fyz2|fx2-y2z|fz3|[ghi][CS]\d))*)\s*$'
 
 # Pattern for system name
 name_pattern = r'^name\s*=\s*([a-zA-Z0-9_-]+)\s*$'
@@ -55,6 +46,25 @@ dim_pattern = r"^dim\s*=\s*(\d+)\s*$"
 # Pattern for number of neighbor cells to consider
 neighbors_pattern = r"^neighbors\s*=\s*(\d+)\s*$"
 
+# Pattern for optional Cartesian cutoff radius of the neighbor search
+neighbor_cutoff_pattern = rf"^neighbor_cutoff\s*=\s*({float_pattern})\s*$"
+
+# Pattern for optional number of neighbor distance shells (first k shells)
+neighbor_shells_pattern = r"^neighbor_shells\s*=\s*(\d+)\s*$"
+
+# Patterns for optional absolute / relative tolerance of the distance shell clustering
+shell_tolerance_pattern = rf"^shell_tolerance\s*=\s*({float_pattern})\s*$"
+shell_relative_tolerance_pattern = rf"^shell_relative_tolerance\s*=\s*({float_pattern})\s*$"
+
+# Pattern for optional LLL reduction of the lattice in the cutoff search (true/false)
+neighbor_lattice_reduction_pattern = r'^neighbor_lattice_reduction\s*=\s*((?i:true|false))\s*$'
+
+# Pattern for optional symmetry reduction of the neighbor pairs (true/false)
+neighbor_symmetry_reduction_pattern = r'^neighbor_symmetry_reduction\s*=\s*((?i:true|false))\s*$'
+
+# Pattern for optional number of worker processes of the neighbor search
+neighbor_workers_pattern = r"^neighbor_workers\s*=\s*(\d+)\s*$"
+
 # Pattern for number of atom types
 atom_type_num_pattern = r"^atom_type_num\s*=\s*(\d+)\s*$"
 
@@ -136,6 +146,13 @@ def parseConfContents(file):
         'dim': '',                     # Dimensionality (2 or 3)
         'spin': '',                    # Spin consideration (true/false)
         'neighbors': '',               # Number of neighbor cells to consider
+        'neighbor_cutoff': '',         # Optional Cartesian cutoff radius of the neighbor search
+        'neighbor_shells': '',         # Optional number of neighbor distance shells
+        'shell_tolerance': '',         # Optional absolute tolerance of the distance shells
+        'shell_relative_tolerance': '',  # Optional relative tolerance of the distance shells
+        'neighbor_lattice_reduction': '',  # Optional: cutoff search in an LLL-reduced basis (true/false)
+        'neighbor_symmetry_reduction': '',  # Optional: one pair per symmetry orbit (true/false)
+        'neighbor_workers': '',        # Optional number of worker processes of the neighbor search
         'atom_type_num': '',          # Total number of atom types
         'lattice_type': '',           # Lattice type (primitive/conventional)
         'lattice_basis': '',          # Lattice basis vectors (3x3 matrix)
@@ -184,6 +201,53 @@ def parseConfContents(file):
                 config['neighbors'] = int(match_neighbors.group(1))
                 continue
 
+            # ==========================================
+            # Parse optional neighbor cutoff radius / number of shells
+            # ==========================================
+            match_neighbor_cutoff = re.match(neighbor_cutoff_pattern, oneLine)
+            if match_neighbor_cutoff:
+                config['neighbor_cutoff'] = float(match_neighbor_cutoff.group(1))
+                continue
+
+            match_neighbor_shells = re.match(neighbor_shells_pattern, oneLine)
+            if match_neighbor_shells:
+                config['neighbor_shells'] = int(match_neighbor_shells.group(1))
+                continue
+
+            # ==========================================
+            # Parse optional distance shell tolerances
+            # ==========================================
+            match_shell_tolerance = re.match(shell_tolerance_pattern, oneLine)
+            if match_shell_tolerance:
+                config['shell_tolerance'] = float(match_shell_tolerance.group(1))
+                continue
+
+            match_shell_relative_tolerance = re.match(shell_relative_tolerance_pattern, oneLine)
+            if match_shell_relative_tolerance:
+                config['shell_relative_tolerance'] = float(match_shell_relative_tolerance.group(1))
+                continue
+
+            # ==========================================
+            # Parse optional lattice / symmetry reduction of the neighbor search
+            # ==========================================
+            match_lattice_reduction = re.match(neighbor_lattice_reduction_pattern, oneLine)
+            if match_lattice_reduction:
+                config['neighbor_lattice_reduction'] = match_lattice_reduction.group(1)
+                continue
+
+            match_symmetry_reduction = re.match(neighbor_symmetry_reduction_pattern, oneLine)
+            if match_symmetry_reduction:
+                config['neighbor_symmetry_reduction'] = match_symmetry_reduction.group(1)
+                continue
+
+            # ==========================================
+            # Parse optional number of neighbor search workers
+            # ==========================================
+            match_neighbor_workers = re.match(neighbor_workers_pattern, oneLine)
+            if match_neighbor_workers:
+                config['neighbor_workers'] = int(match_neighbor_workers.group(1))
+                continue
+
             # ==========================================
             # Parse number of atom types
             # ==========================================
@@ -307,9 +371,28 @@ def parseConfContents(file):
 # ==============================================================================
 # STEP 4: Parse configuration and output as JSON
 # ==============================================================================
-# Parse the configuration file
-parsed_config = parseConfContents(conf_file)
-
-# Output the parsed configuration as JSON to stdout
-# This allows the data to be piped to other scripts
-print(json.dumps(parsed_config, indent=2), file=sys.stdout)
\ No newline at end of file
+if __name__ == "__main__":
+    # Validate command-line arguments
+    args, handoff_dir = pop_handoff_arg(sys.argv[1:])
+    if len(args) != 1:
+        print("wrong number of arguments.", file=sys.stderr)
+        print("usage: python parse_conf.py /path/to/xxx.conf [--handoff /path/to/handoff_dir]", file=sys.stderr)
+        exit(paramErrCode)
+
+    conf_file = args[0]
+
+    # Check if configuration file exists
+    if not os.path.exists(conf_file):
+        print(f"file not found: {conf_file}", file=sys.stderr)
+        exit(fileNotExistErrCode)
+
+    # Parse the configuration file
+    parsed_config = parseConfContents(conf_file)
+
+    if handoff_dir is not None:
+        # Write the parsed configuration to the handoff directory
+        write_stage(handoff_dir, "parse_conf", parsed_config)
+    else:
+        # Output the parsed configuration as JSON to stdout
+        # This allows the data to be piped to other scripts
+        print(json.dumps(parsed_config, indent=2), file=sys.stdout)
@@ -1,9 +1,16 @@
 import sys
+import os
 import glob
 import re
 import json
 import numpy as np
 
+# Make the repository root importable when this file is run as a script
+if __package__ in (None, ""):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pipeline.stage_io import read_stage, pop_handoff_arg
+
 # ==============================================================================
 # Sanity check script for tight-binding configuration files
 # ==============================================================================
@@ -12,6 +19,7 @@ import numpy as np
 # - Valid matrix properties (determinant, condition number)
 # - Correct atom position counts
 # - Duplicate atomic positions after lattice reduction
+# - Valid neighbor search settings (neighbor_cutoff / neighbor_shells, shell tolerances)
 
 # Exit codes for different error conditions
 jsonErr = 4                      # JSON parsing error
@@ -23,19 +31,7 @@ duplicate_position_error = 9     # Duplicate atomic positions found
 
 
 # ==============================================================================
-# STEP 1: Read and parse JSON input from stdin
-# ==============================================================================
-try:
-    config_json = sys.stdin.read()
-    parsed_config = json.loads(config_json)
-
-except json.JSONDecodeError as e:
-    print(f"Error parsing JSON input: {e}", file=sys.stderr)
-    exit(jsonErr)
-
-
-# ==============================================================================
-# STEP 2: Define matrix validation function
+# STEP 1: Define matrix validation function
 # ==============================================================================
 def check_matrix_condition(matrix, matrix_name="Matrix", det_threshold=1e-12, cond_threshold=1e12):
     """
@@ -84,37 +80,7 @@ def check_matrix_condition(matrix, matrix_name="Matrix", det_threshold=1e-12, co
 
 
 # ==============================================================================
-# STEP 3: Check for required matrix fields
-# ==============================================================================
-# Verify that lattice_basis exists and is not empty
-if 'lattice_basis' not in parsed_config or not parsed_config['lattice_basis']:
-    print("Error: Missing or empty required field 'lattice_basis'", file=sys.stderr)
-    exit(matrix_not_exist_error)
-
-# Verify that space_group_basis exists and is not empty
-if 'space_group_basis' not in parsed_config or not parsed_config['space_group_basis']:
-    print("Error: Missing or empty required field 'space_group_basis'", file=sys.stderr)
-    exit(matrix_not_exist_error)
-
-
-# ==============================================================================
-# STEP 4: Validate matrix conditions
-# ==============================================================================
-# Check lattice basis matrix properties
-is_valid, error_msg = check_matrix_condition(parsed_config['lattice_basis'], "Lattice basis")
-if not is_valid:
-    print(f"Error: {error_msg}", file=sys.stderr)
-    exit(matrix_cond_error)
-
-# Check space group basis matrix properties
-is_valid, error_msg = check_matrix_condition(parsed_config['space_group_basis'], "Space group basis")
-if not is_valid:
-    print(f"Error: {error_msg}", file=sys.stderr)
-    exit(matrix_cond_error)
-
-
-# ==============================================================================
-# STEP 5: Define atom position count validation function
+# STEP 2: Define atom position count validation function
 # ==============================================================================
 def check_atom_positions(parsed_config):
     """
@@ -169,7 +135,7 @@ def check_atom_positions(parsed_config):
 
 
 # ==============================================================================
-# STEP 6: Define duplicate position detection function
+# STEP 3: Define duplicate position detection function
 # ==============================================================================
 def check_duplicate_positions(parsed_config, tolerance=1e-6):
     """
@@ -262,25 +228,113 @@ def check_duplicate_positions(parsed_config, tolerance=1e-6):
         return False, f"Error checking duplicate positions: {str(e)}"
 
 
-# ==============================================================================
-# STEP 7: Validate atom positions match atom counts
-# ==============================================================================
-is_valid, error_msg = check_atom_positions(parsed_config)
-if not is_valid:
-    print(f"Error: {error_msg}", file=sys.stderr)
-    exit(atom_position_error)
+def check_neighbor_settings(parsed_config):
+    """
+    Check the optional neighbor search settings
+
+    neighbor_cutoff must be a positive distance, neighbor_shells a positive
+    integer, and at most one of them may be given. The distance shell
+    tolerances must not be negative, neighbor_workers must be positive.
+
+    :param parsed_config: Parsed configuration dictionary
+    :return: tuple: (is_valid, error_message)
+    """
+    neighbor_cutoff = parsed_config.get('neighbor_cutoff', '')
+    neighbor_shells = parsed_config.get('neighbor_shells', '')
+
+    if neighbor_cutoff not in ('', None) and neighbor_shells not in ('', None):
+        return False, "Specify at most one of neighbor_cutoff and neighbor_shells"
+
+    if neighbor_cutoff not in ('', None) and not float(neighbor_cutoff) > 0:
+        return False, f"neighbor_cutoff must be positive, got {neighbor_cutoff}"
+
+    if neighbor_shells not in ('', None) and not int(neighbor_shells) > 0:
+        return False, f"neighbor_shells must be positive, got {neighbor_shells}"
+
+    for key in ('shell_tolerance', 'shell_relative_tolerance'):
+        value = parsed_config.get(key, '')
+        if value not in ('', None) and float(value) < 0:
+            return False, f"{key} must not be negative, got {value}"
+
+    neighbor_workers = parsed_config.get('neighbor_workers', '')
+    if neighbor_workers not in ('', None) and not int(neighbor_workers) > 0:
+        return False, f"neighbor_workers must be positive, got {neighbor_workers}"
+
+    return True, None
 
 
 # ==============================================================================
-# STEP 8: Check for duplicate positions
+# STEP 4: Define function running all sanity checks
 # ==============================================================================
-is_valid, error_msg = check_duplicate_positions(parsed_config)
-if not is_valid:
-    print(f"Error: {error_msg}", file=sys.stderr)
-    exit(duplicate_position_error)
+def run_sanity_checks(parsed_config):
+    """
+    Run all sanity checks on a parsed configuration
+
+    Checks are performed in order: required matrix fields, matrix conditions,
+    atom position counts, duplicate positions, and neighbor search settings. The first failing check
+    determines the returned exit code.
+
+    :param parsed_config: Parsed configuration dictionary (output of parse_conf.py)
+    :return: tuple: (exit_code, error_message)
+               exit_code: 0 if all checks passed, otherwise one of the exit codes above
+               error_message: None if valid, error string if invalid
+    """
+    # Verify that lattice_basis exists and is not empty
+    if 'lattice_basis' not in parsed_config or not parsed_config['lattice_basis']:
+        return matrix_not_exist_error, "Missing or empty required field 'lattice_basis'"
+
+    # Verify that space_group_basis exists and is not empty
+    if 'space_group_basis' not in parsed_config or not parsed_config['space_group_basis']:
+        return matrix_not_exist_error, "Missing or empty required field 'space_group_basis'"
+
+    # Check lattice basis matrix properties
+    is_valid, error_msg = check_matrix_condition(parsed_config['lattice_basis'], "Lattice basis")
+    if not is_valid:
+        return matrix_cond_error, error_msg
+
+    # Check space group basis matrix properties
+    is_valid, error_msg = check_matrix_condition(parsed_config['space_group_basis'], "Space group basis")
+    if not is_valid:
+        return matrix_cond_error, error_msg
+
+    # Validate atom positions match atom counts
+    is_valid, error_msg = check_atom_positions(parsed_config)
+    if not is_valid:
+        return atom_position_error, error_msg
+
+    # Check for duplicate positions
+    is_valid, error_msg = check_duplicate_positions(parsed_config)
+    if not is_valid:
+        return duplicate_position_error, error_msg
+
+    # Check neighbor search settings
+    is_valid, error_msg = check_neighbor_settings(parsed_config)
+    if not is_valid:
+        return valErr, error_msg
+
+    return 0, None
 
 
 # ==============================================================================
-# STEP 9: All checks passed - output success message
+# STEP 5: Read JSON from stdin, run checks and report
 # ==============================================================================
-print("SUCCESS: All sanity checks passed!", file=sys.stdout)
\ No newline at end of file
+if __name__ == "__main__":
+    _, handoff_dir = pop_handoff_arg(sys.argv[1:])
+    try:
+        if handoff_dir is not None:
+            parsed_config = read_stage(handoff_dir, "parse_conf")
+        else:
+            config_json = sys.stdin.read()
+            parsed_config = json.loads(config_json)
+
+    except json.JSONDecodeError as e:
+        print(f"Error parsing JSON input: {e}", file=sys.stderr)
+        exit(jsonErr)
+
+    exit_code, error_msg = run_sanity_checks(parsed_config)
+    if exit_code != 0:
+        print(f"Error: {error_msg}", file=sys.stderr)
+        exit(exit_code)
+
+    # All checks passed - output success message
+    print("SUCCESS: All sanity checks passed!", file=sys.stdout)
@@ -0,0 +1,397 @@
+import os
+import sys
+import time
+import subprocess
+import copy
+import tempfile
+from dataclasses import dataclass, field
+
+from parse_files.parse_conf import parseConfContents, fileNotExistErrCode
+from parse_files.sanity_check import run_sanity_checks
+from symmetry.generate_space_group_representations import (
+    generate_space_group_representations, default_space_group_file, key_err_code, val_err_code)
+from symmetry.complete_orbitals import complete_orbitals, orbital_names_of_completion
+from hoppin_term_relations.find_neighbors import find_neighbors
+from hoppin_term_relations.pair_table import PairTable
+from hoppin_term_relations.irreducible_pairs import IrreduciblePairs, load_pair_columns
+from hoppin_term_relations.pair_stream import NeighborStream, PairStreamFile, default_pair_block_size
+from pipeline.stage_io import write_stage, read_stage
+from pipeline.stage_cache import StageCache, stage_key, source_version, file_sha256
+
+# ==============================================================================
+# In-process preprocessing pipeline engine
+# ==============================================================================
+# Runs the preprocessing stages as plain function calls in one interpreter:
+# 1. Parse configuration file               (parse_files/parse_conf.py)
+# 2. Validate input data (sanity checks)     (parse_files/sanity_check.py)
+# 3. Generate space group representations   (symmetry/generate_space_group_representations.py)
+# 4. Complete orbital basis under symmetry  (symmetry/complete_orbitals.py)
+# 5. Find neighboring atoms                 (hoppin_term_relations/find_neighbors.py)
+#
+# Data is passed between stages as dictionaries of NumPy arrays. The original
+# chain of python3 subprocesses is kept as run_pipeline_subprocess(); its
+# stages exchange data through a binary handoff directory (pipeline/stage_io.py)
+# and it produces the same PipelineResult.
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Scripts run by the subprocess fallback, relative to the repository root
+stage_scripts = {
+    "parse_conf": "./parse_files/parse_conf.py",
+    "sanity_check": "./parse_files/sanity_check.py",
+    "space_group_representations": "./symmetry/generate_space_group_representations.py",
+    "complete_orbitals": "./symmetry/complete_orbitals.py",
+    "find_neighbors": "./hoppin_term_relations/find_neighbors.py",
+}
+
+# Library modules imported by a stage script; part of the stage code version
+stage_library_modules = {
+    "space_group_representations": ["./symmetry/space_group_database.py",
+                                    "./symmetry/real_spherical_harmonics.py",
+                                    "./symmetry/group_structure.py",
+                                    "./symmetry/complete_orbitals.py",
+                                    "./symmetry/union_find.py"],
+    "complete_orbitals": ["./symmetry/union_find.py",
+                          "./symmetry/real_spherical_harmonics.py"],
+    "find_neighbors": ["./hoppin_term_relations/pair_table.py",
+                       "./hoppin_term_relations/distance_shells.py",
+                       "./hoppin_term_relations/irreducible_pairs.py",
+                       "./hoppin_term_relations/orbit_of_space_group.py",
+                       "./hoppin_term_relations/lattice_reduction.py",
+                       "./hoppin_term_relations/pair_stream.py",
+                       "./hoppin_term_relations/parallel_pairs.py"],
+}
+
+
+class PipelineStageError(Exception):
+    """
+    Raised when one preprocessing stage fails
+
+    :param stage: Name of the failing stage (a key of stage_scripts)
+    :param returncode: Exit code the stage script would have returned
+    :param message: Error message
+    """
+
+    def __init__(self, stage, returncode, message):
+        super().__init__(f"{stage} failed with code {returncode}: {message}")
+        self.stage = stage
+        self.returncode = returncode
+        self.message = message
+
+
+@dataclass
+class PipelineResult:
+    """
+    Outputs of all preprocessing stages for one configuration file
+
+    parsed_config has its atom_types orbitals replaced by the completed orbital sets,
+    input_atom_types keeps the atom_types as written in the .conf file.
+    timings maps stage names to wall-clock seconds, cached_stages lists the
+    stages whose output was read from the StageCache. atom_pairs is a
+    PairStreamFile if the pairs were streamed to a file.
+    """
+    parsed_config: dict
+    input_atom_types: dict
+    sanity_message: str
+    space_group_representations: dict
+    orbital_completion: dict
+    atom_pairs: PairTable | IrreduciblePairs | PairStreamFile
+    timings: dict = field(default_factory=dict)
+    cached_stages: list = field(default_factory=list)
+
+
+# ==============================================================================
+# Helper shared by both execution modes
+# ==============================================================================
+def apply_completed_orbitals(parsed_config, orbital_completion):
+    """
+    Update parsed_config with the orbital sets completed under symmetry
+
+    :param parsed_config: Parsed configuration dictionary, modified in place
+    :param orbital_completion: Output of complete_orbitals()
+    :return: parsed_config
+    """
+    updated_vectors = orbital_completion["updated_orbital_vectors"]
+    orbital_map_reverse = orbital_names_of_completion(orbital_completion)  # Reverse lookup
+
+    for atom_pos in parsed_config['atom_positions']:
+        atom_name = atom_pos['position_name']
+        atom_type = atom_pos['atom_type']
+
+        # Get the updated orbital vector for this atom
+        if atom_name in updated_vectors:
+            vector = updated_vectors[atom_name]
+            active_indices = [i for i, val in enumerate(vector) if val == 1]
+            active_orbital_names = [orbital_map_reverse.get(idx, f"unknown_{idx}") for idx in active_indices]
+
+            # Update atom_types with completed orbital list
+            parsed_config['atom_types'][atom_type]['orbitals'] = active_orbital_names
+            parsed_config['atom_types'][atom_type]['orbitals_completed'] = True
+
+    return parsed_config
+
+
+# ==============================================================================
+# In-process execution
+# ==============================================================================
+def stage_cache_inputs(stage, parsed_config, conf_file=None, space_group_key=None):
+    """
+    Collect everything the output of one stage depends on, for its cache key
+
+    :param stage: Name of the stage (a key of stage_scripts)
+    :param parsed_config: Parsed configuration dictionary (ignored for parse_conf)
+    :param conf_file: Path to the .conf file (parse_conf only)
+    :param space_group_key: Cache key of the space group representations
+                            (complete_orbitals only)
+    :return: JSON-serializable dictionary
+    """
+    source_files = [stage_scripts[stage], "./pipeline/stage_io.py"] + stage_library_modules.get(stage, [])
+    inputs = {"code": source_version(*(os.path.join(repo_root, path) for path in source_files))}
+
+    if stage == "parse_conf":
+        inputs["conf"] = file_sha256(conf_file)
+    elif stage == "sanity_check":
+        inputs["config"] = parsed_config
+    elif stage == "space_group_representations":
+        for key in ("lattice_basis", "space_group", "space_group_origin", "space_group_basis"):
+            inputs[key] = parsed_config.get(key)
+        inputs["database"] = file_sha256(default_space_group_file)
+    elif stage == "complete_orbitals":
+        inputs["space_group_representations"] = space_group_key
+        inputs["atom_types"] = parsed_config.get("atom_types")
+        inputs["atom_positions"] = parsed_config.get("atom_positions")
+    else:
+        # Any configuration key except the orbital sets, the name and the
+        # number of workers (same result) may affect the neighbor search
+        inputs["config"] = {k: v for k, v in parsed_config.items()
+                            if k not in ("atom_types", "name", "neighbor_workers")}
+
+    return inputs
+
+
+def run_pipeline(conf_file: str, handoff_dir: str = None, cache: StageCache = None,
+                 pair_stream_file: str = None, pair_block_size: int = default_pair_block_size) -> PipelineResult:
+    """
+    Run all preprocessing stages in the current process
+
+    :param conf_file: Path to the .conf file
+    :param handoff_dir: If given, every stage output is also written to this
+                        handoff directory (see pipeline/stage_io.py)
+    :param cache: If given, stage outputs are looked up in and stored to this
+                  StageCache; only stages whose inputs changed are recomputed
+    :param pair_stream_file: If given, the atom pairs are streamed block by block
+                             to this file (see hoppin_term_relations/pair_stream.py)
+                             instead of being held in memory; never cached
+    :param pair_block_size: Maximal number of pairs per streamed block
+    :return: PipelineResult with NumPy arrays for all matrix-valued outputs
+    :raises PipelineStageError: If any stage fails
+    """
+    timings = {}
+    cached_stages = []
+
+    def lookup(stage, config, **kwargs):
+        # Return (key, cached output or None); no key without a cache
+        if cache is None:
+            return None, None
+        key = stage_key(stage, stage_cache_inputs(stage, config, **kwargs))
+        data = cache.get(stage, key)
+        if data is not None:
+            cached_stages.append(stage)
+        return key, data
+
+    def store(stage, key, data):
+        if cache is not None:
+            cache.put(stage, key, data)
+
+    # Stage 1: parse configuration file
+    start = time.perf_counter()
+    if not os.path.exists(conf_file):
+        raise PipelineStageError("parse_conf", fileNotExistErrCode, f"file not found: {conf_file}")
+    key, parsed_config = lookup("parse_conf", None, conf_file=conf_file)
+    if parsed_config is None:
+        parsed_config = parseConfContents(conf_file)
+        store("parse_conf", key, parsed_config)
+    timings["parse_conf"] = time.perf_counter() - start
+
+    # Stage 2: sanity checks (only passing results are cached)
+    start = time.perf_counter()
+    key, sanity = lookup("sanity_check", parsed_config)
+    if sanity is None:
+        exit_code, error_msg = run_sanity_checks(parsed_config)
+        if exit_code != 0:
+            raise PipelineStageError("sanity_check", exit_code, error_msg)
+        store("sanity_check", key, {"exit_code": exit_code})
+    timings["sanity_check"] = time.perf_counter() - start
+
+    # Stage 3: space group representations
+    start = time.perf_counter()
+    space_group_key, space_group_representations = lookup("space_group_representations", parsed_config)
+    if space_group_representations is None:
+        try:
+            space_group_representations = generate_space_group_representations(parsed_config)
+        except KeyError as e:
+            raise PipelineStageError("space_group_representations", key_err_code,
+                                     f"Required key {e} not found in configuration")
+        except ValueError as e:
+            raise PipelineStageError("space_group_representations", val_err_code,
+                                     f"Error with configuration data: {e}")
+        store("space_group_representations", space_group_key, space_group_representations)
+    timings["space_group_representations"] = time.perf_counter() - start
+
+    # Stage 4: orbital completion
+    start = time.perf_counter()
+    key, orbital_completion = lookup("complete_orbitals", parsed_config,
+                                     space_group_key=space_group_key)
+    if orbital_completion is None:
+        try:
+            orbital_completion = complete_orbitals(parsed_config, space_group_representations)
+        except KeyError as e:
+            raise PipelineStageError("complete_orbitals", 1, f"Missing key {e}")
+        store("complete_orbitals", key, orbital_completion)
+    timings["complete_orbitals"] = time.perf_counter() - start
+
+    # Stage 5: neighbor search (uses the configuration before orbital completion
+    # is written back, exactly as the subprocess chain does)
+    start = time.perf_counter()
+    key, pair_columns = (None, None) if pair_stream_file is not None else lookup("find_neighbors", parsed_config)
+    if pair_columns is not None:
+        atom_pairs = load_pair_columns(pair_columns)
+    elif pair_stream_file is not None:
+        try:
+            atom_pairs = NeighborStream(parsed_config, space_group_representations,
+                                        pair_block_size).write(pair_stream_file)
+        except KeyError as e:
+            raise PipelineStageError("find_neighbors", key_err_code,
+                                     f"Required key {e} not found in configuration")
+        except ValueError as e:
+            raise PipelineStageError("find_neighbors", val_err_code,
+                                     f"Error with configuration data: {e}")
+    else:
+        try:
+            atom_pairs = find_neighbors(parsed_config, space_group_representations)
+        except KeyError as e:
+            raise PipelineStageError("find_neighbors", key_err_code,
+                                     f"Required key {e} not found in configuration")
+        except ValueError as e:
+            raise PipelineStageError("find_neighbors", val_err_code,
+                                     f"Error with configuration data: {e}")
+        pair_columns = atom_pairs.to_columns() if (cache is not None or handoff_dir is not None) else None
+        store("find_neighbors", key, pair_columns)
+    timings["find_neighbors"] = time.perf_counter() - start
+
+    if handoff_dir is not None:
+        write_stage(handoff_dir, "parse_conf", parsed_config)
+        write_stage(handoff_dir, "space_group_representations", space_group_representations)
+        write_stage(handoff_dir, "complete_orbitals", orbital_completion)
+        if pair_columns is not None:
+            write_stage(handoff_dir, "find_neighbors", pair_columns)
+
+    input_atom_types = copy.deepcopy(parsed_config['atom_types'])
+    apply_completed_orbitals(parsed_config, orbital_completion)
+
+    return PipelineResult(
+        parsed_config=parsed_config,
+        input_atom_types=input_atom_types,
+        sanity_message="SUCCESS: All sanity checks passed!",
+        space_group_representations=space_group_representations,
+        orbital_completion=orbital_completion,
+        atom_pairs=atom_pairs,
+        timings=timings,
+        cached_stages=cached_stages
+    )
+
+
+# ==============================================================================
+# Subprocess execution (fallback)
+# ==============================================================================
+def run_stage_subprocess(stage, args=(), input_text=None):
+    """
+    Run one stage script as a separate python3 process
+
+    :param stage: Name of the stage (a key of stage_scripts)
+    :param args: Extra command line arguments
+    :param input_text: Text passed on stdin
+    :return: stdout of the script
+    :raises PipelineStageError: If the script exits with a non-zero code
+    """
+    result = subprocess.run(
+        [sys.executable, stage_scripts[stage], *args],
+        input=input_text,
+        capture_output=True,
+        text=True,
+        cwd=repo_root
+    )
+    if result.returncode != 0:
+        raise PipelineStageError(stage, result.returncode, result.stderr)
+    return result.stdout
+
+
+def run_pipeline_subprocess(conf_file: str, handoff_dir: str = None, pair_stream_file: str = None,
+                            pair_block_size: int = default_pair_block_size) -> PipelineResult:
+    """
+    Run all preprocessing stages as a chain of python3 subprocesses
+
+    The stages exchange data through a binary handoff directory: each script
+    reads its inputs as memory-mapped .npy files and writes its outputs next
+    to them. The result has the same layout as run_pipeline().
+
+    :param conf_file: Path to the .conf file
+    :param handoff_dir: Handoff directory to keep; a temporary one is used if None
+    :param pair_stream_file: If given, find_neighbors.py streams the atom pairs to this file
+    :param pair_block_size: Maximal number of pairs per streamed block
+    :return: PipelineResult
+    :raises PipelineStageError: If any stage fails
+    """
+    if handoff_dir is None:
+        with tempfile.TemporaryDirectory(prefix="tb_handoff_") as tmp_dir:
+            return run_pipeline_subprocess(conf_file, handoff_dir=tmp_dir, pair_stream_file=pair_stream_file,
+                                           pair_block_size=pair_block_size)
+
+    timings = {}
+    conf_file = os.path.abspath(conf_file)
+    handoff_args = ["--handoff", os.path.abspath(handoff_dir)]
+
+    start = time.perf_counter()
+    run_stage_subprocess("parse_conf", args=[conf_file, *handoff_args])
+    timings["parse_conf"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    sanity_message = run_stage_subprocess("sanity_check", args=handoff_args).strip()
+    timings["sanity_check"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    run_stage_subprocess("space_group_representations", args=handoff_args)
+    timings["space_group_representations"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    run_stage_subprocess("complete_orbitals", args=handoff_args)
+    timings["complete_orbitals"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    stream_args = []
+    if pair_stream_file is not None:
+        stream_args = ["--stream", os.path.abspath(pair_stream_file), "--block-size", str(pair_block_size)]
+    run_stage_subprocess("find_neighbors", args=[*handoff_args, *stream_args])
+    timings["find_neighbors"] = time.perf_counter() - start
+
+    # Read the stage outputs back (copies, since a temporary directory may be removed)
+    parsed_config = read_stage(handoff_dir, "parse_conf")
+    space_group_representations = read_stage(handoff_dir, "space_group_representations", mmap=False)
+    orbital_completion = read_stage(handoff_dir, "complete_orbitals", mmap=False)
+    if pair_stream_file is not None:
+        atom_pairs = PairStreamFile(os.path.abspath(pair_stream_file))
+    else:
+        atom_pairs = load_pair_columns(read_stage(handoff_dir, "find_neighbors", mmap=False))
+
+    input_atom_types = copy.deepcopy(parsed_config['atom_types'])
+    apply_completed_orbitals(parsed_config, orbital_completion)
+
+    return PipelineResult(
+        parsed_config=parsed_config,
+        input_atom_types=input_atom_types,
+        sanity_message=sanity_message,
+        space_group_representations=space_group_representations,
+        orbital_completion=orbital_completion,
+        atom_pairs=atom_pairs,
+        timings=timings
+    )
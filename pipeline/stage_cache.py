@@ -0,0 +1,191 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+
+from pipeline.stage_io import write_stage, read_stage
+
+# ==============================================================================
+# Content-addressed on-disk cache for preprocessing stage outputs
+# ==============================================================================
+# Every cache entry is a handoff directory (see pipeline/stage_io.py) holding
+# the output of one stage. The entry name is the SHA-256 of the exact inputs
+# of the stage: the relevant part of the configuration, checksums of input
+# files such as the Bilbao database, and a hash of the source code of the
+# stage. Changing any of them produces a new key, so stale entries are never
+# read; they are removed by size-bounded least-recently-used eviction.
+#
+#   cache_dir/
+#       stages/<key>/       one handoff directory per cached stage output
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cache location and size bound, overridable through the environment
+default_cache_dir = os.environ.get("TB_PREPROCESSING_CACHE",
+                                   os.path.join(repo_root, ".preprocessing_cache"))
+default_max_bytes = int(float(os.environ.get("TB_PREPROCESSING_CACHE_MAX_MB", "1024")) * 1024 * 1024)
+
+# Checksums of files already hashed in this process: path -> (mtime, size, sha256)
+_file_checksums = {}
+
+
+# ==============================================================================
+# STEP 1: Define hashing helpers
+# ==============================================================================
+def file_sha256(path):
+    """
+    SHA-256 checksum of a file, memoized on (mtime, size)
+
+    :param path: File path
+    :return: Hex digest
+    """
+    stat = os.stat(path)
+    memo = _file_checksums.get(path)
+    if memo is not None and memo[0] == stat.st_mtime_ns and memo[1] == stat.st_size:
+        return memo[2]
+
+    sha = hashlib.sha256()
+    with open(path, "rb") as fptr:
+        for block in iter(lambda: fptr.read(1 << 20), b""):
+            sha.update(block)
+    digest = sha.hexdigest()
+    _file_checksums[path] = (stat.st_mtime_ns, stat.st_size, digest)
+    return digest
+
+
+def source_version(*source_files):
+    """
+    Code version of a stage: hash of the contents of its source files
+
+    :param source_files: Paths of the Python files the stage depends on
+    :return: Hex digest
+    """
+    sha = hashlib.sha256()
+    for path in source_files:
+        sha.update(file_sha256(os.path.abspath(path)).encode())
+    return sha.hexdigest()
+
+
+def stage_key(stage_name, inputs):
+    """
+    Cache key of one stage: hash of its name and canonical JSON inputs
+
+    :param stage_name: Name of the stage
+    :param inputs: JSON-serializable dictionary of everything the stage output depends on
+    :return: Hex digest
+    """
+    canonical = json.dumps({"stage": stage_name, "inputs": inputs}, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+# ==============================================================================
+# STEP 2: Define the cache
+# ==============================================================================
+class StageCache:
+    """
+    Size-bounded LRU cache of stage outputs on disk
+
+    :param cache_dir: Cache directory (created if missing)
+    :param max_bytes: Total size of all entries kept after eviction
+    """
+
+    def __init__(self, cache_dir=default_cache_dir, max_bytes=default_max_bytes):
+        self.cache_dir = cache_dir
+        self.entries_dir = os.path.join(cache_dir, "stages")
+        self.max_bytes = max_bytes
+        os.makedirs(self.entries_dir, exist_ok=True)
+
+    def get(self, stage_name, key):
+        """
+        Look up a stage output
+
+        :param stage_name: Name of the stage
+        :param key: Key from stage_key()
+        :return: Stage output, or None on a cache miss
+        """
+        entry_dir = os.path.join(self.entries_dir, key)
+        try:
+            data = read_stage(entry_dir, stage_name, mmap=False)
+        except (OSError, KeyError, ValueError):
+            return None
+
+        # Mark the entry as recently used; a parallel process may have
+        # evicted it since the read, the data read is still valid
+        try:
+            os.utime(entry_dir)
+        except OSError:
+            pass
+        return data
+
+    def put(self, stage_name, key, data):
+        """
+        Store a stage output and evict least-recently-used entries if needed
+
+        The entry is written to a temporary directory and renamed into place,
+        so concurrent readers never see a partial entry.
+
+        :param stage_name: Name of the stage
+        :param key: Key from stage_key()
+        :param data: Stage output (see pipeline/stage_io.py for supported types)
+        """
+        entry_dir = os.path.join(self.entries_dir, key)
+        try:
+            os.utime(entry_dir)
+            return
+        except OSError:
+            # Not stored yet, or evicted by a parallel process
+            pass
+
+        tmp_dir = tempfile.mkdtemp(prefix=".tmp_", dir=self.entries_dir)
+        try:
+            write_stage(tmp_dir, stage_name, data)
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # Another process stored the same entry first
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        self.evict()
+
+    def evict(self):
+        """
+        Remove least-recently-used entries until the cache fits in max_bytes
+        """
+        entries = []
+        total_bytes = 0
+        for name in os.listdir(self.entries_dir):
+            if name.startswith(".tmp_"):
+                continue
+            entry_dir = os.path.join(self.entries_dir, name)
+            try:
+                mtime = os.stat(entry_dir).st_mtime
+            except OSError:
+                # Already evicted by a parallel process
+                continue
+            size = directory_size(entry_dir)
+            entries.append((mtime, size, entry_dir))
+            total_bytes += size
+
+        # Oldest access time first
+        for _, size, entry_dir in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total_bytes -= size
+
+
+def directory_size(path):
+    """
+    Total size of all files below path
+
+    :param path: Directory path
+    :return: Size in bytes
+    """
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return total
@@ -0,0 +1,170 @@
+import os
+import json
+import time
+
+import numpy as np
+
+# ==============================================================================
+# Binary stage-handoff format for the preprocessing pipeline
+# ==============================================================================
+# Stage outputs are written to a handoff directory instead of JSON text:
+#
+#   handoff_dir/
+#       manifest.json               index of the stages written so far
+#       <stage_name>/
+#           manifest.json           layout of the stage output
+#           <key>/<subkey>.npy      one .npy file per NumPy array
+#
+# The stage manifest mirrors the nested structure of the stage output
+# (dicts, lists, scalars, strings). Every NumPy array is replaced by
+# {"__array__": "<relative .npy path>", "shape": [...], "dtype": "..."}.
+# Arrays are read back with np.load(mmap_mode='r'), so readers get
+# zero-copy, read-only views onto the files.
+
+format_version = 1
+manifest_name = "manifest.json"
+array_marker = "__array__"
+
+
+# ==============================================================================
+# STEP 1: Define functions converting between nested data and a layout tree
+# ==============================================================================
+def _flatten(value, stage_dir, key_path):
+    """
+    Write every NumPy array in value to stage_dir and return its JSON layout
+
+    :param value: Stage output (nested dicts/lists of arrays and plain values)
+    :param stage_dir: Directory of the stage
+    :param key_path: List of keys leading to value (used for the file name)
+    :return: JSON-serializable layout of value
+    """
+    if isinstance(value, np.ndarray):
+        if value.dtype == object:
+            raise ValueError(f"object arrays cannot be written to a handoff directory: {'/'.join(key_path)}")
+        relative_path = os.path.join(*key_path) + ".npy"
+        file_path = os.path.join(stage_dir, relative_path)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        # np.require keeps 0-d arrays 0-d (np.ascontiguousarray would make them 1-d)
+        np.save(file_path, np.require(value, requirements="C"), allow_pickle=False)
+        return {array_marker: relative_path, "shape": list(value.shape), "dtype": value.dtype.str}
+
+    if isinstance(value, dict):
+        return {"__dict__": {str(k): _flatten(v, stage_dir, key_path + [str(k)]) for k, v in value.items()}}
+
+    if isinstance(value, (list, tuple)):
+        return {"__list__": [_flatten(v, stage_dir, key_path + [str(i)]) for i, v in enumerate(value)]}
+
+    if isinstance(value, np.generic):
+        return value.item()
+
+    return value
+
+
+def _unflatten(layout, stage_dir, mmap):
+    """
+    Rebuild the stage output from its layout
+
+    :param layout: JSON layout written by _flatten()
+    :param stage_dir: Directory of the stage
+    :param mmap: If True, arrays are memory-mapped read-only
+    :return: Nested dicts/lists with NumPy arrays
+    """
+    if isinstance(layout, dict):
+        if array_marker in layout:
+            file_path = os.path.join(stage_dir, layout[array_marker])
+            return np.load(file_path, mmap_mode="r" if mmap else None, allow_pickle=False)
+        if "__dict__" in layout:
+            return {k: _unflatten(v, stage_dir, mmap) for k, v in layout["__dict__"].items()}
+        if "__list__" in layout:
+            return [_unflatten(v, stage_dir, mmap) for v in layout["__list__"]]
+    return layout
+
+
+# ==============================================================================
+# STEP 2: Define functions writing and reading stages
+# ==============================================================================
+def write_stage(handoff_dir, stage_name, data):
+    """
+    Write one stage output to the handoff directory
+
+    The stage directory is written first and the top-level manifest is
+    updated last, so a stage listed in the manifest is always complete.
+
+    :param handoff_dir: Handoff directory (created if missing)
+    :param stage_name: Name of the stage, e.g. "space_group_representations"
+    :param data: Stage output (nested dicts/lists of arrays and plain values)
+    :return: Path of the stage directory
+    """
+    stage_dir = os.path.join(handoff_dir, stage_name)
+    os.makedirs(stage_dir, exist_ok=True)
+
+    layout = _flatten(data, stage_dir, [])
+    with open(os.path.join(stage_dir, manifest_name), "w") as fptr:
+        json.dump({"format_version": format_version, "stage": stage_name, "layout": layout}, fptr)
+
+    manifest = read_manifest(handoff_dir)
+    manifest["stages"][stage_name] = {"path": stage_name, "written": time.time()}
+    manifest_tmp = os.path.join(handoff_dir, manifest_name + ".tmp")
+    with open(manifest_tmp, "w") as fptr:
+        json.dump(manifest, fptr, indent=2)
+    os.replace(manifest_tmp, os.path.join(handoff_dir, manifest_name))
+
+    return stage_dir
+
+
+def read_manifest(handoff_dir):
+    """
+    Read the top-level manifest of a handoff directory
+
+    :param handoff_dir: Handoff directory
+    :return: Manifest dictionary (empty stage list if the directory is new)
+    """
+    manifest_path = os.path.join(handoff_dir, manifest_name)
+    if not os.path.exists(manifest_path):
+        return {"format_version": format_version, "stages": {}}
+    with open(manifest_path, "r") as fptr:
+        return json.load(fptr)
+
+
+def read_stage(handoff_dir, stage_name, mmap=True):
+    """
+    Read one stage output from the handoff directory
+
+    :param handoff_dir: Handoff directory
+    :param stage_name: Name of the stage
+    :param mmap: If True (default), arrays are zero-copy read-only memory maps
+    :return: Stage output with the same nesting as when it was written
+    :raises KeyError: If the stage has not been written
+    """
+    manifest = read_manifest(handoff_dir)
+    if stage_name not in manifest["stages"]:
+        raise KeyError(f"stage {stage_name} not found in {handoff_dir}")
+
+    stage_dir = os.path.join(handoff_dir, manifest["stages"][stage_name]["path"])
+    with open(os.path.join(stage_dir, manifest_name), "r") as fptr:
+        stage_manifest = json.load(fptr)
+
+    if stage_manifest["format_version"] != format_version:
+        raise ValueError(f"unsupported handoff format version {stage_manifest['format_version']}")
+
+    return _unflatten(stage_manifest["layout"], stage_dir, mmap)
+
+
+# ==============================================================================
+# STEP 3: Define command line helper for the stage scripts
+# ==============================================================================
+def pop_handoff_arg(argv):
+    """
+    Split an optional "--handoff DIR" pair off a stage script's arguments
+
+    :param argv: Command line arguments without the script name
+    :return: tuple: (remaining_args, handoff_dir)
+               handoff_dir is None if --handoff was not given
+    """
+    if "--handoff" not in argv:
+        return list(argv), None
+
+    idx = argv.index("--handoff")
+    if idx + 1 >= len(argv):
+        return list(argv), None
+    return list(argv[:idx]) + list(argv[idx + 2:]), argv[idx + 1]
@@ -1,10 +1,12 @@
-import re
-import subprocess
 import sys
-import os
-import json
 import numpy as np
-from datetime import datetime
+
+from pipeline.engine import (run_pipeline, run_pipeline_subprocess, PipelineStageError)
+from pipeline.stage_cache import StageCache
+from symmetry.complete_orbitals import orbital_names_of_completion, orbital_letters
+from symmetry.group_structure import SpaceGroupStructure
+from hoppin_term_relations.irreducible_pairs import IrreduciblePairs
+from hoppin_term_relations.pair_stream import PairStreamFile
 
 # ==============================================================================
 # Main preprocessing pipeline for tight-binding model setup
@@ -16,383 +18,206 @@ from datetime import datetime
 # 4. Complete orbital basis under symmetry
 # 5. Find neighboring atoms
 #
-# The script chains multiple Python subscripts together, passing data via
-# JSON through stdin/stdout.
+# By default all stages run in this process (see pipeline/engine.py) and
+# stage outputs are cached on disk (see pipeline/stage_cache.py), so a rerun
+# only recomputes the stages whose inputs changed.
+# --no-cache disables the cache.
+# --subprocess runs the stages as a chain of Python subscripts instead
+# (never cached).
+# --stream-pairs=FILE streams the atom pairs block by block to a binary file
+# instead of holding them in memory (see hoppin_term_relations/pair_stream.py).
 
 
 # ==============================================================================
 # STEP 1: Validate command line arguments
 # ==============================================================================
 argErrCode = 20
-if (len(sys.argv) != 2):
+known_flags = {"--subprocess", "--no-cache"}
+stream_flag = "--stream-pairs="
+
+positional_args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+flag_args = [arg for arg in sys.argv[1:] if arg.startswith("--")]
+stream_args = [arg for arg in flag_args if arg.startswith(stream_flag)]
+
+if (len(positional_args) != 1 or len(stream_args) > 1
+        or any(flag not in known_flags and not flag.startswith(stream_flag) for flag in flag_args)):
     print("wrong number of arguments")
-    print("example: python preprocessing.py /path/to/mc.conf")
+    print("example: python preprocessing.py /path/to/mc.conf [--no-cache] [--subprocess] "
+          "[--stream-pairs=pairs.bin]")
     exit(argErrCode)
 
-confFileName = str(sys.argv[1])
+confFileName = str(positional_args[0])
+use_subprocess = "--subprocess" in flag_args
+use_cache = "--no-cache" not in flag_args
+pair_stream_file = stream_args[0][len(stream_flag):] if stream_args else None
 
 
 # ==============================================================================
-# STEP 2: Parse configuration file
+# STEP 2: Run the pipeline
 # ==============================================================================
-# Run parse_conf.py to read and parse the configuration file
-confResult = subprocess.run(
-    ["python3", "./parse_files/parse_conf.py", confFileName],
-    capture_output=True,
-    text=True
-)
-
-# Check if the subprocess ran successfully
-if confResult.returncode != 0:
-    print("Error running parse_conf.py:")
-    print(confResult.stderr)
-    exit(confResult.returncode)
-
-# Parse the JSON output from parse_conf.py
 try:
-    parsed_config = json.loads(confResult.stdout)
-
-    # Display parsed configuration in a formatted way
-    print("=" * 60)
-    print("COMPLETE PARSED CONFIGURATION")
-    print("=" * 60)
-
-    # Print basic configuration parameters
-    print(f"Name: {parsed_config['name']}")
-    print(f"Dimensions: {parsed_config['dim']}")
-    print(f"Spin: {parsed_config['spin']}")
-    print(f"Neighbors: {parsed_config['neighbors']}")
-    print(f"Atom Type Number: {parsed_config['atom_type_num']}")
-    print(f"Lattice Type: {parsed_config['lattice_type']}")
-    print(f"Space Group: {parsed_config['space_group']}")
-
-    # Print space group origin (fractional coordinates)
-    print(f"Space Group Origin: [{', '.join(map(str, parsed_config['space_group_origin']))}]")
-
-    # Print lattice basis vectors (primitive cell)
-    print("Lattice Basis:")
-    for i, vector in enumerate(parsed_config['lattice_basis']):
-        print(f"  Vector {i+1}: [{', '.join(map(str, vector))}]")
-
-    # Print space group basis vectors
-    print("Space Group Basis:")
-    for i, vector in enumerate(parsed_config['space_group_basis']):
-        print(f"  Vector {i+1}: [{', '.join(map(str, vector))}]")
-
-    # Print atom types and their orbital information
-    print("\nAtom Types:")
-    for atom_type, info in parsed_config['atom_types'].items():
-        print(f"  {atom_type}:")
-        print(f"    Count: {info['count']}")
-        print(f"    Orbitals: {info['orbitals']}")
-
-    # Print atom positions in the unit cell
-    print(f"\nAtom Positions (Total: {len(parsed_config['atom_positions'])}):")
-    for i, pos in enumerate(parsed_config['atom_positions']):
-        print(f"  Position {i+1}:")
-        print(f"    Name: {pos['position_name']}")
-        print(f"    Atom Type: {pos['atom_type']}")
-        print(f"    fractional_coordinates: [{', '.join(map(str, pos['fractional_coordinates']))}]")
-
-except json.JSONDecodeError as e:
-    print("Error parsing JSON output from parse_conf.py:")
-    print(f"JSON Error: {e}")
-    print("Raw output was:")
-    print(confResult.stdout)
-    exit(1)
-
-# Convert parsed_config to JSON string for passing to other subprocesses
-config_json = json.dumps(parsed_config)
+    if use_subprocess:
+        result = run_pipeline_subprocess(confFileName, pair_stream_file=pair_stream_file)
+    else:
+        result = run_pipeline(confFileName, cache=StageCache() if use_cache else None,
+                              pair_stream_file=pair_stream_file)
+except PipelineStageError as e:
+    print(f"Error running {e.stage}:")
+    print(f"return code={e.returncode}")
+    print("Error output:")
+    print(e.message)
+    exit(e.returncode)
+
+parsed_config = result.parsed_config
 
 
 # ==============================================================================
-# STEP 3: Run sanity checks on parsed configuration
+# STEP 3: Display parsed configuration
 # ==============================================================================
-print("\n" + "=" * 60)
-print("RUNNING SANITY CHECK")
+print("=" * 60)
+print("COMPLETE PARSED CONFIGURATION")
 print("=" * 60)
 
-# Run sanity_check.py and pass the JSON data via stdin
-sanity_result = subprocess.run(
-    ["python3", "./parse_files/sanity_check.py"],
-    input=config_json,
-    capture_output=True,
-    text=True
-)
-
-print(f"Exit code: {sanity_result.returncode}")
-
-# Check sanity check results
-if sanity_result.returncode != 0:
-    print("Sanity check failed!")
-    print(f"return code={sanity_result.returncode}")
-    print("Error output:")
-    print(sanity_result.stderr)
-    exit(sanity_result.returncode)
-else:
-    print("Sanity check passed!")
-    print("Output:")
-    print(sanity_result.stdout)
+# Print basic configuration parameters
+print(f"Name: {parsed_config['name']}")
+print(f"Dimensions: {parsed_config['dim']}")
+print(f"Spin: {parsed_config['spin']}")
+print(f"Neighbors: {parsed_config['neighbors']}")
+print(f"Atom Type Number: {parsed_config['atom_type_num']}")
+print(f"Lattice Type: {parsed_config['lattice_type']}")
+print(f"Space Group: {parsed_config['space_group']}")
+
+# Print space group origin (fractional coordinates)
+print(f"Space Group Origin: [{', '.join(map(str, parsed_config['space_group_origin']))}]")
+
+# Print lattice basis vectors (primitive cell)
+print("Lattice Basis:")
+for i, vector in enumerate(parsed_config['lattice_basis']):
+    print(f"  Vector {i+1}: [{', '.join(map(str, vector))}]")
+
+# Print space group basis vectors
+print("Space Group Basis:")
+for i, vector in enumerate(parsed_config['space_group_basis']):
+    print(f"  Vector {i+1}: [{', '.join(map(str, vector))}]")
+
+# Print atom types and their orbital information (as given in the conf file)
+print("\nAtom Types:")
+for atom_type, info in result.input_atom_types.items():
+    print(f"  {atom_type}:")
+    print(f"    Count: {info['count']}")
+    print(f"    Orbitals: {info['orbitals']}")
+
+# Print atom positions in the unit cell
+print(f"\nAtom Positions (Total: {len(parsed_config['atom_positions'])}):")
+for i, pos in enumerate(parsed_config['atom_positions']):
+    print(f"  Position {i+1}:")
+    print(f"    Name: {pos['position_name']}")
+    print(f"    Atom Type: {pos['atom_type']}")
+    print(f"    fractional_coordinates: [{', '.join(map(str, pos['fractional_coordinates']))}]")
 
 
 # ==============================================================================
-# STEP 4: Generate space group representations
+# STEP 4: Report sanity checks
 # ==============================================================================
 print("\n" + "=" * 60)
-print("COMPUTING SPACE GROUP REPRESENTATIONS")
+print("RUNNING SANITY CHECK")
 print("=" * 60)
-
-# Run generate_space_group_representations.py
-sgr_result = subprocess.run(
-    ["python3", "./symmetry/generate_space_group_representations.py"],
-    input=config_json,
-    capture_output=True,
-    text=True
-)
-
-print(f"Exit code: {sgr_result.returncode}")
-
-# Check if space group representations were generated successfully
-if sgr_result.returncode != 0:
-    print("Space group representations generation failed!")
-    print(f"return code={sgr_result.returncode}")
-    print("Error output:")
-    print(sgr_result.stderr)
-    print("Standard output:")
-    print(sgr_result.stdout)
-    exit(sgr_result.returncode)
-else:
-    print("Space group representations generated successfully!")
-
-    # Parse the JSON output
-    try:
-        space_group_representations = json.loads(sgr_result.stdout)
-
-        print("\n" + "=" * 60)
-        print("SPACE GROUP REPRESENTATIONS SUMMARY")
-        print("=" * 60)
-
-        # Get number of space group operations
-        num_operations = len(space_group_representations["space_group_matrices"])
-        print(f"Number of space group operations: {num_operations}")
-
-        # Print space group origin in different coordinate systems
-        print("\nSpace Group Origin:")
-        origin_cart = space_group_representations["space_group_origin_cartesian"]
-        origin_frac_prim = space_group_representations["space_group_origin_fractional_primitive"]
-        print(f"  Bilbao (fractional in space group basis): [{', '.join(map(str, parsed_config['space_group_origin']))}]")
-        print(f"  Cartesian: [{', '.join(f'{x:.6f}' for x in origin_cart)}]")
-        print(f"  Fractional (primitive cell basis): [{', '.join(f'{x:.6f}' for x in origin_frac_prim)}]")
-
-        # Extract orbital representations (s, p, d, f)
-        repr_s, repr_p, repr_d, repr_f = space_group_representations["repr_s_p_d_f"]
-
-        # Print dimensions of representation matrices
-        print(f"\nOrbital Representations:")
-        print(f"  s orbitals: {len(repr_s)} operations × {len(repr_s[0])}×{len(repr_s[0][0])} matrices")
-        print(f"  p orbitals: {len(repr_p)} operations × {len(repr_p[0])}×{len(repr_p[0][0])} matrices")
-        print(f"  d orbitals: {len(repr_d)} operations × {len(repr_d[0])}×{len(repr_d[0][0])} matrices")
-        print(f"  f orbitals: {len(repr_f)} operations × {len(repr_f[0])}×{len(repr_f[0][0])} matrices")
-
-        # Convert to NumPy arrays for further processing
-        space_group_matrices = np.array(space_group_representations["space_group_matrices"])
-        space_group_matrices_cartesian = np.array(space_group_representations["space_group_matrices_cartesian"])
-        space_group_matrices_primitive = np.array(space_group_representations["space_group_matrices_primitive"])
-
-        repr_s_np = np.array(repr_s)
-        repr_p_np = np.array(repr_p)
-        repr_d_np = np.array(repr_d)
-        repr_f_np = np.array(repr_f)
-
-        print("\nSpace group representations loaded and converted to NumPy arrays.")
-        print(f"Available matrices:")
-        print(f"  - space_group_matrices: {space_group_matrices.shape}")
-        print(f"  - space_group_matrices_cartesian: {space_group_matrices_cartesian.shape}")
-        print(f"  - space_group_matrices_primitive: {space_group_matrices_primitive.shape}")
-        print(f"  - s orbital representations: {repr_s_np.shape}")
-        print(f"  - p orbital representations: {repr_p_np.shape}")
-        print(f"  - d orbital representations: {repr_d_np.shape}")
-        print(f"  - f orbital representations: {repr_f_np.shape}")
-
-    except json.JSONDecodeError as e:
-        print("Error parsing JSON output from space group representations:")
-        print(f"JSON Error: {e}")
-        print("Raw output was:")
-        print(sgr_result.stdout)
-        exit(1)
-
-    except KeyError as e:
-        print(f"Missing key in space group representations output: {e}")
-        print("Available keys:", list(space_group_representations.keys()) if 'space_group_representations' in locals() else "Could not parse JSON")
-        exit(1)
+print("Sanity check passed!")
+print("Output:")
+print(result.sanity_message)
 
 
 # ==============================================================================
-# STEP 5: Define orbital mapping for 78-dimensional orbital space
+# STEP 5: Summarize space group representations
 # ==============================================================================
-# Maps orbital names (like '3dxy') to their index in the orbital vector
-# Total: 78 orbitals from 1s to 7f
-orbital_map = {
-    # n=1: 1s (index 0)
-    '1s': 0,
-
-    # n=2: 2s, 2p (indices 1-4)
-    '2s': 1,
-    '2px': 2, '2py': 3, '2pz': 4,
-
-    # n=3: 3s, 3p, 3d (indices 5-13)
-    '3s': 5,
-    '3px': 6, '3py': 7, '3pz': 8,
-    '3dxy': 9, '3dyz': 10, '3dxz': 11, '3dx2-y2': 12, '3dz2': 13,
-
-    # n=4: 4s, 4p, 4d, 4f (indices 14-29)
-    '4s': 14,
-    '4px': 15, '4py': 16, '4pz': 17,
-    '4dxy': 18, '4dyz': 19, '4dxz': 20, '4dx2-y2': 21, '4dz2': 22,
-    '4fxyz': 23, '4fz3': 24, '4fxz2': 25, '4fyz2': 26,
-    '4fz(x2-y2)': 27, '4fx(x2-3y2)': 28, '4fy(3x2-y2)': 29,
-
-    # n=5: 5s, 5p, 5d, 5f (indices 30-45)
-    '5s': 30,
-    '5px': 31, '5py': 32, '5pz': 33,
-    '5dxy': 34, '5dyz': 35, '5dxz': 36, '5dx2-y2': 37, '5dz2': 38,
-    '5fxyz': 39, '5fz3': 40, '5fxz2': 41, '5fyz2': 42,
-    '5fz(x2-y2)': 43, '5fx(x2-3y2)': 44, '5fy(3x2-y2)': 45,
-
-    # n=6: 6s, 6p, 6d, 6f (indices 46-61)
-    '6s': 46,
-    '6px': 47, '6py': 48, '6pz': 49,
-    '6dxy': 50, '6dyz': 51, '6dxz': 52, '6dx2-y2': 53, '6dz2': 54,
-    '6fxyz': 55, '6fz3': 56, '6fxz2': 57, '6fyz2': 58,
-    '6fz(x2-y2)': 59, '6fx(x2-3y2)': 60, '6fy(3x2-y2)': 61,
-
-    # n=7: 7s, 7p, 7d, 7f (indices 62-77)
-    '7s': 62,
-    '7px': 63, '7py': 64, '7pz': 65,
-    '7dxy': 66, '7dyz': 67, '7dxz': 68, '7dx2-y2': 69, '7dz2': 70,
-    '7fxyz': 71, '7fz3': 72, '7fxz2': 73, '7fyz2': 74,
-    '7fz(x2-y2)': 75, '7fx(x2-3y2)': 76, '7fy(3x2-y2)': 77,
-}
-
+space_group_representations = result.space_group_representations
 
-# ==============================================================================
-# STEP 6: Complete orbital basis under symmetry operations
-# ==============================================================================
 print("\n" + "=" * 60)
-print("COMPLETING ORBITALS UNDER SYMMETRY")
+print("SPACE GROUP REPRESENTATIONS SUMMARY")
 print("=" * 60)
 
-# Combine parsed_config and space_group_representations
-combined_input = {
-    "parsed_config": parsed_config,
-    "space_group_representations": space_group_representations
-}
-
-# Convert to JSON for subprocess
-combined_input_json = json.dumps(combined_input)
-
-# Run complete_orbitals.py
-completing_result = subprocess.run(
-    ["python3", "./symmetry/complete_orbitals.py"],
-    input=combined_input_json,
-    capture_output=True,
-    text=True
-)
-
-# Check if orbital completion succeeded
-if completing_result.returncode != 0:
-    print("Orbital completion failed!")
-    print(f"Return code: {completing_result.returncode}")
-    print("Error output:")
-    print(completing_result.stderr)
-    exit(completing_result.returncode)
+# Get number of space group operations
+num_operations = len(space_group_representations["space_group_matrices"])
+print(f"Number of space group operations: {num_operations}")
+
+# Print space group origin in different coordinate systems
+print("\nSpace Group Origin:")
+origin_cart = space_group_representations["space_group_origin_cartesian"]
+origin_frac_prim = space_group_representations["space_group_origin_fractional_primitive"]
+print(f"  Bilbao (fractional in space group basis): [{', '.join(map(str, parsed_config['space_group_origin']))}]")
+print(f"  Cartesian: [{', '.join(f'{x:.6f}' for x in origin_cart)}]")
+print(f"  Fractional (primitive cell basis): [{', '.join(f'{x:.6f}' for x in origin_frac_prim)}]")
+
+# Print group structure (operations modulo lattice translations)
+if space_group_representations["group_structure"] is not None:
+    group_structure = SpaceGroupStructure.from_arrays(space_group_representations["group_structure"])
+    num_elements = len(np.unique(group_structure.representatives))
+    print(f"\nGroup structure: {num_elements} operations modulo lattice, "
+          f"{group_structure.num_conjugacy_classes()} conjugacy classes")
+else:
+    print("\nGroup structure: not available (space group operations are not exact "
+          "in the primitive cell basis)")
 
-# Parse the output
-try:
-    orbital_completion_data = json.loads(completing_result.stdout)
+# Extract orbital representations (s, p, d, f, and g, h, ... if configured)
+repr_by_l = [np.asarray(one_repr) for one_repr in space_group_representations["repr_s_p_d_f"]]
 
-    print("Orbital completion successful!")
+# Print dimensions of representation matrices
+print(f"\nOrbital Representations:")
+for l, one_repr in enumerate(repr_by_l):
+    print(f"  {orbital_letters[l]} orbitals: {one_repr.shape[0]} operations × {one_repr.shape[1]}×{one_repr.shape[2]} matrices")
 
-    # Display which orbitals were added by symmetry
-    print("\n" + "-" * 40)
-    print("ORBITALS ADDED BY SYMMETRY:")
-    print("-" * 40)
+print(f"\nAvailable matrices:")
+print(f"  - space_group_matrices: {space_group_representations['space_group_matrices'].shape}")
+print(f"  - space_group_matrices_cartesian: {space_group_representations['space_group_matrices_cartesian'].shape}")
+print(f"  - space_group_matrices_primitive: {space_group_representations['space_group_matrices_primitive'].shape}")
+for l, one_repr in enumerate(repr_by_l):
+    print(f"  - {orbital_letters[l]} orbital representations: {one_repr.shape}")
 
-    added_orbitals = orbital_completion_data["added_orbitals"]
-    if any(added_orbitals.values()):
-        for atom_name, orbitals in added_orbitals.items():
-            if orbitals:
-                print(f"  {atom_name}: {', '.join(orbitals)}")
-    else:
-        print("  No additional orbitals needed - input was already complete")
-
-    # Display final active orbitals for each atom
-    print("\n" + "-" * 40)
-    print("FINAL ACTIVE ORBITALS PER ATOM:")
-    print("-" * 40)
-
-    updated_vectors = orbital_completion_data["updated_orbital_vectors"]
-    orbital_map_reverse = {v: k for k, v in orbital_map.items()}  # Reverse lookup
-
-    for atom_name, vector in updated_vectors.items():
-        # Find indices where orbital is active (value = 1)
-        active_indices = [i for i, val in enumerate(vector) if val == 1]
-        # Convert indices back to orbital names
-        active_orbital_names = [orbital_map_reverse.get(idx, f"unknown_{idx}") for idx in active_indices]
-        print(f"  {atom_name} ({len(active_orbital_names)} orbitals): {', '.join(active_orbital_names)}")
-
-    # Display symmetry representation information
-    print("\n" + "-" * 40)
-    print("SYMMETRY REPRESENTATIONS ON ACTIVE ORBITALS:")
-    print("-" * 40)
-
-    representations = orbital_completion_data["representations_on_active_orbitals"]
-    for atom_name, repr_matrices in representations.items():
-        if repr_matrices:
-            repr_array = np.array(repr_matrices)
-            print(f"  {atom_name}: {repr_array.shape[0]} operations, {repr_array.shape[1]}×{repr_array.shape[2]} matrices")
-
-    # Update parsed_config with completed orbitals
-    for atom_pos in parsed_config['atom_positions']:
-        atom_name = atom_pos['position_name']
-        atom_type = atom_pos['atom_type']
-
-        # Get the updated orbital vector for this atom
-        if atom_name in updated_vectors:
-            vector = updated_vectors[atom_name]
-            active_indices = [i for i, val in enumerate(vector) if val == 1]
-            active_orbital_names = [orbital_map_reverse.get(idx, f"unknown_{idx}") for idx in active_indices]
-
-            # Update atom_types with completed orbital list
-            parsed_config['atom_types'][atom_type]['orbitals'] = active_orbital_names
-            parsed_config['atom_types'][atom_type]['orbitals_completed'] = True
-
-    # Store completion results for later use
-    orbital_completion_results = {
-        "status": "completed",
-        "added_orbitals": added_orbitals,
-        "orbital_vectors": updated_vectors,
-        "representations_on_active_orbitals": representations,
-    }
-
-except json.JSONDecodeError as e:
-    print("Error parsing JSON output from complete_orbitals.py:")
-    print(f"JSON Error: {e}")
-    print("Raw output:")
-    print(completing_result.stdout)
-    print("Error output:")
-    print(completing_result.stderr)
-    exit(1)
 
-except KeyError as e:
-    print(f"Missing key in orbital completion output: {e}")
-    print("Available keys:", list(orbital_completion_data.keys()) if 'orbital_completion_data' in locals() else "Could not parse JSON")
-    exit(1)
+# ==============================================================================
+# STEP 6: Summarize orbital completion under symmetry operations
+# ==============================================================================
+orbital_completion_data = result.orbital_completion
 
-except Exception as e:
-    print(f"Unexpected error processing orbital completion: {e}")
-    print("Type:", type(e).__name__)
-    exit(1)
+print("\n" + "=" * 60)
+print("COMPLETING ORBITALS UNDER SYMMETRY")
+print("=" * 60)
+print("Orbital completion successful!")
+
+# Display which orbitals were added by symmetry
+print("\n" + "-" * 40)
+print("ORBITALS ADDED BY SYMMETRY:")
+print("-" * 40)
+
+added_orbitals = orbital_completion_data["added_orbitals"]
+if any(added_orbitals.values()):
+    for atom_name, orbitals in added_orbitals.items():
+        if orbitals:
+            print(f"  {atom_name}: {', '.join(orbitals)}")
+else:
+    print("  No additional orbitals needed - input was already complete")
+
+# Display final active orbitals for each atom
+print("\n" + "-" * 40)
+print("FINAL ACTIVE ORBITALS PER ATOM:")
+print("-" * 40)
+
+orbital_map_reverse = orbital_names_of_completion(orbital_completion_data)  # Reverse lookup
+for atom_name, vector in orbital_completion_data["updated_orbital_vectors"].items():
+    # Find indices where orbital is active (value = 1)
+    active_indices = np.where(np.asarray(vector) == 1)[0]
+    # Convert indices back to orbital names
+    active_orbital_names = [orbital_map_reverse.get(idx, f"unknown_{idx}") for idx in active_indices]
+    print(f"  {atom_name} ({len(active_orbital_names)} orbitals): {', '.join(active_orbital_names)}")
+
+# Display symmetry representation information
+print("\n" + "-" * 40)
+print("SYMMETRY REPRESENTATIONS ON ACTIVE ORBITALS:")
+print("-" * 40)
+
+for atom_name, repr_array in orbital_completion_data["representations_on_active_orbitals"].items():
+    if repr_array.size > 0:
+        print(f"  {atom_name}: {repr_array.shape[0]} operations, {repr_array.shape[1]}×{repr_array.shape[2]} matrices")
 
 print("\n" + "=" * 60)
 print("ORBITAL COMPLETION FINISHED")
@@ -400,53 +225,48 @@ print("=" * 60)
 
 
 # ==============================================================================
-# STEP 7: Find neighboring atoms in supercell
+# STEP 7: Summarize neighboring atoms in supercell
 # ==============================================================================
 print("\n" + "=" * 60)
 print("FINDING NEIGHBORING ATOMS")
 print("=" * 60)
-#
-# print(f"Parsed configuration summary:")
-# for key, value in parsed_config.items():
-#     print(f"  {key}: {value}")
-
-# Run find_neighbors.py to identify neighboring atoms
-find_neighbor_result = subprocess.run(
-    ["python3", "./hoppin_term_relations/find_neighbors.py"],
-    input=combined_input_json,
-    capture_output=True,
-    text=True
-)
-
-# Print any error messages from stderr
-if find_neighbor_result.stderr:
-    print("Debug output from find_neighbors.py:")
-    print(find_neighbor_result.stderr)
-
-# Check if the subprocess completed successfully
-if find_neighbor_result.returncode != 0:
-    print(f"Error: find_neighbors.py exited with code {find_neighbor_result.returncode}")
-    sys.exit(find_neighbor_result.returncode)
-
-# Parse the atom_pairs from stdout (JSON format)
-try:
-    atom_pairs = json.loads(find_neighbor_result.stdout)
-    print(f"\nSuccessfully loaded {len(atom_pairs)} atom pairs")
 
-    # Optional: Print summary statistics
-    if atom_pairs:
-        distances = [pair['distance'] for pair in atom_pairs]
-        unique_distances = sorted(set(distances))
-        print(f"Number of unique distances: {len(unique_distances)}")
-        print(f"Distance range: {min(distances):.6f} to {max(distances):.6f}")
-
-except json.JSONDecodeError as e:
-    print(f"Error: Failed to parse JSON output from find_neighbors.py")
-    print(f"JSON decode error: {e}")
-    print(f"Output received (first 500 chars):")
-    print(find_neighbor_result.stdout[:500])
-    sys.exit(1)
-
-# Now atom_pairs is available as a Python list of dictionaries
-# Each element has the structure defined in find_neighbors.py
-print("\nAtom pairs are ready for further processing")
\ No newline at end of file
+atom_pairs = result.atom_pairs
+if isinstance(atom_pairs, IrreduciblePairs):
+    # Symmetry-reduced: one representative pair per orbit
+    print(f"\nSuccessfully loaded {len(atom_pairs)} irreducible atom pairs "
+          f"({atom_pairs.num_pairs()} atom pairs after symmetry expansion)")
+    pair_table = atom_pairs.table
+elif isinstance(atom_pairs, PairStreamFile):
+    # Streamed: only the sidecar metadata is in memory, the pairs stay on disk
+    print(f"\nSuccessfully streamed {len(atom_pairs)} atom pairs to {atom_pairs.file}")
+    pair_table = atom_pairs
+else:
+    print(f"\nSuccessfully loaded {len(atom_pairs)} atom pairs")
+    pair_table = atom_pairs
+
+# Cell ranges of the neighbor search
+search_range = pair_table.search_cell_num_vec
+print(f"Neighbor cell range searched: {search_range.tolist()} ({int(np.prod(2*search_range + 1))} cells), "
+      f"pairs within {pair_table.neighbor_cell_num_vec.tolist()}")
+
+# Optional: Print summary statistics
+if len(pair_table) > 0:
+    print(f"Number of unique distances: {len(pair_table.unique_distances)}")
+    print(f"Distance range: {pair_table.shell_lower[0]:.6f} to {pair_table.shell_upper[-1]:.6f}")
+    if len(pair_table.unique_distances) > 1:
+        print(f"Smallest gap between distance shells: {pair_table.shell_gap_to_next[:-1].min():.6f}")
+
+# Print wall-clock time of each stage
+print("\nStage timings:")
+for stage, seconds in result.timings.items():
+    cached_note = " (cached)" if stage in result.cached_stages else ""
+    print(f"  {stage}: {seconds:.3f} s{cached_note}")
+
+# Now atom_pairs is available as a PairTable (NumPy columns, see pair_table.py);
+# iterating it yields the pair dictionaries defined in find_neighbors.py.
+# With neighbor_symmetry_reduction=true it is an IrreduciblePairs object,
+# atom_pairs.expand() reconstructs the full PairTable
+# (see irreducible_pairs.py). With --stream-pairs it is a PairStreamFile,
+# atom_pairs.iter_blocks() yields bounded PairTable blocks (see pair_stream.py)
+print("\nAtom pairs are ready for further processing")
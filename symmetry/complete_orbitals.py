@@ -1,8 +1,16 @@
 import numpy as np
 import sys
+import os
 import re
 import json
-import copy
+
+# Make the repository root importable when this file is run as a script
+if __package__ in (None, ""):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pipeline.stage_io import write_stage, read_stage, pop_handoff_arg
+from symmetry.union_find import UnionFind
+from symmetry.real_spherical_harmonics import harmonic_components
 
 # ==============================================================================
 # Orbital completeness checker and symmetry-based orbital completion script
@@ -22,124 +30,139 @@ json_err_code = 4   # JSON parsing error
 
 
 # ==============================================================================
-# STEP 1: Read and parse JSON input from stdin
+# STEP 1: Define orbital indexing system
 # ==============================================================================
-try:
-    combined_input_json = sys.stdin.read()
-    combined_input = json.loads(combined_input_json)
-except json.JSONDecodeError as e:
-    print(f"Error parsing JSON input: {e}", file=sys.stderr)
-    exit(json_err_code)
+# Orbital names within a shell of angular momentum l, in the order of the
+# representation matrices of space_group_representation_orbitals_all().
+# For l >= 4 (g, h, i) the names follow harmonic_components(l) in
+# real_spherical_harmonics.py, e.g. 5gC0, 5gC1, 5gS1, ..., 5gC4, 5gS4.
+orbital_names_spdf = {
+    0: ['s'],
+    1: ['px', 'py', 'pz'],
+    2: ['dxy', 'dyz', 'dxz', 'dx2-y2', 'dz2'],
+    3: ['fxyz', 'fz3', 'fxz2', 'fyz2', 'fz(x2-y2)', 'fx(x2-3y2)', 'fy(3x2-y2)'],
+}
 
+# Spectroscopic letter of each angular momentum l = 0, 1, 2, ...
+orbital_letters = "spdfghi"
 
-# ==============================================================================
-# STEP 2: Define orbital indexing system
-# ==============================================================================
-# Global mapping from orbital names to indices (0-77)
-# This covers all orbitals from 1s to 7f
-# Total: 78 orbitals organized by principal quantum number and angular momentum
-orbital_map = {
-    # n=1: 1s (index 0)
-    '1s': 0,
-
-    # n=2: 2s, 2p (indices 1-4)
-    '2s': 1,
-    '2px': 2, '2py': 3, '2pz': 4,
-
-    # n=3: 3s, 3p, 3d (indices 5-13)
-    '3s': 5,
-    '3px': 6, '3py': 7, '3pz': 8,
-    '3dxy': 9, '3dyz': 10, '3dxz': 11, '3dx2-y2': 12, '3dz2': 13,
-
-    # n=4: 4s, 4p, 4d, 4f (indices 14-29)
-    '4s': 14,
-    '4px': 15, '4py': 16, '4pz': 17,
-    '4dxy': 18, '4dyz': 19, '4dxz': 20, '4dx2-y2': 21, '4dz2': 22,
-    '4fxyz': 23, '4fz3': 24, '4fxz2': 25, '4fyz2': 26,
-    '4fz(x2-y2)': 27, '4fx(x2-3y2)': 28, '4fy(3x2-y2)': 29,
-
-    # n=5: 5s, 5p, 5d, 5f (indices 30-45)
-    '5s': 30,
-    '5px': 31, '5py': 32, '5pz': 33,
-    '5dxy': 34, '5dyz': 35, '5dxz': 36, '5dx2-y2': 37, '5dz2': 38,
-    '5fxyz': 39, '5fz3': 40, '5fxz2': 41, '5fyz2': 42,
-    '5fz(x2-y2)': 43, '5fx(x2-3y2)': 44, '5fy(3x2-y2)': 45,
-
-    # n=6: 6s, 6p, 6d, 6f (indices 46-61)
-    '6s': 46,
-    '6px': 47, '6py': 48, '6pz': 49,
-    '6dxy': 50, '6dyz': 51, '6dxz': 52, '6dx2-y2': 53, '6dz2': 54,
-    '6fxyz': 55, '6fz3': 56, '6fxz2': 57, '6fyz2': 58,
-    '6fz(x2-y2)': 59, '6fx(x2-3y2)': 60, '6fy(3x2-y2)': 61,
-
-    # n=7: 7s, 7p, 7d, 7f (indices 62-77)
-    '7s': 62,
-    '7px': 63, '7py': 64, '7pz': 65,
-    '7dxy': 66, '7dyz': 67, '7dxz': 68, '7dx2-y2': 69, '7dz2': 70,
-    '7fxyz': 71, '7fz3': 72, '7fxz2': 73, '7fyz2': 74,
-    '7fz(x2-y2)': 75, '7fx(x2-3y2)': 76, '7fy(3x2-y2)': 77,
-}
+# Shells exist for principal quantum numbers n = 1..7 (l < n)
+max_principal_number = 7
 
 
-# ==============================================================================
-# STEP 3: Extract configuration and space group data
-# ==============================================================================
-# Split the combined input into two main components
-parsed_config = combined_input["parsed_config"]
-space_group_representations = combined_input["space_group_representations"]
+def orbital_component_names(l):
+    """
+    Names of the 2l+1 orbitals of a shell of angular momentum l (without n)
+
+    :param l: Angular momentum quantum number, 0 <= l < len(orbital_letters)
+    :return: List of names, e.g. ['px', 'py', 'pz'] for l = 1
+    """
+    if l in orbital_names_spdf:
+        return orbital_names_spdf[l]
+    return [f"{orbital_letters[l]}{kind}{m}" for kind, m, _ in harmonic_components(l)]
+
 
-# Extract space group matrices in different coordinate systems
-space_group_matrices = np.array(space_group_representations["space_group_matrices"])
-space_group_matrices_cartesian = np.array(space_group_representations["space_group_matrices_cartesian"])
-space_group_matrices_primitive = np.array(space_group_representations["space_group_matrices_primitive"])
+def orbital_angular_momentum(orbital):
+    """
+    Angular momentum l of an orbital name such as '3dxy' or '5gC2'
+
+    :param orbital: Orbital name
+    :return: l, or None if the name does not start with n and an orbital letter
+    """
+    if len(orbital) < 2 or not orbital[0].isdigit() or orbital[1] not in orbital_letters:
+        return None
+    return orbital_letters.index(orbital[1])
 
-# Extract representation matrices for different orbital angular momenta
-# These show how symmetry operations transform s, p, d, f orbitals
-repr_s, repr_p, repr_d, repr_f = space_group_representations["repr_s_p_d_f"]
 
-repr_s_np = np.array(repr_s)
-repr_p_np = np.array(repr_p)
-repr_d_np = np.array(repr_d)
-repr_f_np = np.array(repr_f)
+def configured_l_max(parsed_config):
+    """
+    Largest angular momentum needed by the orbitals of a configuration (at least 3)
 
-# Get number of symmetry operations (N in notes)
-num_operations, _, _ = repr_s_np.shape
+    :param parsed_config: Parsed configuration dictionary (output of parse_conf.py)
+    :return: l_max for space_group_representation_orbitals_all()
+    """
+    l_max = 3
+    for atom_type in parsed_config['atom_types'].values():
+        for orbital in atom_type['orbitals']:
+            l = orbital_angular_momentum(orbital)
+            if l is not None:
+                l_max = max(l_max, l)
+    return l_max
 
 
 # ==============================================================================
-# STEP 4: Build combined orbital representation matrix
+# STEP 2: Define orbital shell layout
 # ==============================================================================
+class OrbitalLayout:
+    """
+    Shells, global orbital indices and names of all orbitals up to l_max
+
+    Shells (n, l) with l < n <= max_principal_number and l <= l_max are ordered
+    by n, then l: [1s, 2s, 2p, 3s, 3p, 3d, 4s, 4p, 4d, 4f, ...]. The size of each
+    shell block is len(harmonic_components(l)) = 2l+1.
+
+    :param l_max: Largest angular momentum (3: the 78 orbitals 1s to 7f)
+    """
+
+    def __init__(self, l_max=3):
+        if not 0 <= l_max < len(orbital_letters):
+            raise ValueError(f"l_max must be between 0 and {len(orbital_letters) - 1}, got {l_max}")
+        self.l_max = l_max
+
+        # Orbital shells (principal quantum number n, angular momentum l)
+        self.shells = [(n, l) for n in range(1, max_principal_number + 1) for l in range(min(n - 1, l_max) + 1)]
+
+        # IndSPDF: dimension 2l+1 of each shell (s=1, p=3, d=5, f=7, g=9, ...)
+        self.nums = np.array([len(harmonic_components(l)) for _, l in self.shells])
+
+        # Total dimension of orbital space (78 for l_max = 3)
+        self.max_dim = int(np.sum(self.nums))
+
+        # First orbital index of each shell, and shell of each orbital index
+        self.shell_offsets = np.concatenate([[0], np.cumsum(self.nums)])
+        self.shell_of_index = np.repeat(np.arange(len(self.shells)), self.nums)
+
+        # Mapping from orbital names (e.g. '3dxy') to global indices
+        self.orbital_map = {}
+        for shell, (n, l) in enumerate(self.shells):
+            for i, name in enumerate(orbital_component_names(l)):
+                self.orbital_map[f"{n}{name}"] = int(self.shell_offsets[shell]) + i
+
+        # Orbital name of each global index
+        self.orbital_names = list(self.orbital_map)
+
+
+# Default layout of s, p, d, f orbitals (1s to 7f, 78 orbitals)
+default_orbital_layout = OrbitalLayout(3)
+
+# Global mapping from orbital names to indices (0-77)
+# n=1: 1s (index 0); n=2: 2s, 2p (indices 1-4); n=3: 3s, 3p, 3d (indices 5-13);
+# n=4..7: ns, np, nd, nf (16 orbitals each)
+orbital_map = default_orbital_layout.orbital_map
+
+# Orbital shells (n, l) in the order of their blocks in orbital_map
+orbital_shells = default_orbital_layout.shells
+
 # IndSPDF: Array defining the dimensionality of each orbital shell
-# Structure: [1s, 2s, 2p, 3s, 3p, 3d, 4s, 4p, 4d, 4f, ...]
-# Values: dimension of each shell (s=1, p=3, d=5, f=7)
-orbital_nums_spdf = np.array([
-    1,           # 1s
-    1, 3,        # 2s, 2p
-    1, 3, 5,     # 3s, 3p, 3d
-    1, 3, 5, 7,  # 4s, 4p, 4d, 4f
-    1, 3, 5, 7,  # 5s, 5p, 5d, 5f
-    1, 3, 5, 7,  # 6s, 6p, 6d, 6f
-    1, 3, 5, 7,  # 7s, 7p, 7d, 7f
-])
-
-print(f"len(orbital_nums_spdf)={len(orbital_nums_spdf)}", file=sys.stderr)
+orbital_nums_spdf = default_orbital_layout.nums
 
 # Total dimension of orbital space (should be 78)
-orbital_max_dim = np.sum(orbital_nums_spdf)
-print(f"orbital_max_dim={orbital_max_dim}", file=sys.stderr)
+orbital_max_dim = default_orbital_layout.max_dim
+
+# First orbital index of each shell, and shell of each orbital index
+orbital_shell_offsets = default_orbital_layout.shell_offsets
+orbital_shell_of_index = default_orbital_layout.shell_of_index
 
-# SymSPDF: Combined representation matrix for all orbitals
-# Shape: (num_operations, 78, 78)
-# This is a block diagonal matrix with blocks for each orbital shell
-spdf_combined = np.zeros((num_operations, orbital_max_dim, orbital_max_dim))
+# Threshold for a representation matrix element to couple two orbitals
+coupling_tolerance = 1e-6
 
 
 # ==============================================================================
-# STEP 5: Define function to build orbital vectors for each atom
+# STEP 3: Define function to build orbital vectors for each atom
 # ==============================================================================
-def build_orbital_vectors(parsed_config):
+def build_orbital_vectors(parsed_config, layout=default_orbital_layout):
     """
-    Build a length-78 orbital vector for each atom in the configuration
+    Build a length-78 orbital vector (layout.max_dim for other layouts) for each atom in the configuration
 
     The orbital vector is a binary array where 1 indicates an active orbital
     and 0 indicates an inactive orbital. This represents which orbitals are
@@ -150,6 +173,7 @@ def build_orbital_vectors(parsed_config):
     indices corresponding to 2s and 2pz, and 0's elsewhere.
 
     :param parsed_config: Dictionary containing atom types and their orbitals
+    :param layout: OrbitalLayout defining the orbital indices
     :return: Dictionary mapping atom position names to their orbital vectors (78-dim binary arrays)
     """
     # Build vectors for each atom position
@@ -163,12 +187,12 @@ def build_orbital_vectors(parsed_config):
         orbitals = parsed_config['atom_types'][atom_type]['orbitals']
 
         # Create 78-dimensional binary orbital vector (all zeros initially)
-        orbital_vector = np.zeros(78)
+        orbital_vector = np.zeros(layout.max_dim)
 
         # Set 1 for each active orbital
         for orbital in orbitals:
-            if orbital in orbital_map:
-                orbital_vector[orbital_map[orbital]] = 1
+            if orbital in layout.orbital_map:
+                orbital_vector[layout.orbital_map[orbital]] = 1
             else:
                 print(f"Warning: Orbital '{orbital}' for atom '{position_name}' not recognized", file=sys.stderr)
 
@@ -178,145 +202,298 @@ def build_orbital_vectors(parsed_config):
 
 
 # ==============================================================================
-# STEP 6: Fill the combined representation matrix with orbital blocks
+# STEP 4: Define the block-sparse representation on all 78 orbitals
 # ==============================================================================
-# Fill the diagonal blocks of spdf_combined
-# Each block corresponds to one shell (e.g., 2s, 2p, 3d, etc.)
-for j in range(num_operations):
-    current_idx = 0
+class ShellBlockRepresentation:
+    """
+    Block diagonal representation of the 78 orbitals (layout.max_dim in general), stored per shell
 
-    # Iterate through orbital_nums_spdf to place each block
-    for i, block_size in enumerate(orbital_nums_spdf):
-        if block_size == 1:  # s orbital (1x1 block)
-            spdf_combined[j, current_idx:current_idx+1, current_idx:current_idx+1] = repr_s_np[j]
-        elif block_size == 3:  # p orbital (3x3 block)
-            spdf_combined[j, current_idx:current_idx+3, current_idx:current_idx+3] = repr_p_np[j]
-        elif block_size == 5:  # d orbital (5x5 block)
-            spdf_combined[j, current_idx:current_idx+5, current_idx:current_idx+5] = repr_d_np[j]
-        elif block_size == 7:  # f orbital (7x7 block)
-            spdf_combined[j, current_idx:current_idx+7, current_idx:current_idx+7] = repr_f_np[j]
+    Symmetry operations never mix different shells, so the (num_ops, 78, 78)
+    representation is block diagonal with one (num_ops, 2l+1, 2l+1) block per
+    shell. Only the blocks of the requested shells are kept, and all shells
+    with the same l share the same array.
 
-        current_idx += block_size
+    :param repr_by_l: Representations indexed by l, [repr_s, repr_p, repr_d, repr_f, ...]
+    :param shells: Indices into layout.shells of the shells to materialize (default: all)
+    :param layout: OrbitalLayout of the orbitals (default: s, p, d, f)
+    """
 
+    def __init__(self, repr_by_l, shells=None, layout=default_orbital_layout):
+        self.layout = layout
+        if shells is None:
+            shells = range(len(layout.shells))
+        self.num_operations = len(repr_by_l[0])
+
+        # One array per angular momentum, shared by the shells of that l
+        used_l = sorted({layout.shells[shell][1] for shell in shells})
+        self.repr_by_l = {l: np.asarray(repr_by_l[l], dtype=float) for l in used_l}
+        self.blocks = {shell: self.repr_by_l[layout.shells[shell][1]] for shell in sorted(shells)}
+
+        # IndNonZero per l: orbitals i, j of a shell are coupled if any operation mixes them
+        self.coupling_by_l = {l: np.sum(np.abs(matrices), axis=0) > coupling_tolerance
+                              for l, matrices in self.repr_by_l.items()}
+
+    def coupling(self, shell):
+        """
+        Boolean (2l+1, 2l+1) matrix of the orbitals of a shell coupled by at least one operation
+        """
+        return self.coupling_by_l[self.layout.shells[shell][1]]
+
+    def coupling_components(self):
+        """
+        Connected components of the coupling graph of the 78 orbitals
+
+        Orbitals of shells that are not materialized stay singletons.
+
+        :return: tuple: (component label of each orbital index, shape (78,), number of components)
+        """
+        offsets = self.layout.shell_offsets
+        components = UnionFind(self.layout.max_dim)
+        for shell in self.blocks:
+            coupled_i, coupled_j = np.nonzero(self.coupling(shell))
+            components.union_edges(offsets[shell] + coupled_i, offsets[shell] + coupled_j)
+        return components.labels()
+
+    def submatrices(self, active_indices):
+        """
+        Representation restricted to a set of orbitals
+
+        Equal to dense[:, active_indices[:, None], active_indices[None, :]]
+        of the dense (num_ops, 78, 78) representation.
+
+        :param active_indices: Sorted orbital indices (0-77), all in materialized shells
+        :return: Array of shape (num_ops, n, n)
+        """
+        active_indices = np.asarray(active_indices)
+        num_active = len(active_indices)
+        restricted = np.zeros((self.num_operations, num_active, num_active))
+
+        active_shells = self.layout.shell_of_index[active_indices]
+        for shell in np.unique(active_shells):
+            positions = np.nonzero(active_shells == shell)[0]
+            local_indices = active_indices[positions] - self.layout.shell_offsets[shell]
+            restricted[:, positions[:, None], positions[None, :]] = \
+                self.blocks[shell][:, local_indices[:, None], local_indices[None, :]]
+
+        return restricted
+
+    def to_dense(self):
+        """
+        Dense (num_ops, 78, 78) representation (zero blocks for shells not materialized)
+        """
+        max_dim = self.layout.max_dim
+        dense = np.zeros((self.num_operations, max_dim, max_dim))
+        for shell, block in self.blocks.items():
+            start, stop = self.layout.shell_offsets[shell], self.layout.shell_offsets[shell + 1]
+            dense[:, start:stop, start:stop] = block
+        return dense
+
+
+def build_spdf_combined(repr_s_np, repr_p_np, repr_d_np, repr_f_np):
+    """
+    Build the dense block diagonal representation of all 78 orbitals
 
-# ==============================================================================
-# STEP 7: Find which orbitals are coupled by symmetry
-# ==============================================================================
-# IndNonZero: Boolean matrix indicating which orbitals are coupled by symmetry
-# If non_zero_spdf_combined[i,j] is True, orbitals i and j are coupled by at least one symmetry operation
-# This is computed by summing absolute values across all symmetry operations
-non_zero_spdf_combined = np.sum(np.abs(spdf_combined), axis=0) > 1e-6
+    Each block corresponds to one shell (e.g., 2s, 2p, 3d, etc.).
+    complete_orbitals() uses the block-sparse ShellBlockRepresentation instead.
 
+    :param repr_s_np: s orbital representations, shape (num_ops, 1, 1)
+    :param repr_p_np: p orbital representations, shape (num_ops, 3, 3)
+    :param repr_d_np: d orbital representations, shape (num_ops, 5, 5)
+    :param repr_f_np: f orbital representations, shape (num_ops, 7, 7)
+    :return: SymSPDF, combined representation matrix of shape (num_ops, 78, 78)
+    """
+    return ShellBlockRepresentation([repr_s_np, repr_p_np, repr_d_np, repr_f_np]).to_dense()
 
-# ==============================================================================
-# STEP 8: Build initial orbital vectors from user input
-# ==============================================================================
-# Create orbital vectors for each atom based on user-specified orbitals
-atom_orbital_vectors = build_orbital_vectors(parsed_config)  # Binary vectors with 1 for active orbitals
 
+def completed_orbital_mask(active_mask, orbital_components):
+    """
+    Close sets of active orbitals under symmetry
 
-# ==============================================================================
-# STEP 9: Complete orbital sets using symmetry coupling
-# ==============================================================================
-# Update atom_orbital_vectors based on symmetry coupling
-# If user specifies orbital A, and symmetry couples A to B, then B must also be included
-updated_atom_orbital_vectors = {}
-added_orbitals_dict = {}  # Dictionary to store which orbitals were added for each atom
-
-for atom_name, orbital_vector in atom_orbital_vectors.items():
-    # Start with a copy of the original vector
-    updated_vector = copy.deepcopy(orbital_vector)
-
-    # Find indices where the orbital vector has 1 (active orbitals)
-    active_orbital_indices = np.where(orbital_vector == 1)[0]
-
-    # For each active orbital
-    for orbital_idx in active_orbital_indices:
-        # Find all orbitals coupled to this one by symmetry
-        # Look at column orbital_idx in non_zero_spdf_combined
-        coupled_orbital_indices = np.where(non_zero_spdf_combined[:, orbital_idx])[0]
-
-        # Set all coupled positions to 1 (add them to the basis)
-        updated_vector[coupled_orbital_indices] = 1
-
-    updated_atom_orbital_vectors[atom_name] = updated_vector
-
-    # Report which orbitals were added
-    added_indices = np.where((updated_vector == 1) & (orbital_vector == 0))[0]
-    if len(added_indices) > 0:
-        # Get orbital names for the added indices
-        added_orbitals = [k for k, v in orbital_map.items() if v in added_indices]
-        added_orbitals_dict[atom_name] = added_orbitals
-    else:
-        added_orbitals_dict[atom_name] = []  # Empty list if no orbitals added
+    An orbital is added if it lies in the same coupling component as an
+    active orbital; the result is closed under all operations by construction.
+
+    :param active_mask: Boolean array (num_atoms, 78) of the specified orbitals
+    :param orbital_components: Component label of each orbital index, shape (78,)
+    :return: Boolean array (num_atoms, 78) of the completed orbital sets
+    """
+    num_atoms = active_mask.shape[0]
+    num_components = int(orbital_components.max()) + 1
 
-# Replace the original vectors with updated (completed) ones
-atom_orbital_vectors = updated_atom_orbital_vectors  # Now labels all symmetry-required orbitals with 1
+    # Components touched by the active orbitals of each atom
+    atom_idx, orbital_idx = np.nonzero(active_mask)
+    touched = np.zeros((num_atoms, num_components), dtype=bool)
+    touched[atom_idx, orbital_components[orbital_idx]] = True
 
-print(f"atom_orbital_vectors={atom_orbital_vectors}", file=sys.stderr)
-print(f"added_orbitals_dict={added_orbitals_dict}", file=sys.stderr)
+    return touched[:, orbital_components]
 
 
 # ==============================================================================
-# STEP 10: Extract symmetry representations for active orbitals only
+# STEP 5: Define the stage function completing the orbital sets
 # ==============================================================================
-# For each atom, extract the submatrices of symmetry representations
-# that act only on its active orbitals (reduces dimension from 78x78 to n×n)
-repr_on_active_orbitals = {}
-
-for atom_name, orbital_vector in atom_orbital_vectors.items():
-    # Find indices of active orbitals for this atom
-    active_indices = np.where(orbital_vector == 1)[0]
-
-    if len(active_indices) > 0:
-        # Create index arrays for extracting submatrices
-        # idx will select rows and columns corresponding to active orbitals
-        idx = np.ix_(active_indices, active_indices)
-
-        # Extract the symmetry matrices for just these orbitals
-        repr_matrices_for_atom = []
-        for sym_op in range(num_operations):
-            # Extract the submatrix from spdf_combined for this symmetry operation
+def complete_orbitals(parsed_config: dict, space_group_representations: dict) -> dict:
+    """
+    Complete each atom's orbital set under the space group and extract representations
+
+    If user specifies orbital A, and symmetry couples A to B, then B must also be included
+
+    :param parsed_config: Parsed configuration dictionary (output of parse_conf.py)
+    :param space_group_representations: Output of generate_space_group_representations(),
+                                        repr_s_p_d_f may hold NumPy arrays or nested lists
+    :return: Dictionary with
+             updated_orbital_vectors: atom name -> 78-dim binary array (after symmetry completion;
+                                      longer if repr_s_p_d_f goes beyond l = 3),
+             added_orbitals: atom name -> list of orbital names added by symmetry,
+             representations_on_active_orbitals: atom name -> array (num_ops, n, n),
+             orbital_names: orbital name of each index of the orbital vectors
+    """
+    # Orbital layout for all angular momenta with a representation (s, p, d, f, g, ...)
+    repr_by_l = space_group_representations["repr_s_p_d_f"]
+    layout = OrbitalLayout(len(repr_by_l) - 1)
+
+    # Create orbital vectors for each atom based on user-specified orbitals
+    atom_orbital_vectors = build_orbital_vectors(parsed_config, layout)  # Binary vectors with 1 for active orbitals
+
+    # Shells used by at least one atom (symmetry never couples different shells)
+    used_shells = set()
+    for orbital_vector in atom_orbital_vectors.values():
+        used_shells.update(layout.shell_of_index[np.where(orbital_vector == 1)[0]].tolist())
+
+    # SymSPDF restricted to the used shells, one block per shell
+    # Representation matrices for different orbital angular momenta (s, p, d, f, ...)
+    # show how symmetry operations transform the orbitals of each block
+    spdf_blocks = ShellBlockRepresentation(repr_by_l, used_shells, layout)
+
+    # Connected components of the coupling graph (orbital i ~ j if any operation mixes them)
+    orbital_components, _ = spdf_blocks.coupling_components()
+
+    # Close all atoms at once: an orbital becomes active if its component
+    # contains an orbital the user specified for that atom
+    atom_names = list(atom_orbital_vectors)
+    active_mask = np.array([atom_orbital_vectors[name] == 1 for name in atom_names]).reshape(len(atom_names), layout.max_dim)
+    closed_mask = completed_orbital_mask(active_mask, orbital_components)
+
+    updated_atom_orbital_vectors = {}
+    added_orbitals_dict = {}  # Dictionary to store which orbitals were added for each atom
+
+    for atom_idx, atom_name in enumerate(atom_names):
+        orbital_vector = atom_orbital_vectors[atom_name]
+        updated_vector = closed_mask[atom_idx].astype(orbital_vector.dtype)
+        updated_atom_orbital_vectors[atom_name] = updated_vector
+
+        # Report which orbitals were added
+        added_indices = np.where((updated_vector == 1) & (orbital_vector == 0))[0]
+        if len(added_indices) > 0:
+            # Get orbital names for the added indices
+            added_orbitals = [layout.orbital_names[idx] for idx in added_indices]
+            added_orbitals_dict[atom_name] = added_orbitals
+        else:
+            added_orbitals_dict[atom_name] = []  # Empty list if no orbitals added
+
+    # For each atom, extract the submatrices of symmetry representations
+    # that act only on its active orbitals (reduces dimension from 78x78 to n×n)
+    repr_on_active_orbitals = {}
+
+    for atom_name, orbital_vector in updated_atom_orbital_vectors.items():
+        # Find indices of active orbitals for this atom
+        active_indices = np.where(orbital_vector == 1)[0]
+
+        if len(active_indices) > 0:
+            # Extract the symmetry matrices for just these orbitals
             # This gives the representation acting on this atom's orbital subspace
-            submatrix = spdf_combined[sym_op][idx]
-            repr_matrices_for_atom.append(submatrix)
+            repr_on_active_orbitals[atom_name] = spdf_blocks.submatrices(active_indices)
+        else:
+            repr_on_active_orbitals[atom_name] = np.array([])
 
-        repr_on_active_orbitals[atom_name] = np.array(repr_matrices_for_atom)
+    return {
+        # Updated orbital vectors (after symmetry completion)
+        "updated_orbital_vectors": updated_atom_orbital_vectors,
 
-        print(f"Atom {atom_name}: Extracted {num_operations} representation matrices of size {len(active_indices)}x{len(active_indices)}", file=sys.stderr)
-    else:
-        repr_on_active_orbitals[atom_name] = np.array([])
-        print(f"Atom {atom_name}: No active orbitals", file=sys.stderr)
+        # List of orbitals that were added by symmetry for each atom
+        "added_orbitals": added_orbitals_dict,
 
+        # Symmetry representation matrices acting on each atom's active orbital subspace
+        "representations_on_active_orbitals": repr_on_active_orbitals,
 
-# ==============================================================================
-# STEP 11: Verify and report results (debugging output)
-# ==============================================================================
-for atom_name, repr_matrices in repr_on_active_orbitals.items():
-    if repr_matrices.size > 0:
-        print(f"\nAtom {atom_name}:", file=sys.stderr)
-        print(f"  Number of symmetry operations: {repr_matrices.shape[0]}", file=sys.stderr)
-        print(f"  Representation matrix dimension: {repr_matrices.shape[1]}x{repr_matrices.shape[2]}", file=sys.stderr)
+        # Orbital name of each index of the orbital vectors
+        "orbital_names": layout.orbital_names
+    }
 
-        # Get the orbital names for this atom
-        active_indices = np.where(atom_orbital_vectors[atom_name] == 1)[0]
-        active_orbital_names = [name for name, idx in orbital_map.items() if idx in active_indices]
-        print(f"  Active orbitals: {active_orbital_names}", file=sys.stderr)
 
+def orbital_names_of_completion(orbital_completion):
+    """
+    Orbital name of each index of the completed orbital vectors
 
-# ==============================================================================
-# STEP 12: Package results and output as JSON
-# ==============================================================================
-output_data = {
-    # Updated orbital vectors (after symmetry completion)
-    "updated_orbital_vectors": {name: vec.tolist() for name, vec in atom_orbital_vectors.items()},
+    :param orbital_completion: Output of complete_orbitals()
+    :return: Dictionary orbital index -> orbital name
+    """
+    names = orbital_completion.get("orbital_names", default_orbital_layout.orbital_names)
+    return {idx: str(name) for idx, name in enumerate(names)}
 
-    # List of orbitals that were added by symmetry for each atom
-    "added_orbitals": added_orbitals_dict,
 
-    # Symmetry representation matrices acting on each atom's active orbital subspace
-    "representations_on_active_orbitals": {name: matrices.tolist() for name, matrices in repr_on_active_orbitals.items()}
-}
+def orbital_completion_to_json(orbital_completion):
+    """
+    Convert the NumPy arrays of the orbital completion result to nested lists
+
+    :param orbital_completion: Output of complete_orbitals()
+    :return: JSON-serializable dictionary with the same keys
+    """
+    return {
+        "updated_orbital_vectors": {name: vec.tolist() for name, vec in orbital_completion["updated_orbital_vectors"].items()},
+        "added_orbitals": orbital_completion["added_orbitals"],
+        "representations_on_active_orbitals": {name: matrices.tolist() for name, matrices in orbital_completion["representations_on_active_orbitals"].items()},
+        "orbital_names": list(orbital_completion["orbital_names"])
+    }
+
 
-# Output as JSON to stdout
-print(json.dumps(output_data), file=sys.stdout)
\ No newline at end of file
+# ==============================================================================
+# STEP 6: Read JSON from stdin, complete orbitals and output as JSON
+# ==============================================================================
+if __name__ == "__main__":
+    _, handoff_dir = pop_handoff_arg(sys.argv[1:])
+    if handoff_dir is not None:
+        # Read both inputs from the handoff directory (zero-copy arrays)
+        parsed_config = read_stage(handoff_dir, "parse_conf")
+        space_group_representations = read_stage(handoff_dir, "space_group_representations")
+    else:
+        try:
+            combined_input_json = sys.stdin.read()
+            combined_input = json.loads(combined_input_json)
+        except json.JSONDecodeError as e:
+            print(f"Error parsing JSON input: {e}", file=sys.stderr)
+            exit(json_err_code)
+
+        # Split the combined input into two main components
+        parsed_config = combined_input["parsed_config"]
+        space_group_representations = combined_input["space_group_representations"]
+
+    layout = OrbitalLayout(len(space_group_representations["repr_s_p_d_f"]) - 1)
+    print(f"len(orbital_nums_spdf)={len(layout.nums)}", file=sys.stderr)
+    print(f"orbital_max_dim={layout.max_dim}", file=sys.stderr)
+
+    orbital_completion = complete_orbitals(parsed_config, space_group_representations)
+    atom_orbital_vectors = orbital_completion["updated_orbital_vectors"]
+    repr_on_active_orbitals = orbital_completion["representations_on_active_orbitals"]
+
+    print(f"atom_orbital_vectors={atom_orbital_vectors}", file=sys.stderr)
+    print(f"added_orbitals_dict={orbital_completion['added_orbitals']}", file=sys.stderr)
+
+    # Verify and report results (debugging output)
+    for atom_name, repr_matrices in repr_on_active_orbitals.items():
+        if repr_matrices.size > 0:
+            print(f"\nAtom {atom_name}:", file=sys.stderr)
+            print(f"  Number of symmetry operations: {repr_matrices.shape[0]}", file=sys.stderr)
+            print(f"  Representation matrix dimension: {repr_matrices.shape[1]}x{repr_matrices.shape[2]}", file=sys.stderr)
+
+            # Get the orbital names for this atom
+            active_indices = np.where(atom_orbital_vectors[atom_name] == 1)[0]
+            active_orbital_names = [layout.orbital_names[idx] for idx in active_indices]
+            print(f"  Active orbitals: {active_orbital_names}", file=sys.stderr)
+        else:
+            print(f"Atom {atom_name}: No active orbitals", file=sys.stderr)
+
+    if handoff_dir is not None:
+        # Write NumPy arrays to the handoff directory
+        write_stage(handoff_dir, "complete_orbitals", orbital_completion)
+    else:
+        # Output as JSON to stdout
+        print(json.dumps(orbital_completion_to_json(orbital_completion)), file=sys.stdout)
@@ -0,0 +1,247 @@
+import numpy as np
+from dataclasses import dataclass
+
+# ==============================================================================
+# Group structure of a space group modulo lattice translations
+# ==============================================================================
+# The operations of a space group, written in the primitive cell basis, have
+# integer rotation matrices and translations that are multiples of 1/24
+# (all crystallographic screw and glide translations are). Each operation is
+# stored exactly as integers: rotation R (3x3) and translation t*24 reduced
+# modulo 24. Composition is then integer arithmetic,
+#   (R1|t1)(R2|t2) = (R1 R2 | R1 t2 + t1),
+# and every product is matched to an operation of the list.
+#
+# Operations that differ by a lattice vector (e.g. the centering translations
+# of the Bilbao conventional-cell listing, which are lattice vectors of the
+# primitive cell) are the same element modulo the lattice; the tables always
+# refer to the first of them (its representative).
+#
+# The structure is computed once per space group (stage
+# space_group_representations); afterwards composing operations, inverting
+# them and finding conjugacy classes are table lookups. The stage stores no
+# structure when the operations are not exact in the primitive basis (e.g. a
+# lattice given with few digits); it is then built, or the error raised, only
+# when the symmetry helpers ask for it (structure_of_representations()).
+
+# Translations are snapped to multiples of 1/translation_denominator
+translation_denominator = 24
+# Tolerance when snapping floating-point matrices to integers
+snap_tolerance = 1e-6
+
+
+@dataclass
+class SpaceGroupStructure:
+    """
+    Multiplication table, inverses, element orders and conjugacy classes of a space group
+
+    All indices refer to the operations in the order they were given.
+    Tables hold representative indices (first operation equal modulo the lattice).
+
+    rotations: (num_ops, 3, 3) integer rotation matrices in primitive basis
+    translations: (num_ops, 3) translations in units of 1/translation_denominator, in [0, translation_denominator)
+    representatives: (num_ops,) index of the first operation equal modulo the lattice
+    multiplication_table: (num_ops, num_ops) index of op_i @ op_j modulo the lattice
+    product_lattice_shifts: (num_ops, num_ops, 3) lattice vector L with op_i @ op_j = (1|L) @ op_table[i, j]
+    inverses: (num_ops,) index of the inverse modulo the lattice
+    identity: index of the identity operation
+    element_orders: (num_ops,) smallest k with op^k = identity modulo the lattice
+    conjugacy_classes: (num_ops,) conjugacy class label of each operation (0, 1, ... in order of appearance)
+    """
+    rotations: np.ndarray
+    translations: np.ndarray
+    representatives: np.ndarray
+    multiplication_table: np.ndarray
+    product_lattice_shifts: np.ndarray
+    inverses: np.ndarray
+    identity: int
+    element_orders: np.ndarray
+    conjugacy_classes: np.ndarray
+
+    def multiply(self, i, j):
+        """
+        Index of op_i @ op_j modulo the lattice (i, j may be integer arrays)
+        """
+        return self.multiplication_table[i, j]
+
+    def inverse(self, i):
+        """
+        Index of the inverse of op_i modulo the lattice (i may be an integer array)
+        """
+        return self.inverses[i]
+
+    def num_conjugacy_classes(self):
+        """
+        Number of conjugacy classes of the group modulo the lattice
+        """
+        return int(self.conjugacy_classes.max()) + 1 if len(self.conjugacy_classes) else 0
+
+    def conjugacy_class_members(self, label):
+        """
+        Representative indices of the operations in conjugacy class label
+        """
+        members = np.nonzero(self.conjugacy_classes == label)[0]
+        return members[self.representatives[members] == members]
+
+    def to_arrays(self):
+        """
+        Dictionary of arrays for a handoff directory or the stage cache
+        """
+        return {
+            "rotations": self.rotations,
+            "translations": self.translations,
+            "representatives": self.representatives,
+            "multiplication_table": self.multiplication_table,
+            "product_lattice_shifts": self.product_lattice_shifts,
+            "inverses": self.inverses,
+            "identity": self.identity,
+            "element_orders": self.element_orders,
+            "conjugacy_classes": self.conjugacy_classes,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        Rebuild the structure from the output of to_arrays()
+        """
+        fields = {key: np.asarray(value) for key, value in arrays.items() if key != "identity"}
+        fields["identity"] = int(arrays["identity"])
+        return cls(**fields)
+
+
+# ==============================================================================
+# STEP 1: Define exact integer form of the operations
+# ==============================================================================
+def snap_operations(space_group_matrices_primitive):
+    """
+    Convert affine operations in primitive basis to exact integers
+
+    :param space_group_matrices_primitive: Space group matrices (affine) in primitive cell basis, shape (num_ops, 3, 4)
+    :return: tuple: (rotations (num_ops, 3, 3) int64,
+                     translations (num_ops, 3) int64 in units of 1/translation_denominator, reduced modulo 1)
+    :raises ValueError: If a rotation is not integer or a translation is not a multiple of 1/translation_denominator
+    """
+    matrices = np.asarray(space_group_matrices_primitive, dtype=float)
+
+    rotations = np.rint(matrices[:, :, 0:3])
+    if np.any(np.abs(matrices[:, :, 0:3] - rotations) > snap_tolerance):
+        raise ValueError("space group rotations are not integer in the primitive cell basis; "
+                         "check that lattice_basis is compatible with the space group")
+
+    scaled_translations = matrices[:, :, 3] * translation_denominator
+    translations = np.rint(scaled_translations)
+    if np.any(np.abs(scaled_translations - translations) > snap_tolerance * translation_denominator):
+        raise ValueError(f"space group translations are not multiples of 1/{translation_denominator} "
+                         f"in the primitive cell basis")
+
+    return rotations.astype(np.int64), np.mod(translations.astype(np.int64), translation_denominator)
+
+
+def operation_keys(rotations, translations, rotation_bound):
+    """
+    Encode exact operations as single integers (mixed radix)
+
+    :param rotations: Integer rotations, shape (..., 3, 3), entries in [-rotation_bound, rotation_bound]
+    :param translations: Reduced integer translations, shape (..., 3)
+    :param rotation_bound: Largest absolute rotation entry
+    :return: int64 keys, shape (...)
+    """
+    radix = 2 * rotation_bound + 1
+    keys = np.zeros(rotations.shape[:-2], dtype=np.int64)
+    for digit in (rotations + rotation_bound).reshape(rotations.shape[:-2] + (9,)).transpose():
+        keys = keys * radix + digit.transpose()
+    for digit in translations.transpose():
+        keys = keys * translation_denominator + digit.transpose()
+    return keys
+
+
+# ==============================================================================
+# STEP 2: Define construction of the group structure
+# ==============================================================================
+def build_group_structure(space_group_matrices_primitive):
+    """
+    Build the group structure of a space group from its operations in primitive basis
+
+    :param space_group_matrices_primitive: Space group matrices (affine) in primitive cell basis, shape (num_ops, 3, 4)
+    :return: SpaceGroupStructure
+    :raises ValueError: If the operations are not exact in the primitive basis or do not form a group
+    """
+    rotations, translations = snap_operations(space_group_matrices_primitive)
+    num_ops = len(rotations)
+    rotation_bound = int(np.abs(rotations).max()) if num_ops else 0
+
+    # Representative of each operation: first operation with the same key
+    keys = operation_keys(rotations, translations, rotation_bound)
+    sorted_keys, first_index, key_inverse = np.unique(keys, return_index=True, return_inverse=True)
+    representatives = first_index[key_inverse.reshape(-1)]
+
+    # All products op_i @ op_j at once
+    product_rotations = np.einsum('iab,jbc->ijac', rotations, rotations)
+    product_translations_raw = np.einsum('iab,jb->ija', rotations, translations) + translations[:, np.newaxis, :]
+    product_translations = np.mod(product_translations_raw, translation_denominator)
+
+    if num_ops and np.abs(product_rotations).max() > rotation_bound:
+        raise ValueError("space group operations are not closed under multiplication")
+    product_keys = operation_keys(product_rotations, product_translations, rotation_bound)
+    positions = np.searchsorted(sorted_keys, product_keys)
+    positions = np.minimum(positions, len(sorted_keys) - 1)
+    if np.any(sorted_keys[positions] != product_keys):
+        raise ValueError("space group operations are not closed under multiplication")
+    multiplication_table = first_index[positions].astype(np.int32)
+
+    # Lattice part of each product relative to the tabulated operation
+    product_lattice_shifts = (product_translations_raw - translations[multiplication_table]) // translation_denominator
+
+    # Identity
+    identity_key = operation_keys(np.eye(3, dtype=np.int64), np.zeros(3, dtype=np.int64), rotation_bound)
+    identity_candidates = np.nonzero(keys == identity_key)[0]
+    if len(identity_candidates) == 0:
+        raise ValueError("space group operations do not contain the identity")
+    identity = int(identity_candidates[0])
+
+    # Inverses: op_i @ op_j = identity
+    inverses = np.argmax(multiplication_table == identity, axis=1).astype(np.int32)
+
+    # Element orders: smallest k with op^k = identity
+    element_orders = np.zeros(num_ops, dtype=np.int32)
+    power = representatives.copy()
+    for k in range(1, num_ops + 1):
+        element_orders[(power == identity) & (element_orders == 0)] = k
+        if np.all(element_orders > 0):
+            break
+        power = multiplication_table[power, representatives]
+
+    # Conjugacy classes: h g h^(-1) for all h, labelled by the smallest member
+    conjugates = multiplication_table[multiplication_table, inverses[:, np.newaxis]]
+    class_minimum = conjugates.min(axis=0)
+    _, class_first, class_labels = np.unique(class_minimum, return_index=True, return_inverse=True)
+    # Relabel in order of appearance
+    relabel = np.empty(len(class_first), dtype=np.int32)
+    relabel[np.argsort(class_first, kind="stable")] = np.arange(len(class_first), dtype=np.int32)
+    conjugacy_classes = relabel[class_labels.reshape(-1)]
+
+    return SpaceGroupStructure(
+        rotations=rotations,
+        translations=translations,
+        representatives=representatives,
+        multiplication_table=multiplication_table,
+        product_lattice_shifts=product_lattice_shifts,
+        inverses=inverses,
+        identity=identity,
+        element_orders=element_orders,
+        conjugacy_classes=conjugacy_classes,
+    )
+
+
+def structure_of_representations(space_group_representations):
+    """
+    Group structure of a space_group_representations stage output
+
+    :param space_group_representations: Output of generate_space_group_representations()
+    :return: SpaceGroupStructure, built from space_group_matrices_primitive if the stage stored none
+    :raises ValueError: If the operations are not exact in the primitive basis or do not form a group
+    """
+    arrays = space_group_representations.get("group_structure")
+    if arrays is not None:
+        return SpaceGroupStructure.from_arrays(arrays)
+    return build_group_structure(space_group_representations["space_group_matrices_primitive"])
@@ -0,0 +1,183 @@
+import numpy as np
+import hashlib
+
+# ==============================================================================
+# Real spherical harmonic representations for arbitrary angular momentum l
+# ==============================================================================
+# Orbitals of angular momentum l transform like the real solid harmonics
+# C_lm, S_lm (m = 0..l) of degree l. They are generated here by the standard
+# recursion of the regular solid harmonics (Racah normalization, no
+# Condon-Shortley phase):
+#   C_00 = 1, S_00 = 0
+#   C_(m+1)(m+1) = sqrt((2m+1)/(2m+2)) * (x*C_mm - y*S_mm)
+#   S_(m+1)(m+1) = sqrt((2m+1)/(2m+2)) * (y*C_mm + x*S_mm)
+#   C_(l+1)m = ((2l+1)*z*C_lm - sqrt((l+m)(l-m))*r²*C_(l-1)m) / sqrt((l+m+1)(l-m+1))
+# and likewise for S_(l+1)m. Components with m > 0 are multiplied by sqrt(2),
+# which makes all 2l+1 functions orthonormal over the sphere (up to a common factor).
+#
+# The representation matrix of a rotation R follows the convention of
+# space_group_representation_orbitals_all() in generate_space_group_representations.py:
+#   Y_j(R^T r) = sum_i D_ij Y_i(r)
+# It is obtained by evaluating the harmonics on a fixed set of sample points
+# and on the rotated points, and solving the (overdetermined) linear system
+# with a precomputed pseudo-inverse. All operations are handled in one batch.
+#
+# For l <= 3 the component order and normalization reproduce the hand-derived
+# bases of generate_space_group_representations.py (p: x, y, z; d: dxy, dyz,
+# dzx, d(x²-y²), d(3z²-r²); f: fz³, fxz², fyz², fxyz, fz(x²-y²), fx(x²-3y²),
+# fy(3x²-y²)), see verify_real_harmonics.py. For l >= 4 the order is
+# C_0, C_1, S_1, ..., C_l, S_l with orthonormal normalization.
+
+# Component order and scale of the orbital basis for each l:
+# list of (kind, m, scale) with kind "C" or "S", scale relative to the orthonormal harmonic
+orbital_components = {
+    0: [("C", 0, 1.0)],
+    1: [("C", 1, 1.0), ("S", 1, 1.0), ("C", 0, 1.0)],
+    2: [("S", 2, 1.0), ("S", 1, 1.0), ("C", 1, 1.0), ("C", 2, 1.0), ("C", 0, 1.0)],
+    3: [("C", 0, 1/np.sqrt(15)), ("C", 1, np.sqrt(2/15)), ("S", 1, np.sqrt(2/15)), ("S", 2, 1/np.sqrt(15)),
+        ("C", 2, 1/np.sqrt(15)), ("C", 3, np.sqrt(2/15)), ("S", 3, np.sqrt(2/15))],
+}
+
+# Representations already computed in this process:
+# (checksum of the rotation stack, l) -> read-only array of shape (num_ops, 2l+1, 2l+1)
+_representation_cache = {}
+max_cached_representations = 256
+
+# Sample points and pseudo-inverse of the harmonics on them, per l
+_sample_fits = {}
+
+
+# ==============================================================================
+# STEP 1: Define evaluation of real solid harmonics
+# ==============================================================================
+def harmonic_components(l):
+    """
+    Component order and scales of the orbital basis for angular momentum l
+
+    :param l: Angular momentum quantum number (l >= 0)
+    :return: List of (kind, m, scale), kind is "C" (cosine type) or "S" (sine type)
+    """
+    if l < 0:
+        raise ValueError(f"angular momentum must be non-negative, got {l}")
+    if l in orbital_components:
+        return orbital_components[l]
+
+    components = [("C", 0, 1.0)]
+    for m in range(1, l + 1):
+        components += [("C", m, 1.0), ("S", m, 1.0)]
+    return components
+
+
+def real_solid_harmonics(points, l):
+    """
+    Evaluate the real solid harmonics of degree l in the orbital basis order
+
+    :param points: Cartesian points, shape (..., 3)
+    :param l: Angular momentum quantum number (l >= 0)
+    :return: Harmonic values, shape (..., 2l+1)
+    """
+    points = np.asarray(points, dtype=float)
+    x, y, z = points[..., 0], points[..., 1], points[..., 2]
+    r2 = x*x + y*y + z*z
+
+    # C[m], S[m] of the current degree and of the previous degree
+    C, S = [np.ones_like(x)], [np.zeros_like(x)]
+    C_prev, S_prev = [], []
+    for degree in range(l):
+        C_next, S_next = [], []
+        for m in range(degree + 1):
+            a = np.sqrt((degree + m + 1) * (degree - m + 1))
+            b = np.sqrt((degree + m) * (degree - m))
+            C_m = (2*degree + 1) * z * C[m]
+            S_m = (2*degree + 1) * z * S[m]
+            if m < degree:
+                C_m = C_m - b * r2 * C_prev[m]
+                S_m = S_m - b * r2 * S_prev[m]
+            C_next.append(C_m / a)
+            S_next.append(S_m / a)
+
+        # Sectoral harmonics m = degree + 1
+        f = np.sqrt((2*degree + 1) / (2*degree + 2))
+        C_next.append(f * (x * C[degree] - y * S[degree]))
+        S_next.append(f * (y * C[degree] + x * S[degree]))
+
+        C_prev, S_prev = C, S
+        C, S = C_next, S_next
+
+    values = []
+    for kind, m, scale in harmonic_components(l):
+        component = C[m] if kind == "C" else S[m]
+        if m > 0:
+            scale = scale * np.sqrt(2)
+        values.append(scale * component)
+
+    return np.stack(values, axis=-1)
+
+
+# ==============================================================================
+# STEP 2: Define the batched representation engine
+# ==============================================================================
+def _sample_fit(l):
+    """
+    Fixed sample points on the unit sphere and pseudo-inverse of the harmonics on them
+
+    Points form a Fibonacci lattice with twice as many points as components,
+    which keeps the least-squares system well conditioned.
+
+    :param l: Angular momentum quantum number
+    :return: tuple: (points (num_points, 3), pinv (2l+1, num_points))
+    """
+    fit = _sample_fits.get(l)
+    if fit is not None:
+        return fit
+
+    num_points = 2 * (2*l + 1) + 1
+    k = np.arange(num_points) + 0.5
+    z = 1 - 2 * k / num_points
+    phi = np.pi * (1 + np.sqrt(5)) * k
+    rho = np.sqrt(1 - z*z)
+    points = np.stack([rho * np.cos(phi), rho * np.sin(phi), z], axis=-1)
+
+    fit = (points, np.linalg.pinv(real_solid_harmonics(points, l)))
+    _sample_fits[l] = fit
+    return fit
+
+
+def real_harmonic_representation(rotations, l):
+    """
+    Representation matrices of a stack of rotations on the orbitals of angular momentum l
+
+    Results are cached per (rotation stack, l); the returned array is read-only.
+
+    :param rotations: Linear parts of the operations in Cartesian basis, shape (num_ops, 3, 3) or (3, 3)
+    :param l: Angular momentum quantum number (l >= 0)
+    :return: Representation matrices, shape (num_ops, 2l+1, 2l+1) (or (2l+1, 2l+1) for one rotation)
+    """
+    rotations = np.ascontiguousarray(rotations, dtype=float)
+    key = (hashlib.sha1(rotations.tobytes()).hexdigest(), rotations.shape, l)
+    cached = _representation_cache.get(key)
+    if cached is not None:
+        return cached
+
+    points, pinv = _sample_fit(l)
+
+    # Harmonics on the rotated points R^T r (rows r @ R) for all operations at once
+    rotated_points = points @ rotations
+    representation = pinv @ real_solid_harmonics(rotated_points, l)
+    representation.setflags(write=False)
+
+    if len(_representation_cache) >= max_cached_representations:
+        _representation_cache.pop(next(iter(_representation_cache)))
+    _representation_cache[key] = representation
+    return representation
+
+
+def real_harmonic_representations(rotations, l_max):
+    """
+    Representation matrices for all angular momenta 0..l_max
+
+    :param rotations: Linear parts of the operations in Cartesian basis, shape (num_ops, 3, 3)
+    :param l_max: Largest angular momentum
+    :return: List of l_max+1 arrays, entry l of shape (num_ops, 2l+1, 2l+1)
+    """
+    return [real_harmonic_representation(rotations, l) for l in range(l_max + 1)]
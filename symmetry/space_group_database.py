@@ -0,0 +1,235 @@
+import numpy as np
+import sys
+import os
+import re
+from math import gcd
+
+# Make the repository root importable when this file is run as a script
+if __package__ in (None, ""):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pipeline.stage_cache import default_cache_dir, file_sha256
+
+# ==============================================================================
+# Compiled, pre-indexed form of read_only/space_group_matrices_Bilbao.txt
+# ==============================================================================
+# The text database is parsed once into packed integer arrays:
+#   rotations               (total_ops, 3, 3) int8   linear parts [R]
+#   translation_numerators  (total_ops, 3)    int16  numerators of [t]
+#   translation_denominator (total_ops, 3)    int16  denominators of [t] (reduced, >= 1)
+#   offsets                 (232,)            int64  operations of group n are
+#                                                    offsets[n]:offsets[n+1]
+#   source_sha256           ()                str    checksum of the text file
+#
+# The compiled .npz lives in the preprocessing cache directory and is rebuilt
+# automatically whenever the checksum of the text file changes. Looking up a
+# space group is then a slice.
+#
+# usage: python space_group_database.py [/path/to/space_group_matrices_Bilbao.txt]
+#        (re)builds the compiled database
+
+num_space_groups = 230
+
+# Loaded databases in this process: compiled file path -> (source checksum, arrays)
+_loaded_databases = {}
+
+
+# ==============================================================================
+# STEP 1: Define parser of the text database
+# ==============================================================================
+def removeCommentsAndEmptyLines(file):
+    """
+    Remove comments and empty lines from file
+
+    Comments start with # and continue to end of line
+
+    :param file: File path
+    :return: List of cleaned lines (comments and empty lines removed)
+    """
+    with open(file, "r") as fptr:
+        lines = fptr.readlines()
+
+    linesToReturn = []
+    for oneLine in lines:
+        # Remove comments (everything after #) and strip whitespace
+        oneLine = re.sub(r'#.*$', '', oneLine).strip()
+        if oneLine:  # Only add non-empty lines
+            linesToReturn.append(oneLine)
+
+    return linesToReturn
+
+
+def compile_space_group_database(in_space_group_file):
+    """
+    Parse all space groups of the text database into exact integer arrays
+
+    The file contains space group operations in affine matrix form:
+    [ R | t ] where R is 3x3 rotation/reflection and t is 3x1 translation
+    Stored as 3x4 matrices flattened row-wise, after a header "_<space_group_num>_ <num_matrices>"
+
+    :param in_space_group_file: File containing matrices of all space groups
+    :return: Dictionary of arrays (see module header)
+    :raises ValueError: If the file is malformed or a space group is missing
+    """
+    contents = removeCommentsAndEmptyLines(in_space_group_file)
+
+    # Space group header: "_<space_group_num>_ <num_matrices>"
+    space_group_pattern = re.compile(r'_(\d+)_\s+(\d+)')
+    # Matrix element: integer or fraction like "1/2", "-1/2"
+    matrix_elem_pattern = re.compile(r'([+-]?\d+(?:/\d+)?)')
+
+    group_ops = {}
+    line_num = 0
+    while line_num < len(contents):
+        match_space_group = space_group_pattern.match(contents[line_num])
+        if not match_space_group:
+            line_num += 1
+            continue
+
+        sgn = int(match_space_group.group(1))
+        num_matrices = int(match_space_group.group(2))
+
+        ops = []
+        for matrix_idx in range(num_matrices):
+            matrix_line = contents[line_num + matrix_idx + 1]
+            elements = matrix_elem_pattern.findall(matrix_line)
+            if len(elements) != 12:
+                raise ValueError(f"Expected 12 elements, got {len(elements)} in line: {matrix_line}")
+
+            # Each element as an exact (numerator, denominator) pair
+            fractions = []
+            for one_elem in elements:
+                if "/" in one_elem:
+                    numerator, denominator = (int(x) for x in one_elem.split("/"))
+                else:
+                    numerator, denominator = int(one_elem), 1
+                divisor = gcd(numerator, denominator)
+                fractions.append((numerator // divisor, denominator // divisor))
+            ops.append(np.array(fractions, dtype=np.int64).reshape((3, 4, 2)))
+
+        group_ops[sgn] = ops
+        line_num += num_matrices + 1
+
+    missing = [sgn for sgn in range(1, num_space_groups + 1) if sgn not in group_ops]
+    if missing:
+        raise ValueError(f"Space groups {missing} not found in {in_space_group_file}")
+
+    offsets = np.zeros(num_space_groups + 2, dtype=np.int64)
+    for sgn in range(1, num_space_groups + 1):
+        offsets[sgn + 1] = offsets[sgn] + len(group_ops[sgn])
+
+    all_ops = np.concatenate([np.array(group_ops[sgn]) for sgn in range(1, num_space_groups + 1)])
+
+    # The linear part must be integer
+    if np.any(all_ops[:, :, 0:3, 1] != 1):
+        raise ValueError(f"Non-integer rotation matrix element in {in_space_group_file}")
+
+    return {
+        "rotations": all_ops[:, :, 0:3, 0].astype(np.int8),
+        "translation_numerators": all_ops[:, :, 3, 0].astype(np.int16),
+        "translation_denominators": all_ops[:, :, 3, 1].astype(np.int16),
+        "offsets": offsets,
+        "source_sha256": np.array(file_sha256(os.path.abspath(in_space_group_file)))
+    }
+
+
+# ==============================================================================
+# STEP 2: Define loading with checksum-triggered rebuild
+# ==============================================================================
+def compiled_database_path(in_space_group_file):
+    """
+    Location of the compiled database for a text database file
+
+    :param in_space_group_file: File containing matrices of all space groups
+    :return: Path of the .npz file in the preprocessing cache directory
+    """
+    base_name = os.path.splitext(os.path.basename(in_space_group_file))[0]
+    return os.path.join(default_cache_dir, base_name + ".npz")
+
+
+def load_space_group_database(in_space_group_file, compiled_file=None):
+    """
+    Load the compiled database, rebuilding it if the text source changed
+
+    :param in_space_group_file: File containing matrices of all space groups
+    :param compiled_file: Path of the compiled .npz (default: compiled_database_path())
+    :return: Dictionary of arrays (see module header)
+    """
+    in_space_group_file = os.path.abspath(in_space_group_file)
+    if compiled_file is None:
+        compiled_file = compiled_database_path(in_space_group_file)
+
+    source_checksum = file_sha256(in_space_group_file)
+
+    # Already loaded in this process
+    loaded = _loaded_databases.get(compiled_file)
+    if loaded is not None and loaded[0] == source_checksum:
+        return loaded[1]
+
+    database = None
+    if os.path.exists(compiled_file):
+        with np.load(compiled_file, allow_pickle=False) as npz:
+            if str(npz["source_sha256"]) == source_checksum:
+                database = {key: npz[key] for key in npz.files}
+
+    if database is None:
+        database = compile_space_group_database(in_space_group_file)
+        os.makedirs(os.path.dirname(compiled_file), exist_ok=True)
+        tmp_file = f"{compiled_file}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_file, **database)
+        os.replace(tmp_file, compiled_file)
+
+    _loaded_databases[compiled_file] = (source_checksum, database)
+    return database
+
+
+# ==============================================================================
+# STEP 3: Define space group lookup
+# ==============================================================================
+def read_space_group_exact(in_space_group_file, space_group_num):
+    """
+    Exact space group operations in Bilbao basis
+
+    :param in_space_group_file: File containing matrices of all space groups
+    :param space_group_num: Space group number (1-230)
+    :return: tuple: (rotations, translation_numerators, translation_denominators)
+             with shapes (num_ops, 3, 3), (num_ops, 3), (num_ops, 3), all integer
+    :raises ValueError: If space_group_num is not in 1-230
+    """
+    if not 1 <= space_group_num <= num_space_groups:
+        raise ValueError(f"Space group {space_group_num} not found in {in_space_group_file}")
+
+    database = load_space_group_database(in_space_group_file)
+    start, stop = database["offsets"][space_group_num], database["offsets"][space_group_num + 1]
+    return (database["rotations"][start:stop],
+            database["translation_numerators"][start:stop],
+            database["translation_denominators"][start:stop])
+
+
+def read_space_group(in_space_group_file, space_group_num):
+    """
+    Read space group symmetry operations from database file
+
+    Stored as 3x4 matrices: [R11 R12 R13 t1]
+                           [R21 R22 R23 t2]
+                           [R31 R32 R33 t3]
+
+    :param in_space_group_file: File containing matrices of all space groups
+    :param space_group_num: Space group number (1-230)
+    :return: Space group matrices (affine) for space_group_num, shape (num_ops, 3, 4)
+    """
+    rotations, numerators, denominators = read_space_group_exact(in_space_group_file, space_group_num)
+
+    space_group_matrices = np.zeros((len(rotations), 3, 4))
+    space_group_matrices[:, :, 0:3] = rotations
+    space_group_matrices[:, :, 3] = numerators / denominators
+    return space_group_matrices
+
+
+if __name__ == "__main__":
+    repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    source_file = sys.argv[1] if len(sys.argv) > 1 else \
+        os.path.join(repo_root, "read_only", "space_group_matrices_Bilbao.txt")
+    database = load_space_group_database(source_file)
+    print(f"{compiled_database_path(source_file)}: "
+          f"{len(database['rotations'])} operations in {num_space_groups} space groups")
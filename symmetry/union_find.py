@@ -0,0 +1,96 @@
+import numpy as np
+
+# ==============================================================================
+# Union-find (disjoint set) over integer labels 0..size-1
+# ==============================================================================
+# Used to reduce symmetry coupling graphs to connected components, e.g. the
+# orbitals mixed by the operations of a space group (complete_orbitals.py).
+#
+# The parent array is a NumPy array. Single unions and finds work on scalars;
+# union_edges() merges a whole edge list at once by repeated vectorized
+# hooking of the larger root onto the smaller one, so the root of every
+# component is its smallest member and results do not depend on edge order.
+
+
+class UnionFind:
+    """
+    Disjoint sets of the integers 0..size-1, each represented by its smallest member
+
+    :param size: Number of elements
+    """
+
+    def __init__(self, size):
+        self.parent = np.arange(size, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.parent)
+
+    def find(self, i):
+        """
+        Root (smallest member) of the set containing i, with path halving
+        """
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return int(i)
+
+    def union(self, i, j):
+        """
+        Merge the sets containing i and j
+
+        :return: True if the sets were different
+        """
+        root_i, root_j = self.find(i), self.find(j)
+        if root_i == root_j:
+            return False
+        if root_i < root_j:
+            self.parent[root_j] = root_i
+        else:
+            self.parent[root_i] = root_j
+        return True
+
+    def union_edges(self, i, j):
+        """
+        Merge the sets of all pairs (i[k], j[k]) at once
+
+        :param i: Integer array of first endpoints
+        :param j: Integer array of second endpoints (same length as i)
+        """
+        i = np.asarray(i, dtype=np.int64).reshape(-1)
+        j = np.asarray(j, dtype=np.int64).reshape(-1)
+        while len(i):
+            roots = self.roots()
+            root_i, root_j = roots[i], roots[j]
+            different = root_i != root_j
+            if not np.any(different):
+                break
+            low = np.minimum(root_i[different], root_j[different])
+            high = np.maximum(root_i[different], root_j[different])
+            # Hook every larger root onto the smallest root it is joined with
+            np.minimum.at(self.parent, high, low)
+            i, j = i[different], j[different]
+
+    def roots(self):
+        """
+        Root of every element (fully compresses the parent array)
+
+        :return: Integer array of shape (size,)
+        """
+        parent = self.parent
+        grandparent = parent[parent]
+        while np.any(grandparent != parent):
+            parent = grandparent
+            grandparent = parent[parent]
+        self.parent = parent
+        return parent.copy()
+
+    def labels(self):
+        """
+        Component label of every element, numbered 0, 1, ... in order of the smallest members
+
+        :return: tuple: (labels of shape (size,), number of components)
+        """
+        roots = self.roots()
+        unique_roots, labels = np.unique(roots, return_inverse=True)
+        return labels.reshape(-1), len(unique_roots)
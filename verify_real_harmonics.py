@@ -0,0 +1,44 @@
+import numpy as np
+
+from symmetry.generate_space_group_representations import (
+    space_group_representation_D_orbitals, space_group_representation_F_orbitals,
+    space_group_to_cartesian_basis, default_space_group_file)
+from symmetry.space_group_database import read_space_group
+from symmetry.real_spherical_harmonics import real_harmonic_representation
+
+# Check the general real-harmonic engine (symmetry/real_spherical_harmonics.py)
+# against the hand-derived p, d and f representations, and check that the
+# matrices for higher l form orthogonal representations.
+# usage: python verify_real_harmonics.py
+
+tol = 1e-12
+
+# Random orthogonal matrices (proper and improper rotations)
+np.random.seed(42)
+random_matrices = np.random.randn(500, 3, 3)
+R_random, _ = np.linalg.qr(random_matrices)
+
+# Cubic space groups: the Bilbao basis is Cartesian
+R_cubic = np.concatenate([
+    space_group_to_cartesian_basis(read_space_group(default_space_group_file, n), np.eye(3))[:, :3, :3]
+    for n in range(195, 231)
+])
+
+for name, R in [("random", R_random), ("cubic groups", R_cubic)]:
+    err_s = np.abs(real_harmonic_representation(R, 0) - 1).max()
+    err_p = np.abs(real_harmonic_representation(R, 1) - R).max()
+    err_d = np.abs(real_harmonic_representation(R, 2) - space_group_representation_D_orbitals(R)).max()
+    err_f = np.abs(real_harmonic_representation(R, 3) - space_group_representation_F_orbitals(R)).max()
+    print(f"{name}: max |engine - kernel| s={err_s:.2e} p={err_p:.2e} d={err_d:.2e} f={err_f:.2e}")
+    assert max(err_s, err_p, err_d, err_f) < tol
+
+# Higher l: orthogonality and D(R1 @ R2) = D(R1) @ D(R2)
+for l in range(4, 9):
+    D = real_harmonic_representation(R_random, l)
+    D_product = real_harmonic_representation(R_random[:-1] @ R_random[1:], l)
+    err_orth = np.abs(D @ np.swapaxes(D, -1, -2) - np.eye(2*l + 1)).max()
+    err_hom = np.abs(D_product - D[:-1] @ D[1:]).max()
+    print(f"l={l}: max |D D^T - I|={err_orth:.2e}, max |D(R1 R2) - D(R1) D(R2)|={err_hom:.2e}")
+    assert max(err_orth, err_hom) < tol
+
+print("all checks passed")